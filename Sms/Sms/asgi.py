@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The Server-Sent Events endpoint (/api/events/) is only served here, e.g.
+``uvicorn Sms.asgi:application``. Set SMS_ASYNC_READ_VIEWS=1 to also serve
+the async read views (see ASYNC_READ_VIEWS in settings).
 """
 
 import os
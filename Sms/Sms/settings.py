@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -47,6 +48,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Outermost after security, so it sees the final body
+    'user.middleware.CompressionMiddleware',
+    'user.middleware.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,9 +58,34 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'user.middleware.CustomHookMiddleware',
+    'user.middleware.RequestTimingMiddleware',
 ]
 
+# Per-request timing (Server-Timing header + per-view latency histograms).
+# SAMPLE_RATE is the fraction of requests that are measured.
+REQUEST_TIMING = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+}
+
+# Response compression: zstd, br or gzip as the client accepts (br and zstd
+# need the brotli and zstandard packages). MIN_SIZE is in bytes.
+RESPONSE_COMPRESSION = {
+    'ENABLED': True,
+    'MIN_SIZE': 1024,
+}
+
+# Bulk user provisioning: processes used to hash passwords (None = one per core)
+PROVISIONING_HASH_WORKERS = None
+
+# Audit log: events are queued and written in batches by a background thread
+AUDIT_LOG = {
+    'ASYNC': True,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL_MS': 500,
+}
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
@@ -65,10 +94,30 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.CachedJWTAuthentication',
+    ),
+    # Opt-in: only applies when the client sends ?cursor= or ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'user.pagination.KeysetPagination',
+    # orjson when installed, DRF's stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'user.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'user.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 }
 
+# Keyset pagination
+PAGINATION_PAGE_SIZE = 50
+PAGINATION_MAX_PAGE_SIZE = 500
+
+# Marks analytics
+MARKS_PASS_MARK = 40
+MARKS_STATS_CACHE_TIMEOUT = 60 * 60
+
 # JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -89,6 +138,53 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# Response cache for the read-heavy list endpoints (notices, subjects,
+# assignments). locmem culls least-recently-used entries past MAX_ENTRIES.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Server-Sent Events at /api/events/ (ASGI only). InProcessBroker suits a
+# single worker; use user.events.DatabaseBroker to relay between workers.
+PUSH_EVENTS = {
+    'BACKEND': 'user.events.InProcessBroker',
+    'QUEUE_SIZE': 100,  # events a slow client may fall behind before it is dropped
+    'HISTORY_SIZE': 1000,  # events kept for Last-Event-ID replay
+    'HEARTBEAT': 15,  # seconds between keep-alive comments
+    'STREAM_TOKEN_LIFETIME': 60,  # seconds a ?token= from /api/events/token/ can open a stream
+}
+
+# Background jobs (user.jobs), run by `manage.py run_jobs`. QUEUES caps how
+# many jobs of each queue run at once across all workers. Exports and bulk
+# marks answer 202 with a job when the client sends `Prefer: respond-async`.
+JOB_QUEUE = {
+    'QUEUES': {'default': 4, 'exports': 2},
+    'POLL_INTERVAL_MS': 1000,
+    'LEASE': 60,  # seconds before a job whose worker went silent is retried
+    'BACKOFF': 5,  # seconds before the first retry, doubling for each retry after
+    'MAX_BACKOFF': 3600,
+    'RETENTION': 7 * 24 * 60 * 60,  # seconds finished jobs and their export files are kept
+}
+
+# Cache of the user rows behind JWT-authenticated requests. Point CACHE at a
+# cache shared by all workers, or a change to a user reaches the other
+# workers' copies only when TTL runs out.
+JWT_USER_CACHE = {
+    'CACHE': 'default',
+    'TTL': 300,  # seconds
+}
+
 
 ROOT_URLCONF = 'Sms.urls'
 
@@ -110,18 +206,51 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Sms.wsgi.application'
+ASGI_APPLICATION = 'Sms.asgi.application'
+
+# Async list/retrieve for notices, subjects, assignments and marks
+# (user.mixins.AsyncReadMixin). Opt-in with SMS_ASYNC_READ_VIEWS=1 under ASGI
+# until it measures faster; under WSGI the async views would only add an
+# event loop hop per request.
+ASYNC_READ_VIEWS = os.environ.get('SMS_ASYNC_READ_VIEWS', '') == '1'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Production SQLite profile (user/sqlite.py): WAL and the pragmas below on
+# every connection, persistent connections, and BEGIN IMMEDIATE with
+# bounded retry for the write-heavy actions. Off unless SMS_SQLITE_TUNING=1.
+SQLITE_TUNING = {
+    'ENABLED': os.environ.get('SMS_SQLITE_TUNING', '') == '1',
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'MMAP_SIZE': 256 * 1024 * 1024,
+    'CACHE_SIZE': -64 * 1024,  # KiB
+    'BUSY_TIMEOUT_MS': 5000,
+    'TEMP_STORE': 'MEMORY',
+    'WRITE_RETRIES': 3,
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600 if SQLITE_TUNING['ENABLED'] else 0,
+        'CONN_HEALTH_CHECKS': SQLITE_TUNING['ENABLED'],
     }
 }
 
+# Read replicas: aliases in DATABASES that safe-method requests read from
+# (see user.db_router.ReplicaRouter). After a write, that user's requests
+# read from the primary for STICKY_SECONDS. Empty means everything uses
+# 'default'.
+DATABASE_ROUTERS = ['user.db_router.ReplicaRouter']
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 10,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -159,6 +288,26 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Submission and assignment files are deduplicated by content hash under
+# MEDIA_ROOT/blobs/ (user.storage); run gc_blobs to remove unreferenced ones.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'blobs': {'BACKEND': 'user.storage.ContentAddressedStorage'},
+}
+
+# Resumable uploads at /api/uploads/ (user.uploads). Chunks are stored under
+# MEDIA_ROOT/uploads/ until the session is finalized or purged.
+CHUNKED_UPLOADS = {
+    'CHUNK_SIZE': 5 * 1024 * 1024,  # default chunk size offered to clients
+    'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+    'MAX_FILE_SIZE': 2 * 1024 * 1024 * 1024,
+    'SESSION_TTL': 24 * 60 * 60,  # seconds before an unfinished upload is purged
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,39 @@
+"""
+Settings for the replica routing tests: a primary and a replica SQLite
+database, and a file-based cache shared by processes for the
+read-your-writes pins.
+
+    python manage.py test user.tests.ReplicaRoutingTests --settings=Sms.settings_replica
+"""
+import os
+import tempfile
+
+from Sms.settings import *  # noqa: F401,F403
+
+_TMP = tempfile.gettempdir()
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(_TMP, 'sms-primary.sqlite3'),
+        'TEST': {'NAME': os.path.join(_TMP, 'sms-test-primary.sqlite3')},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(_TMP, 'sms-replica.sqlite3'),
+        'TEST': {'NAME': os.path.join(_TMP, 'sms-test-replica.sqlite3')},
+    },
+}
+
+CACHES = {
+    **CACHES,  # noqa: F405
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(_TMP, 'sms-test-cache'),
+    },
+}
+
+DATABASE_REPLICAS = {
+    'ALIASES': ['replica'],
+    'STICKY_SECONDS': 2,
+}
@@ -0,0 +1,76 @@
+"""
+Teacher dashboard load: the three list calls the dashboard pages make today
+(/api/subjects/, /api/student-profiles/, /api/marks/) against the single
+/api/subjects/dashboard/ call. Requests are issued sequentially through the
+WSGI application, as the browser does, with the response cache bypassed.
+
+    python benchmarks/dashboard.py --students 500 --rounds 50
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from read_path import seed, setup_django, tokens_for
+
+SEPARATE_CALLS = ('/api/subjects/', '/api/student-profiles/', '/api/marks/')
+DASHBOARD_CALL = ('/api/subjects/dashboard/',)
+
+
+def make_client():
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+    def get(path, token):
+        status = []
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_AUTHORIZATION': f'Bearer {token}', 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        }
+        body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+        size = sum(len(part) for part in body)
+        body.close()
+        if not status[0].startswith('200'):
+            raise RuntimeError(f"{path} answered {status[0]}")
+        return size
+
+    return get
+
+
+def measure(get, token, paths, rounds):
+    timings = []
+    size = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        size = sum(get(path, token) for path in paths)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--subjects', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'), uncached=True)
+        teacher = seed(students=args.students, subjects=args.subjects)[0]
+        token = tokens_for([teacher])[0]
+        get = make_client()
+        measure(get, token, SEPARATE_CALLS + DASHBOARD_CALL, 3)  # warm up
+
+        print(f"{'calls':<28}{'median ms':>12}{'bytes':>12}")
+        for label, paths in (('subjects+profiles+marks', SEPARATE_CALLS), ('dashboard', DASHBOARD_CALL)):
+            elapsed, size = measure(get, token, paths, args.rounds)
+            print(f"{label:<28}{elapsed:>12.2f}{size:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Throughput and latency of the list/retrieve endpoints: sync views behind a
+threaded WSGI server versus async views (AsyncReadMixin) under ASGI.
+
+Both modes drive the Django application in-process from the same closed-loop
+client, so the numbers compare the application stacks rather than two HTTP
+servers. Each of --concurrency clients issues requests back to back:
+
+- wsgi: requests are handed to a pool of --threads worker threads, like
+  gunicorn's gthread worker; latency includes the wait for a free thread.
+- asgi: requests are awaited on one event loop, like a uvicorn worker.
+
+A fresh SQLite database is created and seeded in a temporary directory.
+Each mode runs in its own process because ASYNC_READ_VIEWS is read when the
+URLconf is loaded.
+
+    python benchmarks/read_path.py --concurrency 200 --requests 5000
+    python benchmarks/read_path.py --uncached   # bypass the response cache
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+ENDPOINTS = ('/api/notice/', '/api/assignments/', '/api/subjects/', '/api/marks/')
+
+
+def setup_django(database, uncached):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Sms.settings')
+    from django.conf import settings
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['*']
+    settings.DATABASES['default']['NAME'] = database
+    settings.AUDIT_LOG = {'ASYNC': False}
+    if uncached:
+        settings.CACHES['responses'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    import django
+    django.setup()
+
+
+def seed(students=200, subjects=10, notices=50, assignments_per_subject=10):
+    from django.core.management import call_command
+    from django.utils import timezone
+    from student.models import Marks, StudentProfile
+    from teacher.models import Assignment, Subject
+    from user.models import User, notice
+
+    call_command('migrate', verbosity=0)
+    admin = User.objects.create_user('bench-admin', password='x', role='admin')
+    teacher = User.objects.create_user('bench-teacher', password='x', role='teacher')
+    subject_rows = Subject.objects.bulk_create(
+        [Subject(name=f'Subject {i}', teacher=teacher) for i in range(subjects)]
+    )
+    notice.objects.bulk_create([
+        notice(title=f'Notice {i}', content='x' * 200, created_by=admin, audience='both')
+        for i in range(notices)
+    ])
+    Assignment.objects.bulk_create([
+        Assignment(
+            title=f'{subject.name} #{i}', description='x' * 200, created_by=teacher,
+            due_date=timezone.now(), subject=subject, audience='student',
+        )
+        for subject in subject_rows for i in range(assignments_per_subject)
+    ])
+    users = User.objects.bulk_create([
+        User(username=f'bench-student-{i}', password='x', role='student') for i in range(students)
+    ])
+    profiles = StudentProfile.objects.bulk_create([StudentProfile(user=user, grade='5') for user in users])
+    Through = StudentProfile.subjects.through
+    Through.objects.bulk_create([
+        Through(studentprofile_id=profile.id, subject_id=subject.id)
+        for profile in profiles for subject in subject_rows
+    ])
+    Marks.objects.bulk_create([
+        Marks(student=profile, subject=subject, marks=50, published=True)
+        for profile in profiles for subject in subject_rows
+    ])
+    return [teacher] + users[:20]
+
+
+def tokens_for(users):
+    from user.serializers import CustomTokenObtainPairSerializer
+    return [str(CustomTokenObtainPairSerializer.get_token(user).access_token) for user in users]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def drive(send_request, concurrency, total, tokens):
+    """Closed loop: `concurrency` clients issue `total` requests between them"""
+    latencies = []
+    errors = 0
+    issued = iter(range(total))
+
+    async def client(client_id):
+        nonlocal errors
+        token = tokens[client_id % len(tokens)]
+        for n in issued:
+            path = ENDPOINTS[n % len(ENDPOINTS)]
+            start = time.perf_counter()
+            status = await send_request(path, token)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def wsgi_sender(threads):
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def call(path, token):
+        status = []
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_AUTHORIZATION': f'Bearer {token}', 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        }
+        body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+        for _ in body:
+            pass
+        body.close()
+        return int(status[0].split()[0])
+
+    async def send(path, token):
+        return await asyncio.get_running_loop().run_in_executor(pool, call, path, token)
+
+    return send
+
+
+def asgi_sender():
+    from Sms.asgi import application
+
+    async def send(path, token):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'query_string': b'', 'root_path': '', 'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+        }
+        status = []
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected; Django cancels this once it has responded
+            await asyncio.Event().wait()
+
+        async def send_message(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send_message)
+        return status[0]
+
+    return send
+
+
+def run_mode(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'), args.uncached)
+        tokens = tokens_for(seed())
+        send = wsgi_sender(args.threads) if args.mode == 'wsgi' else asgi_sender()
+        # Warm up caches, connections and the URLconf
+        asyncio.run(drive(send, 10, 200, tokens))
+        result = asyncio.run(drive(send, args.concurrency, args.requests, tokens))
+    print(json.dumps(dict(mode=args.mode, **result)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('both', 'wsgi', 'asgi'), default='both')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+    parser.add_argument('--uncached', action='store_true', help='bypass the response cache')
+    args = parser.parse_args()
+
+    if args.mode != 'both':
+        os.environ['SMS_ASYNC_READ_VIEWS'] = '1' if args.mode == 'asgi' else '0'
+        run_mode(args)
+        return
+
+    print(f"{'mode':<6}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode in ('wsgi', 'asgi'):
+        command = [sys.executable, __file__] + sys.argv[1:] + ['--mode', mode]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<6}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10}"
+              f"{result['p50_ms']:>10}{result['p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
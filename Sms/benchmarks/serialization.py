@@ -0,0 +1,100 @@
+"""
+Render time and bytes on the wire for the large list endpoints
+(/api/marks/ and /api/student-profiles/) at --rows rows each.
+
+Render: the decoded list body is rendered with DRF's stdlib JSONRenderer
+and with FastJSONRenderer (orjson when installed), median of --rounds.
+
+Wire: the whole request through the WSGI application (middleware included,
+response cache bypassed) for each Accept-Encoding the server can produce,
+with the compressed size and the median request time.
+
+    python benchmarks/serialization.py --rows 10000 --rounds 20
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from read_path import seed, setup_django, tokens_for
+
+ENDPOINTS = ('/api/marks/', '/api/student-profiles/')
+
+
+def make_client():
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+    def get(path, token, accept_encoding=''):
+        status, headers = [], {}
+
+        def start_response(s, response_headers, exc_info=None):
+            status.append(s)
+            headers.update(response_headers)
+
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_AUTHORIZATION': f'Bearer {token}', 'HTTP_ACCEPT_ENCODING': accept_encoding,
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        }
+        body = application(environ, start_response)
+        content = b''.join(body)
+        body.close()
+        if not status[0].startswith('200'):
+            raise RuntimeError(f"{path} answered {status[0]}")
+        return content, headers.get('Content-Encoding', 'identity')
+
+    return get
+
+
+def median_ms(func, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, 'bench.sqlite3'), uncached=True)
+        from rest_framework.renderers import JSONRenderer
+        from user.middleware import COMPRESSORS
+        from user.renderers import FastJSONRenderer, orjson
+
+        # One subject, so both endpoints list --rows rows
+        teacher = seed(students=args.rows, subjects=1, notices=0, assignments_per_subject=0)[0]
+        token = tokens_for([teacher])[0]
+        get = make_client()
+        fast = 'orjson' if orjson else 'stdlib fallback'
+
+        print(f"{'endpoint':<24}{'renderer':<26}{'median ms':>12}{'bytes':>12}")
+        for path in ENDPOINTS:
+            data = json.loads(get(path, token)[0])
+            for label, renderer in (('JSONRenderer', JSONRenderer()), (f'FastJSONRenderer ({fast})', FastJSONRenderer())):
+                elapsed = median_ms(lambda: renderer.render(data), args.rounds)
+                print(f"{path:<24}{label:<26}{elapsed:>12.2f}{len(renderer.render(data)):>12}")
+
+        print()
+        print(f"{'endpoint':<24}{'encoding':<26}{'median ms':>12}{'bytes':>12}")
+        for path in ENDPOINTS:
+            for encoding in ['identity'] + sorted(COMPRESSORS):
+                content, sent = get(path, token, encoding)
+                assert sent == encoding, f"asked for {encoding}, got {sent}"
+                elapsed = median_ms(lambda: get(path, token, encoding), args.rounds)
+                print(f"{path:<24}{encoding:<26}{elapsed:>12.2f}{len(content):>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Concurrent writers and readers on one SQLite file, with the default
+configuration and with SQLITE_TUNING (WAL, pragmas, persistent
+connections, BEGIN IMMEDIATE with retry).
+
+--threads clients share --requests requests through the WSGI application,
+as gthread workers would. --write-ratio of them are students submitting an
+assignment (POST /api/submissions/ with a small file, the deadline rush);
+the rest list their assignments (GET /api/assignments/, response cache
+bypassed). Failed requests are mostly "database is locked" errors.
+
+Each mode runs in its own process because the tuning is read when the
+settings are imported.
+
+    python benchmarks/sqlite_concurrency.py --threads 16 --requests 2000
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from read_path import percentile, seed, setup_django, tokens_for
+
+BOUNDARY = 'sqlite-concurrency-benchmark'
+
+
+def submission_body(assignment_id, n):
+    payload = os.urandom(2048)  # distinct bodies, so every file is a new blob
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="assignment"\r\n\r\n{assignment_id}\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="essay-{n}.txt"\r\n'
+        f'Content-Type: text/plain\r\n\r\n'
+    ).encode() + payload + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def make_client():
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+    def call(method, path, token, body=b'', content_type=''):
+        status = []
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_AUTHORIZATION': f'Bearer {token}', 'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)), 'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body), 'wsgi.errors': io.StringIO(),
+        }
+        response = application(environ, lambda s, headers, exc_info=None: status.append(s))
+        for _ in response:
+            pass
+        response.close()
+        return int(status[0].split()[0])
+
+    return call
+
+
+def run_mode(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        from django.conf import settings
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Sms.settings')
+        settings.MEDIA_ROOT = os.path.join(tmp, 'media')
+        setup_django(os.path.join(tmp, 'bench.sqlite3'), uncached=True)
+        from django.db import connection
+        from teacher.models import Assignment
+
+        students = seed(students=args.students, subjects=10, assignments_per_subject=10)[1:]
+        tokens = tokens_for(students)
+        assignment_ids = list(Assignment.objects.values_list('id', flat=True))
+        connection.close()
+        call = make_client()
+
+        # Each student submits to each assignment at most once
+        lock = threading.Lock()
+        next_assignment = [0] * len(students)
+        writes_every = max(1, round(1 / args.write_ratio)) if args.write_ratio else 0
+
+        def request(n):
+            student = n % len(students)
+            start = time.perf_counter()
+            if writes_every and n % writes_every == 0:
+                with lock:
+                    index = next_assignment[student]
+                    next_assignment[student] += 1
+                body = submission_body(assignment_ids[index % len(assignment_ids)], n)
+                status = call('POST', '/api/submissions/', tokens[student], body,
+                              f'multipart/form-data; boundary={BOUNDARY}')
+                kind = 'write'
+            else:
+                status = call('GET', '/api/assignments/', tokens[student])
+                kind = 'read'
+            return kind, status, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(request, range(min(50, args.requests))))  # warm up
+            start = time.perf_counter()
+            results = list(pool.map(request, range(50, 50 + args.requests)))
+            elapsed = time.perf_counter() - start
+
+    writes = [r for r in results if r[0] == 'write']
+    reads = [r for r in results if r[0] == 'read']
+    ok = [r for r in results if r[1] < 400]
+    print(json.dumps({
+        'requests': len(results),
+        'throughput_rps': round(len(ok) / elapsed, 1),
+        'failed_writes': sum(1 for r in writes if r[1] >= 400),
+        'failed_reads': sum(1 for r in reads if r[1] >= 400),
+        'write_p99_ms': round(percentile([r[2] for r in writes], 0.99) * 1000, 1) if writes else 0,
+        'read_p99_ms': round(percentile([r[2] for r in reads], 0.99) * 1000, 1) if reads else 0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=('both', 'default', 'tuned'), default='both')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.mode != 'both':
+        run_mode(args)
+        return
+
+    print(f"{'mode':<9}{'requests':>10}{'ok req/s':>10}{'failed w':>10}{'failed r':>10}"
+          f"{'write p99':>11}{'read p99':>10}")
+    for mode in ('default', 'tuned'):
+        env = dict(os.environ, SMS_SQLITE_TUNING='1' if mode == 'tuned' else '0')
+        command = [sys.executable, __file__] + sys.argv[1:] + ['--mode', mode]
+        output = subprocess.run(command, check=True, capture_output=True, text=True, env=env).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<9}{result['requests']:>10}{result['throughput_rps']:>10}{result['failed_writes']:>10}"
+              f"{result['failed_reads']:>10}{result['write_p99_ms']:>11}{result['read_p99_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max, Min, Q
+from student.models import Marks
+
+PERCENTILES = (10, 25, 50, 75, 90)
+HISTOGRAM_BINS = 10
+
+
+def statistics_cache_key(subject_id):
+    return f'marks-stats:{subject_id}'
+
+
+def invalidate_subject_statistics(subject_id):
+    cache.delete(statistics_cache_key(subject_id))
+
+
+def _percentile(values, percent):
+    """Linear interpolation between closest ranks of an already sorted list"""
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def compute_subject_statistics(subject_id):
+    """
+    Summarise every mark recorded for a subject.
+
+    Count, mean, spread and pass rate come from a single aggregate query. The
+    order statistics and the histogram come from one pass over the marks read
+    back already sorted by the database.
+    """
+    pass_mark = getattr(settings, 'MARKS_PASS_MARK', 40)
+    marks = Marks.objects.filter(subject_id=subject_id)
+
+    summary = marks.aggregate(
+        count=Count('id'),
+        mean=Avg('marks'),
+        mean_square=Avg(F('marks') * F('marks')),
+        min=Min('marks'),
+        max=Max('marks'),
+        passed=Count('id', filter=Q(marks__gte=pass_mark)),
+        published=Count('id', filter=Q(published=True)),
+    )
+    count = summary['count']
+    result = {
+        'subject_id': subject_id,
+        'count': count,
+        'published': summary['published'],
+        'mean': summary['mean'],
+        'median': None,
+        'std_dev': None,
+        'min': summary['min'],
+        'max': summary['max'],
+        'percentiles': {},
+        'pass_mark': pass_mark,
+        'pass_rate': None,
+        'histogram': [],
+    }
+    if not count:
+        return result
+
+    variance = max(summary['mean_square'] - summary['mean'] ** 2, 0.0)
+    result['std_dev'] = variance ** 0.5
+    result['pass_rate'] = summary['passed'] / count
+
+    values = list(marks.order_by('marks').values_list('marks', flat=True))
+    result['median'] = _percentile(values, 50)
+    result['percentiles'] = {f'p{p}': _percentile(values, p) for p in PERCENTILES}
+
+    # Equal-width bins over 0..max(100, highest mark)
+    upper = max(100.0, values[-1])
+    width = upper / HISTOGRAM_BINS
+    counts = [0] * HISTOGRAM_BINS
+    for value in values:
+        counts[min(max(int(value // width), 0), HISTOGRAM_BINS - 1)] += 1
+    result['histogram'] = [
+        {'from': i * width, 'to': (i + 1) * width, 'count': counts[i]}
+        for i in range(HISTOGRAM_BINS)
+    ]
+    return result
+
+
+def subject_statistics(subject_id):
+    """Cached statistics for a subject; dropped whenever its marks change"""
+    key = statistics_cache_key(subject_id)
+    result = cache.get(key)
+    if result is None:
+        result = compute_subject_statistics(subject_id)
+        cache.set(key, result, getattr(settings, 'MARKS_STATS_CACHE_TIMEOUT', 3600))
+    return result
@@ -0,0 +1,71 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from student.models import GradebookSummary, Marks, StudentProfile
+
+REFRESH_CHUNK_SIZE = 1000
+
+
+def refresh_gradebook(student_ids):
+    """
+    Recompute the summary rows of the given students from their published marks.
+
+    Only the listed students are touched: their marks are aggregated through the
+    Marks(student) index and written back with one upsert per chunk.
+    """
+    student_ids = list(student_ids)
+    for start in range(0, len(student_ids), REFRESH_CHUNK_SIZE):
+        chunk = student_ids[start:start + REFRESH_CHUNK_SIZE]
+        rows = (
+            StudentProfile.objects.filter(id__in=chunk)
+            .annotate(
+                total=Coalesce(Sum('marks__marks', filter=Q(marks__published=True)), Value(0.0)),
+                subject_count=Count('marks', filter=Q(marks__published=True)),
+            )
+            .values_list('id', 'grade', 'total', 'subject_count')
+        )
+        GradebookSummary.objects.bulk_create(
+            [
+                GradebookSummary(
+                    student_id=student_id,
+                    grade=grade,
+                    total=total,
+                    subject_count=subject_count,
+                    average=total / subject_count if subject_count else 0,
+                )
+                for student_id, grade, total, subject_count in rows
+            ],
+            update_conflicts=True,
+            unique_fields=['student', 'grade'],
+            update_fields=['total', 'average', 'subject_count', 'updated_at'],
+        )
+
+
+def rebuild_gradebook():
+    """Recompute every summary row; used for backfills"""
+    student_ids = StudentProfile.objects.order_by('id').values_list('id', flat=True)
+    refresh_gradebook(student_ids.iterator(chunk_size=REFRESH_CHUNK_SIZE))
+    return GradebookSummary.objects.count()
+
+
+def students_for_subjects(subject_ids):
+    return Marks.objects.filter(subject_id__in=subject_ids).values_list('student_id', flat=True).distinct()
+
+
+def with_rank(queryset):
+    """
+    Annotate each summary with its 1-based rank by average within its grade.
+    Only students currently in the grade are ranked against; the rows kept
+    from grades students have left do not count.
+    """
+    higher = (
+        GradebookSummary.objects.filter(
+            grade=OuterRef('grade'), average__gt=OuterRef('average'), student__grade=F('grade'),
+        )
+        .order_by()
+        .values('grade')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    return queryset.annotate(
+        rank=Coalesce(Subquery(higher, output_field=IntegerField()), Value(0)) + 1
+    )
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from student.gradebook import rebuild_gradebook
+
+
+class Command(BaseCommand):
+    help = "Recompute the gradebook summary of every student from their published marks"
+
+    def handle(self, *args, **options):
+        count = rebuild_gradebook()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} gradebook rows"))
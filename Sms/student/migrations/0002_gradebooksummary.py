@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('student', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradebookSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grade', models.CharField(choices=[('1', 'Grade 1'), ('2', 'Grade 2'), ('3', 'Grade 3'), ('4', 'Grade 4'), ('5', 'Grade 5'), ('6', 'Grade 6'), ('7', 'Grade 7'), ('8', 'Grade 8'), ('9', 'Grade 9'), ('10', 'Grade 10'), ('11', 'Grade 11'), ('12', 'Grade 12')], max_length=2)),
+                ('total', models.FloatField(default=0)),
+                ('average', models.FloatField(default=0)),
+                ('subject_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gradebook', to='student.studentprofile')),
+            ],
+            options={
+                'verbose_name_plural': 'Gradebook Summaries',
+                'indexes': [models.Index(fields=['grade', '-average'], name='gradebook_grade_avg_idx')],
+                'unique_together': {('student', 'grade')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('student', '0002_gradebooksummary'),
+        ('teacher', '0002_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='marks',
+            index=models.Index(fields=['subject', 'published'], name='marks_subject_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='marks',
+            index=models.Index(condition=models.Q(('published', True)), fields=['student'], name='marks_student_published_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:37
+
+import user.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('student', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='studentsubmission',
+            name='file',
+            field=models.FileField(max_length=255, storage=user.storage.blob_storage, upload_to='submissions/'),
+        ),
+    ]
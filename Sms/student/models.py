@@ -1,7 +1,15 @@
 from django.db import models
+from user.managers import LiveUserRowsManager
 from user.models import User
+from user.storage import blob_storage
 from teacher.models import Assignment, Subject
 
+
+class StudentRowsManager(LiveUserRowsManager):
+    """Rows of a StudentProfile, hidden once its user is soft-deleted"""
+    user_lookup = 'student__user'
+
+
 class StudentProfile(models.Model):
     GRADE_CHOICES = [
         ('1', 'Grade 1'),
@@ -23,6 +31,10 @@ class StudentProfile(models.Model):
     grade = models.CharField(max_length=2, choices=GRADE_CHOICES, default='1')
     subjects = models.ManyToManyField(Subject, related_name='students')
 
+    # Profiles of soft-deleted users are hidden; all_objects includes them
+    objects = LiveUserRowsManager()
+    all_objects = models.Manager()
+
     def __str__(self):
         return f"{self.user.username}, Grade {self.grade}"
     
@@ -34,9 +46,18 @@ class Marks(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StudentRowsManager()
+    all_objects = models.Manager()
+
     class Meta:
         unique_together = ('student', 'subject')
         verbose_name_plural = 'Marks'
+        indexes = [
+            # Teachers' per-subject reads and publish/statistics counts
+            models.Index(fields=['subject', 'published'], name='marks_subject_pub_idx'),
+            # Students: their own published marks
+            models.Index(fields=['student'], condition=models.Q(published=True), name='marks_student_published_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.user.username} - {self.subject.name} - {self.marks}"
@@ -44,13 +65,39 @@ class Marks(models.Model):
 class StudentSubmission(models.Model):
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='submissions')
     student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='submissions')
-    file = models.FileField(upload_to='submissions/')
+    file = models.FileField(upload_to='submissions/', storage=blob_storage, max_length=255)
     submitted_at = models.DateTimeField(auto_now_add=True)
     comments = models.TextField(blank=True, null=True)
 
+    objects = StudentRowsManager()
+    all_objects = models.Manager()
+
     class Meta:
         unique_together = ('assignment', 'student')
         verbose_name_plural = 'Student Submissions'
 
     def __str__(self):
-        return f"{self.student.user.username} - {self.assignment.title}"
\ No newline at end of file
+        return f"{self.student.user.username} - {self.assignment.title}"
+
+class GradebookSummary(models.Model):
+    """Denormalized totals of a student's published marks, one row per grade"""
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='gradebook')
+    grade = models.CharField(max_length=2, choices=StudentProfile.GRADE_CHOICES)
+    total = models.FloatField(default=0)
+    average = models.FloatField(default=0)
+    subject_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StudentRowsManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        unique_together = ('student', 'grade')
+        verbose_name_plural = 'Gradebook Summaries'
+        indexes = [
+            # Rank lookups: students of a grade ordered by average
+            models.Index(fields=['grade', '-average'], name='gradebook_grade_avg_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.user.username} - Grade {self.grade} - {self.average}"
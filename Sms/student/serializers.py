@@ -2,21 +2,26 @@ from rest_framework import serializers
 from student.models import Marks, StudentProfile, StudentSubmission
 from teacher.serializers import SubjectSerializer, UserBasicSerializer
 from teacher.models import Subject
+from user.fieldsets import DynamicFieldsMixin
 from user.models import User
 
-class MarksSerializer(serializers.ModelSerializer):
+class MarksSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     subject_name = serializers.CharField(source='subject.name', read_only=True)
     student_name = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = Marks
         fields = ['id', 'student', 'subject', 'marks', 'published', 'subject_name', 'student_name']
+        expandable_fields = ['subject_name', 'student_name']
+        field_lookups = {
+            'student_name': ['student__user__first_name', 'student__user__last_name', 'student__user__username'],
+        }
         
     def get_student_name(self, obj):
         user = obj.student.user
         return f"{user.first_name} {user.last_name}" if user.first_name and user.last_name else user.username
 
-class StudentSubmissionSerializer(serializers.ModelSerializer):
+class StudentSubmissionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     student_name = serializers.ReadOnlyField(source='student.user.username')
     assignment_title = serializers.ReadOnlyField(source='assignment.title')
     
@@ -25,6 +30,7 @@ class StudentSubmissionSerializer(serializers.ModelSerializer):
         fields = ['id', 'assignment', 'assignment_title', 'student', 
                   'student_name', 'file', 'submitted_at', 'comments']
         read_only_fields = ['student', 'submitted_at', 'student_name', 'assignment_title']
+        expandable_fields = ['student_name', 'assignment_title']
     
     def update(self, instance, validated_data):
         # Handle file updates carefully - only update if a new file is provided
@@ -36,7 +42,7 @@ class StudentSubmissionSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
     
-class StudentProfileSerializer(serializers.ModelSerializer):
+class StudentProfileSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user_details = UserBasicSerializer(source='user', read_only=True)
     subject_details = SubjectSerializer(source='subjects', many=True, read_only=True)
     grade_display = serializers.CharField(source='get_grade_display', read_only=True)
@@ -54,6 +60,8 @@ class StudentProfileSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'user': {'write_only': True}
         }
+        expandable_fields = ['user_details', 'subject_details']
+        field_lookups = {'grade_display': ['grade']}
     
     def create(self, validated_data):
         subjects = validated_data.pop('subjects', [])
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+from student.models import Marks, StudentProfile, StudentSubmission
+from user.cache import forget_student_subjects
+from user.events import publish_event
+from user.storage import track_blob_references
+
+# Sent after marks are written in bulk (bulk-create, import, publish) where
+# the per-row model signals do not fire. Receivers get `subject_ids` and
+# `student_ids` (StudentProfile IDs); either may be None when unknown.
+marks_changed = Signal()
+
+
+@receiver(post_save, sender=Marks)
+@receiver(post_delete, sender=Marks)
+def relay_marks_write(sender, instance, **kwargs):
+    """Funnel single-row writes into marks_changed"""
+    marks_changed.send(
+        sender=Marks,
+        subject_ids=[instance.subject_id],
+        student_ids=[instance.student_id],
+    )
+
+
+@receiver(marks_changed)
+def invalidate_marks_statistics(sender, subject_ids=None, **kwargs):
+    from student.analytics import invalidate_subject_statistics
+
+    def invalidate():
+        for subject_id in subject_ids or []:
+            invalidate_subject_statistics(subject_id)
+
+    # After commit, or a concurrent read could cache the old marks again
+    transaction.on_commit(invalidate)
+
+
+@receiver(marks_changed)
+def update_gradebook(sender, subject_ids=None, student_ids=None, **kwargs):
+    from student.gradebook import refresh_gradebook, students_for_subjects
+
+    def refresh():
+        ids = student_ids
+        if ids is None:
+            ids = students_for_subjects(subject_ids or [])
+        refresh_gradebook(ids)
+
+    # After commit, so a cascade delete of the profile has already happened
+    transaction.on_commit(refresh)
+
+
+@receiver(marks_changed)
+def push_results(sender, subject_ids=None, student_ids=None, **kwargs):
+    """
+    Tell students whose published marks were written, publish_results
+    included. The event only names the subjects; clients refetch their marks.
+    """
+    if not subject_ids:
+        return
+
+    def push():
+        published = Marks.objects.filter(subject_id__in=subject_ids, published=True)
+        if student_ids is not None:
+            published = published.filter(student_id__in=student_ids)
+        profile_ids = set(published.values_list('student_id', flat=True))
+        publish_event(
+            'results.updated',
+            [f'student:{profile_id}' for profile_id in profile_ids],
+            {'subject_ids': list(subject_ids)},
+        )
+
+    transaction.on_commit(push)
+
+
+@receiver(post_save, sender=StudentProfile)
+def update_gradebook_for_profile(sender, instance, created, **kwargs):
+    """A grade change starts a new summary row for the new grade"""
+    if created:
+        return
+    from student.gradebook import refresh_gradebook
+    transaction.on_commit(lambda: refresh_gradebook([instance.id]))
+
+
+@receiver(m2m_changed, sender=StudentProfile.subjects.through)
+def forget_enrolment(sender, instance, action, reverse, pk_set, **kwargs):
+    """Enrolment changes move a student to another assignment cache scope"""
+    if not reverse:
+        if not action.startswith('post_'):
+            return
+        user_ids = [instance.user_id]
+    elif action == 'pre_clear':
+        # subject.students.clear(): the links are gone by post_clear
+        user_ids = list(instance.students.values_list('user_id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        user_ids = list(StudentProfile.objects.filter(id__in=pk_set).values_list('user_id', flat=True))
+    else:
+        return
+    # After commit, or a concurrent read could cache the old subjects again
+    transaction.on_commit(lambda: forget_student_subjects(*user_ids))
+
+
+@receiver(post_delete, sender=StudentProfile)
+def forget_deleted_profile(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: forget_student_subjects(user_id))
+
+
+track_blob_references(StudentSubmission, 'file')
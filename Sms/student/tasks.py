@@ -0,0 +1,33 @@
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+from rest_framework.request import Request
+
+from student.utils import bulk_create_marks, filter_export_queryset, save_export
+from teacher.models import Subject
+from user.jobs import PermanentJobError, task
+
+
+@task(queue='default', max_attempts=3)
+def bulk_create_marks_job(job, subject_id, marks_data):
+    """MarksViewSet.bulk_create run by a worker"""
+    subject = Subject.objects.get(id=subject_id)
+    return bulk_create_marks(subject, marks_data)
+
+
+@task(queue='exports', max_attempts=2)
+def export_job(job, viewset, params, columns, lookups, export_format, filename):
+    """
+    An export action run by a worker. The rows are scoped exactly as the
+    request would have been, by the queryset `viewset` gives the job's owner.
+    """
+    owner = job.created_by
+    if owner is None or owner.is_deleted:
+        raise PermanentJobError("The user who requested this export no longer exists")
+    view = import_string(viewset)()
+    view.request = Request(HttpRequest())
+    view.request.user = owner
+    view.action = 'export'
+    view.format_kwarg = None
+    queryset = filter_export_queryset(view.get_queryset(), params, lookups)
+    name = save_export(queryset.order_by('id'), columns, export_format, f'exports/{job.pk}/{filename}')
+    return {'file': name}
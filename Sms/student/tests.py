@@ -1,3 +1,408 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import AsyncClient, override_settings
+from django.utils import timezone
+
+from student.analytics import subject_statistics
+from student.utils import load_workbook
+from student.models import GradebookSummary, Marks, StudentSubmission
+from student.views import MarksViewSet, StudentProfileViewSet, StudentSubmissionViewSet
+from teacher.models import Assignment
+from user.jobs import Worker, purge_finished
+from user.models import Job
+from user.serializers import CustomTokenObtainPairSerializer
+from user.tests import QueryPlanTestCase, SchoolTestCase, SchoolTransactionTestCase
+
+
+class StudentQueryPlanTests(QueryPlanTestCase):
+    def test_profile_list_for_teacher(self):
+        self.assertNoFullScan(StudentProfileViewSet, self.teacher)
+
+    def test_profile_list_for_student(self):
+        self.assertNoFullScan(StudentProfileViewSet, self.student)
+
+    def test_marks_list_for_teacher(self):
+        self.assertNoFullScan(MarksViewSet, self.teacher)
+
+    def test_marks_list_for_student(self):
+        self.assertNoFullScan(MarksViewSet, self.student)
+
+    def test_submission_list_for_teacher(self):
+        self.assertNoFullScan(StudentSubmissionViewSet, self.teacher)
+
+    def test_submission_list_for_student(self):
+        self.assertNoFullScan(StudentSubmissionViewSet, self.student)
+
+
+class MarksImportTests(SchoolTestCase):
+    def upload(self, body, name='marks.csv'):
+        self.auth(self.teacher)
+        return self.client.post(
+            '/api/marks/import/',
+            {'subject_id': self.subject.id, 'file': SimpleUploadedFile(name, body)},
+            format='multipart',
+        )
+
+    def test_csv(self):
+        first, second, third = self.students[:3]
+        body = (
+            "Student_ID,username,marks\n"
+            f"{first.id},,55\n"
+            ",student1,66\n"
+            ",nobody,3\n"
+            f"{third.id},,abc\n"
+            "\n"
+            ",,4\n"
+            f"{first.id},,77\n"
+        )
+        response = self.upload(body.encode('utf-8-sig'))
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['created'], response.data['updated']), (2, 1))
+        self.assertEqual([error['row'] for error in response.data['errors']], [4, 5, 7])
+        self.assertEqual(Marks.objects.get(student=first).marks, 77)
+        self.assertEqual(Marks.objects.get(student=second).marks, 66)
+
+    def test_rejects_non_finite_marks(self):
+        body = "student_id,marks\n" + "".join(
+            f"{profile.id},{value}\n" for profile, value in zip(self.students, ['nan', 'inf', '-Infinity', '40'])
+        )
+        response = self.upload(body.encode())
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 3, 4])
+        self.assertEqual(list(Marks.objects.values_list('marks', flat=True)), [40])
+
+
+    def test_rejects_non_integral_student_ids(self):
+        first, second = self.students[:2]
+        body = f"student_id,marks\n{first.id}.7,50\n{second.id}.0,60\ninf,70\n1e400,80\n"
+        response = self.upload(body.encode())
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 4, 5])
+        self.assertEqual(list(Marks.objects.values_list('student', 'marks')), [(second.id, 60)])
+
+    @skipUnless(load_workbook, 'openpyxl is not installed')
+    def test_xlsx(self):
+        from openpyxl import Workbook
+
+        first, second, third = self.students[:3]
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Student_ID', 'Username', 'Marks'])
+        sheet.append([float(first.id), None, 55])
+        sheet.append([None, 'student1', '66.5'])
+        sheet.append([])
+        sheet.append([third.id + 0.5, None, 70])
+        sheet.append([None, None, 10])
+        body = io.BytesIO()
+        workbook.save(body)
+
+        response = self.upload(body.getvalue(), 'marks.xlsx')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['created'], response.data['updated']), (2, 0))
+        self.assertEqual([error['row'] for error in response.data['errors']], [5, 6])
+        self.assertEqual(Marks.objects.get(student=first).marks, 55)
+        self.assertEqual(Marks.objects.get(student=second).marks, 66.5)
+
+    def test_unreadable_files(self):
+        response = self.upload(b'student_id,marks\n\xff\xfe,1\n')
+        self.assertEqual(response.status_code, 400)
+        with mock.patch('student.utils.load_workbook', None):
+            response = self.upload(b'PK', 'marks.xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('openpyxl', response.data['error'])
+
+
+class BulkCreateMarksTests(SchoolTestCase):
+    def bulk_create(self, marks_data):
+        self.auth(self.teacher)
+        response = self.client.post('/api/marks/bulk-create/', {
+            'subject_id': self.subject.id, 'marks_data': marks_data,
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_upsert(self):
+        first, second = self.students[:2]
+        existing = Marks.objects.create(student=first, subject=self.subject, marks=10, published=False)
+        data = self.bulk_create([
+            {'student_id': first.id, 'marks': 80},
+            {'student_id': second.id, 'marks': '60'},
+            {'student_id': second.id, 'marks': 65.5},
+            {'student_id': 99999, 'marks': 50},
+        ])
+        self.assertEqual((data['created'], data['updated']), (1, 2))
+        self.assertEqual(len(data['errors']), 1)
+        self.assertIn('99999', data['errors'][0])
+
+        updated = Marks.objects.get(pk=existing.pk)
+        self.assertEqual(updated.marks, 80)
+        self.assertFalse(updated.published)
+        self.assertGreater(updated.updated_at, existing.updated_at)
+        created = Marks.objects.get(student=second)
+        self.assertEqual(created.marks, 65.5)
+        self.assertTrue(created.published)
+
+    def test_rejects_invalid_marks(self):
+        values = [True, 'nan', 'inf', '1e999', 'abc']
+        data = self.bulk_create([
+            {'student_id': profile.id, 'marks': value} for profile, value in zip(self.students, values)
+        ])
+        self.assertEqual((data['created'], data['updated']), (0, 0))
+        self.assertEqual(len(data['errors']), len(values))
+        self.assertFalse(Marks.objects.exists())
+
+
+@override_settings(SQLITE_TUNING={'ENABLED': True, 'RETRY_BACKOFF_MS': 1})
+class LockedWriteRetryTests(SchoolTransactionTestCase):
+    def locked_once(self, func):
+        calls = []
+
+        def locked(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return func(*args, **kwargs)
+        return locked
+
+    def test_import_is_read_again_on_retry(self):
+        from student import utils
+        body = "username,marks\nstudent0,55\nstudent1,66\n".encode()
+        self.auth(self.teacher)
+        with mock.patch.object(utils, 'import_marks', self.locked_once(utils.import_marks)):
+            response = self.client.post(
+                '/api/marks/import/',
+                {'subject_id': self.subject.id, 'file': SimpleUploadedFile('marks.csv', body)},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(Marks.objects.count(), 2)
+
+    def test_submission_create_retries(self):
+        assignment = Assignment.objects.create(
+            title='Essay', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student',
+        )
+        self.auth(self.students[0].user)
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            with mock.patch.object(StudentSubmission, 'save', self.locked_once(StudentSubmission.save)):
+                response = self.client.post(
+                    '/api/submissions/',
+                    {'assignment': assignment.id, 'file': SimpleUploadedFile('essay.txt', b'hello')},
+                    format='multipart',
+                )
+            self.assertEqual(response.status_code, 201, response.data)
+            submission = StudentSubmission.objects.get()
+            self.assertEqual(submission.student, self.students[0])
+            self.assertEqual(submission.file.read(), b'hello')
+
+    def test_submission_needs_a_profile(self):
+        assignment = Assignment.objects.create(
+            title='Essay', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student',
+        )
+        self.auth(self.teacher)
+        response = self.client.post(
+            '/api/submissions/',
+            {'assignment': assignment.id, 'file': SimpleUploadedFile('essay.txt', b'hello')},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class GradebookTests(SchoolTestCase):
+    def ranks(self, user):
+        self.auth(user)
+        response = self.client.get('/api/student-profiles/gradebook/')
+        self.assertEqual(response.status_code, 200)
+        return {row['student_id']: (row['grade'], row['rank']) for row in response.data}
+
+    def test_rank_ignores_students_who_left_the_grade(self):
+        first, second = self.students[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            for value, profile in zip([90, 80, 70, 60, 50], self.students):
+                Marks.objects.create(student=profile, subject=self.subject, marks=value)
+        self.assertEqual(self.ranks(self.teacher)[self.students[2].id], ('5', 3))
+
+        # The top two move up a grade; their grade 5 rows stay behind
+        with self.captureOnCommitCallbacks(execute=True):
+            for profile in (first, second):
+                profile.grade = '6'
+                profile.save()
+        self.assertEqual(GradebookSummary.objects.filter(grade='5').count(), 5)
+
+        ranks = self.ranks(self.teacher)
+        self.assertEqual(ranks[self.students[2].id], ('5', 1))
+        self.assertEqual(ranks[self.students[4].id], ('5', 3))
+        self.assertEqual(ranks[first.id], ('6', 1))
+        self.assertEqual(ranks[second.id], ('6', 2))
+
+
+class StatisticsTests(SchoolTestCase):
+    def statistics(self):
+        self.auth(self.teacher)
+        response = self.client.get(f'/api/marks/statistics/?subject_id={self.subject.id}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cached_until_marks_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for value, profile in zip([30, 50, 70, 90], self.students):
+                Marks.objects.create(student=profile, subject=self.subject, marks=value)
+        data = self.statistics()
+        self.assertEqual((data['count'], data['median'], data['pass_rate']), (4, 60, 0.75))
+        with self.assertNumQueries(1):  # the subject permission check only
+            self.statistics()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/marks/bulk-create/', {
+                'subject_id': self.subject.id, 'marks_data': [{'student_id': self.students[4].id, 'marks': 100}],
+            }, format='json')
+        self.assertEqual(self.statistics()['count'], 5)
+
+    def test_invalidated_after_commit(self):
+        self.assertEqual(self.statistics()['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Marks.objects.create(student=self.students[0], subject=self.subject, marks=50)
+            # Before the commit, a read recomputing from the old marks is
+            # cleared again once the transaction commits
+            self.assertEqual(subject_statistics(self.subject.id)['count'], 0)
+        self.assertEqual(self.statistics()['count'], 1)
+
+    def test_students_are_refused(self):
+        self.auth(self.students[0].user)
+        response = self.client.get(f'/api/marks/statistics/?subject_id={self.subject.id}')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(JOB_QUEUE={'QUEUES': {'default': 1, 'exports': 1}, 'POLL_INTERVAL_MS': 10})
+class StreamingExportTests(SchoolTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i, profile in enumerate(cls.students):
+            Marks.objects.create(student=profile, subject=cls.subject, marks=60 + i, published=i % 2 == 0)
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        self.auth(self.teacher)
+        response, body = self.download('/api/marks/export/?published=true')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="marks.csv"')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0][:4], ['id', 'student_id', 'username', 'first_name'])
+        self.assertEqual([row[2] for row in rows[1:]], ['student0', 'student2', 'student4'])
+
+    def test_ndjson(self):
+        self.auth(self.teacher)
+        response, body = self.download(f'/api/student-profiles/export/?export_format=ndjson&grade=5&subject={self.subject.id}')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['username'] for row in rows], [f'student{i}' for i in range(5)])
+        self.assertEqual(rows[0]['grade'], '5')
+
+    def test_scoped_to_the_user(self):
+        # Students see their own published marks only
+        self.auth(self.students[1].user)
+        self.assertEqual(self.download('/api/marks/export/?export_format=ndjson')[1], '')
+        self.auth(self.students[2].user)
+        _, body = self.download('/api/marks/export/?export_format=ndjson')
+        self.assertEqual([json.loads(line)['username'] for line in body.splitlines()], ['student2'])
+
+    def test_one_query_however_many_rows(self):
+        self.auth(self.teacher)
+        for query in ('published=true', 'published=false', ''):
+            with self.assertNumQueries(1):
+                self.download(f'/api/marks/export/?{query}')
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.teacher).access_token
+        with mock.patch('student.utils.EXPORT_CHUNK_SIZE', 2):
+            response = await AsyncClient().get(
+                '/api/marks/export/?export_format=ndjson', headers={'Authorization': f'Bearer {token}'},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+        # Sent as it is read, two rows at a time
+        self.assertEqual(len(chunks), 3)
+        body = b''.join(chunks).decode()
+        self.assertEqual([json.loads(line)['marks'] for line in body.splitlines()], [60, 61, 62, 63, 64])
+
+    def test_rejects_bad_params(self):
+        self.auth(self.teacher)
+        for query in ('export_format=xml', 'published=maybe', 'subject=math'):
+            response = self.client.get(f'/api/marks/export/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('error', response.data)
+
+
+class ExportJobTests(SchoolTransactionTestCase):
+    def test_export_job(self):
+        for profile in self.students[:3]:
+            Marks.objects.create(student=profile, subject=self.subject, marks=70)
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            self.auth(self.teacher)
+            response = self.client.get('/api/marks/export/?export_format=ndjson', headers={'Prefer': 'respond-async'})
+            self.assertEqual(response.status_code, 202, response.data)
+            job_id = response.data['job_id']
+            Worker().run(once=True)
+
+            response = self.client.get(f'/api/jobs/{job_id}/')
+            self.assertEqual(response.data['status'], 'succeeded', response.data)
+            name = response.data['result']['file']
+            self.assertTrue(name.startswith(f'exports/{job_id}/'))
+            response = self.client.get(f'/api/jobs/{job_id}/download/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content).count(b'\n'), 3)
+
+            self.auth(self.students[0].user)
+            self.assertEqual(self.client.get(f'/api/jobs/{job_id}/').status_code, 404)
+
+            # Retention removes the job and its file
+            Job.objects.filter(pk=job_id).update(finished_at=timezone.now() - timedelta(days=30))
+            self.assertEqual(purge_finished(), 1)
+            self.assertFalse(default_storage.exists(name))
+
+    async def test_job_download_streams_asynchronously_under_asgi(self):
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        name = await sync_to_async(default_storage.save)('exports/1/marks.csv', ContentFile(b'id\n1\n'))
+        job = await Job.objects.acreate(
+            task='student.tasks.export_job', status='succeeded', result={'file': name}, created_by=self.teacher,
+        )
+        token = CustomTokenObtainPairSerializer.get_token(self.teacher).access_token
+        response = await AsyncClient().get(f'/api/jobs/{job.pk}/download/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'id\n1\n')
+
+    def test_export_job_without_its_owner_fails_at_once(self):
+        self.auth(self.teacher)
+        response = self.client.get('/api/marks/export/', headers={'Prefer': 'respond-async'})
+        job_id = response.data['job_id']
+        for owner in (self.teacher, None):
+            if owner is not None:
+                owner.delete()
+            Job.objects.filter(pk=job_id).update(created_by=owner, status='queued', attempts=0)
+            with self.assertLogs('user.jobs', 'ERROR'):
+                Worker().run(once=True)
+            job = Job.objects.get(pk=job_id)
+            self.assertEqual((job.status, job.attempts), ('failed', 1))
+            self.assertEqual(job.error, 'The user who requested this export no longer exists')
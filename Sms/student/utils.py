@@ -0,0 +1,388 @@
+import csv
+import io
+import math
+from contextlib import closing
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from student.models import Marks, StudentProfile
+from user.sqlite import immediate_atomic, retry_when_locked
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # XLSX import is optional
+    load_workbook = None
+
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+def parse_mark(value):
+    """
+    float(value) for a marks value. Raises ValueError for booleans, NaN and
+    infinities, which float() would accept.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid marks value '{value}'")
+    mark = float(value)
+    if not math.isfinite(mark):
+        raise ValueError(f"Invalid marks value '{value}'")
+    return mark
+
+
+def parse_student_id(value):
+    """
+    The profile ID in an imported student_id cell. XLSX numbers arrive as
+    floats such as 12.0; anything that is not a whole number raises ValueError.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f"Invalid student_id '{value}'")
+        return int(number)
+
+
+def upsert_marks(subject, entries):
+    """
+    Insert or update the marks of one subject with one bulk upsert.
+
+    `entries` is an ordered list of (student_id, marks) pairs whose students
+    are known to exist. Repeated students keep their last value and count as
+    updates, the same as running update_or_create once per entry.
+    Callers own the transaction. Returns a (created, updated) tuple.
+    """
+    if not entries:
+        return 0, 0
+
+    # One indexed read of the subject's current rows; bounded by class size
+    # rather than by the number of bound parameters in the batch.
+    existing = set(
+        Marks.objects.filter(subject=subject).values_list('student_id', flat=True)
+    )
+
+    created_count = 0
+    updated_count = 0
+    values = {}
+    for student_id, mark_value in entries:
+        if student_id in existing or student_id in values:
+            updated_count += 1
+        else:
+            created_count += 1
+        values[student_id] = mark_value
+
+    # Conflicts on the (student, subject) constraint update the row instead
+    Marks.objects.bulk_create(
+        [
+            Marks(student_id=student_id, subject=subject, marks=mark_value)
+            for student_id, mark_value in values.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['student', 'subject'],
+        update_fields=['marks', 'updated_at'],
+    )
+    return created_count, updated_count
+
+
+@retry_when_locked
+def bulk_create_marks(subject, marks_data):
+    """
+    Validate and upsert a list of {"student_id", "marks"} items for `subject`
+    in one transaction. Returns the response body of MarksViewSet.bulk_create.
+    """
+    from student.signals import marks_changed
+
+    # Errors are keyed by position so they are reported in input order
+    errors = {}
+    entries = []
+
+    for index, item in enumerate(marks_data):
+        student_id = item.get('student_id')
+        mark_value = item.get('marks')
+
+        if not student_id or mark_value is None:
+            errors[index] = f"Missing student_id or marks for item: {item}"
+            continue
+
+        try:
+            entries.append((index, int(student_id), parse_mark(mark_value)))
+        except (TypeError, ValueError):
+            errors[index] = f"Invalid student_id or marks for item: {item}"
+
+    with immediate_atomic():
+        # Validate every student ID in one query
+        valid_ids = set(
+            StudentProfile.objects.filter(id__in={sid for _, sid, _ in entries})
+            .values_list('id', flat=True)
+        )
+        valid_entries = []
+        for index, student_id, mark_value in entries:
+            if student_id not in valid_ids:
+                errors[index] = f"Student with ID {student_id} not found"
+                continue
+            valid_entries.append((student_id, mark_value))
+
+        created_count, updated_count = upsert_marks(subject, valid_entries)
+        marks_changed.send(
+            sender=Marks,
+            subject_ids=[subject.id],
+            student_ids=[student_id for student_id, _ in valid_entries],
+        )
+
+    return {
+        "message": f"Created {created_count} marks and updated {updated_count} marks",
+        "created": created_count,
+        "updated": updated_count,
+        "errors": [errors[index] for index in sorted(errors)]
+    }
+
+
+def iter_marks_rows(upload):
+    """
+    Yield (row_number, row) pairs from an uploaded CSV or XLSX marks sheet.
+
+    Rows are dicts keyed by the lower-cased header. The file is read
+    incrementally, never loaded whole. Raises ValueError for a file that
+    cannot be read.
+    """
+    name = (upload.name or '').lower()
+    if name.endswith('.xlsx'):
+        if load_workbook is None:
+            raise ValueError("XLSX import requires openpyxl; upload a CSV file instead")
+        workbook = load_workbook(upload, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            header = [str(cell or '').strip().lower() for cell in header]
+            for row_number, cells in enumerate(rows, start=2):
+                if not any(cell is not None and cell != '' for cell in cells):
+                    continue
+                yield row_number, dict(zip(header, cells))
+        finally:
+            workbook.close()
+        return
+
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [cell.strip().lower() for cell in header]
+        for cells in reader:
+            if not any(cell.strip() for cell in cells):
+                continue
+            yield reader.line_num, dict(zip(header, cells))
+    except UnicodeDecodeError:
+        raise ValueError("The file is not valid UTF-8 CSV")
+    finally:
+        # Leave the upload open for Django to clean up
+        stream.detach()
+
+
+def import_marks(subject, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Upsert marks for `subject` from (row_number, row) pairs, one chunk at a time.
+
+    Each row names its student by `student_id` (the profile ID) or `username`
+    and carries a `marks` value. Students are resolved with two queries per
+    chunk at most. Returns (created, updated, errors) where errors is a list of
+    {"row": ..., "error": ...} dicts.
+    """
+    created_total = 0
+    updated_total = 0
+    report = []
+    rows = iter(rows)
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        errors = []
+        parsed = []
+        profile_ids = set()
+        usernames = set()
+        for row_number, row in chunk:
+            student_id = str(row.get('student_id') or '').strip()
+            username = str(row.get('username') or '').strip()
+            mark_value = row.get('marks')
+
+            if mark_value is None or str(mark_value).strip() == '':
+                errors.append({"row": row_number, "error": "Missing marks"})
+                continue
+            try:
+                mark_value = parse_mark(mark_value)
+            except (TypeError, ValueError):
+                errors.append({"row": row_number, "error": f"Invalid marks value '{mark_value}'"})
+                continue
+
+            if student_id:
+                try:
+                    student_id = parse_student_id(student_id)
+                except ValueError:
+                    errors.append({"row": row_number, "error": f"Invalid student_id '{student_id}'"})
+                    continue
+                profile_ids.add(student_id)
+                parsed.append((row_number, 'id', student_id, mark_value))
+            elif username:
+                usernames.add(username)
+                parsed.append((row_number, 'username', username, mark_value))
+            else:
+                errors.append({"row": row_number, "error": "Missing student_id or username"})
+
+        found_ids = set()
+        if profile_ids:
+            found_ids = set(
+                StudentProfile.objects.filter(id__in=profile_ids).values_list('id', flat=True)
+            )
+        ids_by_username = {}
+        if usernames:
+            ids_by_username = dict(
+                StudentProfile.objects.filter(user__username__in=usernames)
+                .values_list('user__username', 'id')
+            )
+
+        entries = []
+        for row_number, key_type, key, mark_value in parsed:
+            if key_type == 'id':
+                student_id = key if key in found_ids else None
+            else:
+                student_id = ids_by_username.get(key)
+            if student_id is None:
+                errors.append({"row": row_number, "error": f"Student '{key}' not found"})
+                continue
+            entries.append((student_id, mark_value))
+
+        created, updated = upsert_marks(subject, entries)
+        created_total += created
+        updated_total += updated
+        report.extend(sorted(errors, key=lambda error: error['row']))
+
+    return created_total, updated_total, report
+
+
+@retry_when_locked
+def import_marks_file(subject, upload):
+    """
+    Import a CSV or XLSX marks sheet for `subject` in one transaction (see
+    iter_marks_rows and import_marks). A retry reads the upload again from
+    the start. Returns (created, updated, errors).
+    """
+    from student.signals import marks_changed
+
+    upload.seek(0)
+    with closing(iter_marks_rows(upload)) as rows, immediate_atomic():
+        result = import_marks(subject, rows)
+        marks_changed.send(sender=Marks, subject_ids=[subject.id], student_ids=None)
+    return result
+
+
+def filter_export_queryset(queryset, params, lookups):
+    """
+    Narrow an export queryset by the `subject`, `grade` and `published` query
+    params. `lookups` maps each supported param to the field lookup it filters
+    on for this model. Raises ValueError for a malformed value.
+    """
+    filters = {}
+    for param, lookup in lookups.items():
+        value = params.get(param)
+        if value in (None, ''):
+            continue
+        if param == 'published':
+            if value.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError("published must be true or false")
+            filters[lookup] = value.lower() in ('true', '1')
+        elif param == 'subject':
+            if not value.isdigit():
+                raise ValueError("subject must be a subject ID")
+            filters[lookup] = int(value)
+        else:
+            filters[lookup] = value
+    return queryset.filter(**filters)
+
+
+class Echo:
+    """A write-only file-like object that hands back what it is given"""
+    def write(self, value):
+        return value
+
+
+def export_content(queryset, columns, export_format):
+    """
+    Yield the rows of `queryset` as CSV or NDJSON text.
+
+    `columns` is a list of (header, lookup) pairs; the queryset is reduced to
+    those lookups with values() and read with a server-side chunked iterator,
+    so memory stays flat however many rows are exported.
+    """
+    headers = [header for header, _ in columns]
+    rows = queryset.values_list(*[lookup for _, lookup in columns]).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(headers, row))) + '\n'
+
+
+async def aexport_content(queryset, columns, export_format):
+    """
+    export_content for responses served under ASGI, which would read a sync
+    iterator whole before sending anything. The generator is advanced
+    EXPORT_CHUNK_SIZE lines at a time in the thread-sensitive worker thread
+    that holds the database connection; values_list().aiterator() would run
+    the query on the event loop.
+    """
+    lines = export_content(queryset, columns, export_format)
+    next_batch = sync_to_async(lambda: ''.join(islice(lines, EXPORT_CHUNK_SIZE)))
+    while batch := await next_batch():
+        yield batch
+
+
+def stream_export(queryset, columns, export_format, filename, asynchronous=False):
+    """Stream an export (see export_content) as a download. Pass `asynchronous=True` under ASGI."""
+    content_type, extension = EXPORT_FORMATS[export_format]
+    content = (aexport_content if asynchronous else export_content)(queryset, columns, export_format)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
+class ExportFile(File):
+    """An export generator handed to a storage backend as it is produced"""
+
+    def __init__(self, content, name):
+        super().__init__(None, name)
+        self.content = content
+
+    def chunks(self, chunk_size=None):
+        for text in self.content:
+            yield text.encode()
+
+    def __iter__(self):
+        return self.chunks()
+
+
+def save_export(queryset, columns, export_format, name):
+    """Write an export to default storage under `name`; returns the stored name"""
+    _, extension = EXPORT_FORMATS[export_format]
+    content = ExportFile(export_content(queryset, columns, export_format), f'{name}.{extension}')
+    return default_storage.save(content.name, content)
@@ -1,19 +1,65 @@
+from django.db.models import F
 from rest_framework import status
 from rest_framework.response import Response
 from teacher.models import Subject
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
-from student.models import Marks, StudentProfile, StudentSubmission
+from student.gradebook import with_rank
+from student.models import GradebookSummary, Marks, StudentProfile, StudentSubmission
+from student.analytics import subject_statistics
 from student.serializers import MarksSerializer, StudentSubmissionSerializer, StudentProfileSerializer
+from student.signals import marks_changed
+from student.utils import (
+    EXPORT_FORMATS, bulk_create_marks, filter_export_queryset, import_marks_file, stream_export,
+)
+from student.tasks import bulk_create_marks_job, export_job
+from user.jobs import enqueue, job_accepted, wants_async
 from user.permissions import IsTeacher, IsStudent, IsTeacherOrAdmin
+from user.mixins import AsyncReadMixin, ConditionalGetMixin, SparseFieldsMixin
+from user.sqlite import immediate_atomic, retry_when_locked
+from user.storage import file_response
+from user.utils import served_by_asgi
 from django.views.decorators.csrf import csrf_exempt
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from .models import StudentSubmission
 
 
+def export_response(view, request, columns, lookups, filename):
+    """
+    Validate the export query params and stream the view's scoped queryset,
+    or queue the export and answer 202 when the client prefers to wait for it.
+    """
+    export_format = request.query_params.get('export_format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return Response(
+            {"error": f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        queryset = filter_export_queryset(view.get_queryset(), request.query_params, lookups)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if wants_async(request):
+        job = enqueue(export_job, {
+            'viewset': f'{type(view).__module__}.{type(view).__qualname__}',
+            'params': {param: request.query_params.get(param) for param in lookups},
+            'columns': columns,
+            'lookups': lookups,
+            'export_format': export_format,
+            'filename': filename,
+        }, user=request.user)
+        return job_accepted(request, job)
+    return stream_export(
+        queryset.order_by('id'), columns, export_format, filename, asynchronous=served_by_asgi(request),
+    )
+
+
 @method_decorator(csrf_exempt, name='dispatch')
-class StudentProfileViewSet(viewsets.ModelViewSet):
+class StudentProfileViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = StudentProfile.objects.all()
     serializer_class = StudentProfileSerializer  # Changed from StudentSubmissionSerializer to StudentProfileSerializer
 
@@ -46,6 +92,43 @@ class StudentProfileViewSet(viewsets.ModelViewSet):
             print(f"Error creating profile: {str(e)}")
             raise
 
+    @action(detail=False, methods=['get'], url_path='gradebook')
+    def gradebook(self, request):
+        """Totals, averages and class rank from the gradebook summary table"""
+        summaries = GradebookSummary.objects.filter(
+            student__in=self.get_queryset(),
+            grade=F('student__grade'),
+        )
+        grade = request.query_params.get('grade')
+        if grade:
+            summaries = summaries.filter(grade=grade)
+
+        rows = with_rank(summaries).order_by('grade', '-average', 'student_id').values(
+            'student_id', 'grade', 'total', 'average', 'subject_count', 'rank',
+            username=F('student__user__username'),
+        )
+        return Response(list(rows))
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """Stream the profiles visible to the current user as CSV or NDJSON"""
+        return export_response(
+            self,
+            request,
+            columns=[
+                ('id', 'id'),
+                ('user_id', 'user_id'),
+                ('username', 'user__username'),
+                ('first_name', 'user__first_name'),
+                ('last_name', 'user__last_name'),
+                ('email', 'user__email'),
+                ('education_level', 'education_level'),
+                ('grade', 'grade'),
+            ],
+            lookups={'subject': 'subjects', 'grade': 'grade'},
+            filename='student-profiles',
+        )
+
     # Add debug endpoint to help diagnose issues
     @action(detail=False, methods=['get'], url_path='debug')
     def debug_profile(self, request):
@@ -61,13 +144,17 @@ class StudentProfileViewSet(viewsets.ModelViewSet):
         })
 
 
-class MarksViewSet(viewsets.ModelViewSet):
+class MarksViewSet(ConditionalGetMixin, SparseFieldsMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Marks.objects.all()
     serializer_class = MarksSerializer
+    # Versions the ETags; bumped when a subject or student name changes
+    cache_namespace = 'marks'
 
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy', 'publish_results', 'bulk_create']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'publish_results', 'bulk_create', 'import_marks']:
             return [IsTeacher()]
+        if self.action == 'statistics':
+            return [IsTeacherOrAdmin()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
@@ -75,10 +162,7 @@ class MarksViewSet(viewsets.ModelViewSet):
 
         if user.role == 'student':
             # Students can only see their published marks or allow them to see unpublished too based on requirements
-            student_profile = StudentProfile.objects.filter(user=user).first()
-            if student_profile:
-                return Marks.objects.filter(student=student_profile, published=True)
-            return Marks.objects.none()
+            return Marks.objects.filter(student__user=user, published=True)
         elif user.role == 'teacher':
             # Teachers can see all marks for subjects they teach
             return Marks.objects.filter(subject__teacher=user)
@@ -109,7 +193,12 @@ class MarksViewSet(viewsets.ModelViewSet):
             filter_kwargs['student__id__in'] = student_ids
 
         # Update marks to published
-        marks_count = Marks.objects.filter(**filter_kwargs).update(published=True)
+        marks_count = Marks.objects.filter(**filter_kwargs).update(published=True, updated_at=timezone.now())
+        marks_changed.send(
+            sender=Marks,
+            subject_ids=[subject.id],
+            student_ids=None if publish_all or not student_ids else student_ids,
+        )
 
         return Response({
             "message": f"Published {marks_count} results successfully",
@@ -136,35 +225,38 @@ class MarksViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        created_count = 0
-        updated_count = 0
-        errors = []
-
-        for item in marks_data:
-            student_id = item.get('student_id')
-            mark_value = item.get('marks')
-
-            if not student_id or mark_value is None:
-                errors.append(f"Missing student_id or marks for item: {item}")
-                continue
-
-            # Find the student profile
-            student = StudentProfile.objects.filter(id=student_id).first()
-            if not student:
-                errors.append(f"Student with ID {student_id} not found")
-                continue
-
-            # Update or create the mark
-            mark, created = Marks.objects.update_or_create(
-                student=student,
-                subject=subject,
-                defaults={'marks': mark_value}
+        if wants_async(request):
+            job = enqueue(
+                bulk_create_marks_job, {'subject_id': subject.id, 'marks_data': marks_data}, user=request.user
             )
+            return job_accepted(request, job)
+
+        return Response(bulk_create_marks(subject, marks_data))
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def import_marks(self, request):
+        """Import marks for one subject from an uploaded CSV or XLSX sheet"""
+        subject_id = request.data.get('subject_id')
+        upload = request.FILES.get('file')
 
-            if created:
-                created_count += 1
-            else:
-                updated_count += 1
+        if not subject_id:
+            return Response({"error": "Subject ID is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not upload:
+            return Response({"error": "A CSV or XLSX file is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check if teacher teaches this subject
+        subject = Subject.objects.filter(id=subject_id, teacher=request.user).first()
+        if not subject:
+            return Response(
+                {"error": "You can only add marks for subjects you teach"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            created_count, updated_count, errors = import_marks_file(subject, upload)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             "message": f"Created {created_count} marks and updated {updated_count} marks",
@@ -173,8 +265,49 @@ class MarksViewSet(viewsets.ModelViewSet):
             "errors": errors
         })
 
+    @action(detail=False, methods=['get'], url_path='statistics')
+    def statistics(self, request):
+        """Class statistics for the marks of one subject"""
+        subject_id = request.query_params.get('subject_id')
+        if not subject_id or not subject_id.isdigit():
+            return Response({"error": "Subject ID is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-class StudentSubmissionViewSet(viewsets.ModelViewSet):
+        subjects = Subject.objects.filter(id=subject_id)
+        if request.user.role == 'teacher':
+            subjects = subjects.filter(teacher=request.user)
+        if not subjects.exists():
+            return Response(
+                {"error": "You can only view statistics for subjects you teach"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        return Response(subject_statistics(int(subject_id)))
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """Stream the marks visible to the current user as CSV or NDJSON"""
+        return export_response(
+            self,
+            request,
+            columns=[
+                ('id', 'id'),
+                ('student_id', 'student_id'),
+                ('username', 'student__user__username'),
+                ('first_name', 'student__user__first_name'),
+                ('last_name', 'student__user__last_name'),
+                ('grade', 'student__grade'),
+                ('subject_id', 'subject_id'),
+                ('subject', 'subject__name'),
+                ('marks', 'marks'),
+                ('published', 'published'),
+                ('updated_at', 'updated_at'),
+            ],
+            lookups={'subject': 'subject', 'grade': 'student__grade', 'published': 'published'},
+            filename='marks',
+        )
+
+
+class StudentSubmissionViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """API endpoint for student assignment submissions"""
     queryset = StudentSubmission.objects.all()
     serializer_class = StudentSubmissionSerializer
@@ -196,7 +329,7 @@ class StudentSubmissionViewSet(viewsets.ModelViewSet):
             
         if user.role == 'student':
             # Students can see only their own submissions
-            return StudentSubmission.objects.filter(student=user)
+            return StudentSubmission.objects.filter(student__user=user)
         elif user.role == 'teacher':
             # Teachers can see submissions for assignments they created or in subjects they teach
             return StudentSubmission.objects.filter(
@@ -205,6 +338,45 @@ class StudentSubmissionViewSet(viewsets.ModelViewSet):
         # Admin can see all submissions
         return StudentSubmission.objects.all()
     
+    @retry_when_locked
     def perform_create(self, serializer):
-        serializer.save(student=self.request.user)
-        serializer.save(student=self.request.user)
+        profile = StudentProfile.objects.filter(user=self.request.user).first()
+        if profile is None:
+            raise PermissionDenied("You need a student profile to submit assignments")
+        with immediate_atomic():
+            serializer.save(student=profile)
+
+    @action(detail=True, methods=['get'], url_path='file')
+    def download(self, request, pk=None):
+        """The submitted file, with ETag revalidation and byte ranges"""
+        submission = self.get_object()
+        return file_response(
+            request, submission.file.storage, submission.file.name, asynchronous=served_by_asgi(request)
+        )
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """Stream the submissions visible to the current user as CSV or NDJSON"""
+        return export_response(
+            self,
+            request,
+            columns=[
+                ('id', 'id'),
+                ('assignment_id', 'assignment_id'),
+                ('assignment', 'assignment__title'),
+                ('subject_id', 'assignment__subject_id'),
+                ('subject', 'assignment__subject__name'),
+                ('student_id', 'student_id'),
+                ('username', 'student__user__username'),
+                ('grade', 'student__grade'),
+                ('file', 'file'),
+                ('submitted_at', 'submitted_at'),
+                ('comments', 'comments'),
+            ],
+            lookups={
+                'subject': 'assignment__subject',
+                'grade': 'student__grade',
+                'published': 'assignment__published',
+            },
+            filename='submissions',
+        )
@@ -0,0 +1,90 @@
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+from student.models import Marks, StudentProfile, StudentSubmission
+from teacher.models import Assignment, Subject
+
+
+def _count(queryset):
+    """A correlated COUNT subquery; ungrouped, so it is 0 rather than NULL when nothing matches"""
+    counted = queryset.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count')
+    return Subquery(counted, output_field=IntegerField())
+
+
+def teacher_dashboard(teacher):
+    """
+    Everything the teacher dashboard shows, in four queries whatever the
+    class sizes: subjects with their counts, enrolment, marks and assignments.
+
+    The payload is columnar: each table is a dict of equal-length lists, so
+    column names are sent once rather than once per row. Per subject,
+    `students` lists indexes into the `students` table and `marks` and
+    `published` are aligned with it, null where no mark is recorded yet.
+    """
+    Enrolment = StudentProfile.subjects.through
+    # The through model has no soft-delete-aware manager of its own
+    enrolled_live = Enrolment.objects.filter(studentprofile__user__is_deleted=False)
+
+    subjects = list(
+        Subject.objects.filter(teacher=teacher)
+        .annotate(
+            enrolled=_count(enrolled_live.filter(subject_id=OuterRef('pk'))),
+            unpublished=_count(Marks.objects.filter(subject_id=OuterRef('pk'), published=False)),
+        )
+        .order_by('name', 'id')
+        .values_list('id', 'name', 'enrolled', 'unpublished')
+    )
+
+    enrolment = (
+        enrolled_live.filter(subject__teacher=teacher)
+        .order_by('studentprofile__user__username', 'studentprofile_id')
+        .values_list(
+            'subject_id', 'studentprofile_id', 'studentprofile__user__username',
+            'studentprofile__user__first_name', 'studentprofile__user__last_name', 'studentprofile__grade',
+        )
+    )
+    students = {'id': [], 'username': [], 'first_name': [], 'last_name': [], 'grade': []}
+    student_index = {}
+    roster = {subject_id: [] for subject_id, *_ in subjects}
+    for subject_id, student_id, *details in enrolment:
+        if student_id not in student_index:
+            student_index[student_id] = len(students['id'])
+            for column, value in zip(students, (student_id, *details)):
+                students[column].append(value)
+        roster[subject_id].append(student_id)
+
+    recorded = {
+        (subject_id, student_id): (value, published)
+        for subject_id, student_id, value, published in
+        Marks.objects.filter(subject__teacher=teacher).values_list('subject_id', 'student_id', 'marks', 'published')
+    }
+
+    subject_table = {
+        'id': [], 'name': [], 'enrolled': [], 'unpublished': [], 'students': [], 'marks': [], 'published': [],
+    }
+    for subject_id, name, enrolled, unpublished in subjects:
+        row = [recorded.get((subject_id, student_id), (None, None)) for student_id in roster[subject_id]]
+        subject_table['id'].append(subject_id)
+        subject_table['name'].append(name)
+        subject_table['enrolled'].append(enrolled)
+        subject_table['unpublished'].append(unpublished)
+        subject_table['students'].append([student_index[student_id] for student_id in roster[subject_id]])
+        subject_table['marks'].append([value for value, _ in row])
+        subject_table['published'].append([published for _, published in row])
+
+    assignments = (
+        Assignment.objects.filter(subject__teacher=teacher)
+        .annotate(submitted=_count(StudentSubmission.objects.filter(
+            assignment_id=OuterRef('pk'), student__subjects=OuterRef('subject_id'),
+        )))
+        .order_by('due_date', 'id')
+        .values_list('id', 'title', 'subject_id', 'due_date', 'published', 'submitted')
+    )
+    enrolled_in = {subject_id: enrolled for subject_id, _, enrolled, _ in subjects}
+    assignment_table = {
+        'id': [], 'title': [], 'subject_id': [], 'due_date': [], 'published': [], 'submitted': [], 'pending': [],
+    }
+    for assignment_id, title, subject_id, due_date, published, submitted in assignments:
+        for column, value in zip(assignment_table, (assignment_id, title, subject_id, due_date, published, submitted)):
+            assignment_table[column].append(value)
+        assignment_table['pending'].append(max(enrolled_in.get(subject_id, 0) - submitted, 0))
+
+    return {'subjects': subject_table, 'students': students, 'assignments': assignment_table}
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teacher', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(condition=models.Q(('published', True)), fields=['subject', '-created_at'], name='assignment_published_subj_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:37
+
+import user.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teacher', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assignment',
+            name='file',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=user.storage.blob_storage, upload_to='assignments/'),
+        ),
+    ]
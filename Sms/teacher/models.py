@@ -2,6 +2,7 @@
 from django.db import models
 from django.conf import settings
 from user.models import User
+from user.storage import blob_storage
 
 class Subject(models.Model):
     name = models.CharField(max_length=100)
@@ -13,6 +14,8 @@ class Subject(models.Model):
         null=True,
         blank=True
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return self.name
 
@@ -26,16 +29,25 @@ class Assignment(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    file = models.FileField(upload_to='assignments/', blank=True, null=True)  # Make file optional
+    file = models.FileField(upload_to='assignments/', storage=blob_storage, max_length=255, blank=True, null=True)  # Make file optional
     due_date = models.DateTimeField()
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='assignments')
     remarks = models.TextField(blank=True, null=True)
     audience = models.CharField(max_length=10, choices=FOR_CHOICES)
     published = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.title
     
     class Meta:
         verbose_name_plural = 'Assignments'
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            # Students: published assignments of their subjects, newest first
+            models.Index(
+                fields=['subject', '-created_at'],
+                condition=models.Q(published=True),
+                name='assignment_published_subj_idx'
+            ),
+        ]
\ No newline at end of file
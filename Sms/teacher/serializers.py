@@ -1,21 +1,23 @@
 from rest_framework import serializers
 from teacher.models import Assignment, Subject
+from user.fieldsets import DynamicFieldsMixin
 from user.models import User
 
-class UserBasicSerializer(serializers.ModelSerializer):
+class UserBasicSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
 
-class SubjectSerializer(serializers.ModelSerializer):
+class SubjectSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     teacher_name = serializers.CharField(source='teacher.username', read_only=True)
 
     class Meta:
         model = Subject
         fields = ['id', 'name', 'teacher', 'teacher_name']
         read_only_fields = ['teacher_name']
+        expandable_fields = ['teacher_name']
 
-class AssignmentSerializer(serializers.ModelSerializer):
+class AssignmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.ReadOnlyField(source='created_by.username')
     subject_name = serializers.ReadOnlyField(source='subject.name')
     
@@ -24,4 +26,5 @@ class AssignmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'description', 'created_at', 'created_by', 
                   'created_by_name', 'file', 'due_date', 'subject', 'subject_name',
                   'remarks', 'audience', 'published']
-        read_only_fields = ['created_by', 'created_at']
\ No newline at end of file
+        read_only_fields = ['created_by', 'created_at']
+        expandable_fields = ['created_by_name', 'subject_name']
\ No newline at end of file
@@ -0,0 +1,51 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from teacher.models import Assignment, Subject
+from user.cache import invalidate_responses
+from user.events import publish_event
+from user.storage import track_blob_references
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+def invalidate_subject_responses(sender, instance, **kwargs):
+    # Assignment and marks payloads carry the subject name. After commit, or a
+    # concurrent read could cache the old rows under the new version.
+    transaction.on_commit(lambda: invalidate_responses('subjects', 'assignments', 'marks'))
+
+
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def invalidate_assignment_responses(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_responses('assignments'))
+
+
+@receiver(post_save, sender=Assignment)
+def push_assignment(sender, instance, created, **kwargs):
+    """Admins, the author and the subject's teacher get every change; students only published ones"""
+    topics = ['role:admin', f'user:{instance.created_by_id}', f'teaching:{instance.subject_id}']
+    if instance.published:
+        topics.append(f'subject:{instance.subject_id}')
+    else:
+        publish_event('assignment.removed', [f'subject:{instance.subject_id}'], {'id': instance.id})
+    publish_event('assignment.created' if created else 'assignment.updated', topics, {
+        'id': instance.id,
+        'title': instance.title,
+        'subject': instance.subject_id,
+        'due_date': instance.due_date,
+        'audience': instance.audience,
+        'published': instance.published,
+        'updated_at': instance.updated_at,
+    })
+
+
+@receiver(post_delete, sender=Assignment)
+def push_assignment_removed(sender, instance, **kwargs):
+    publish_event('assignment.removed', [
+        'role:admin', f'user:{instance.created_by_id}',
+        f'teaching:{instance.subject_id}', f'subject:{instance.subject_id}',
+    ], {'id': instance.id})
+
+
+track_blob_references(Assignment, 'file')
@@ -1,3 +1,163 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import zipfile
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.test import AsyncClient, override_settings
+from django.utils import timezone
+
+from student.models import Marks, StudentProfile, StudentSubmission
+from teacher.dashboard import teacher_dashboard
+from teacher.models import Assignment, Subject
+from teacher.utils import iter_zip, stream_zip
+from teacher.views import AssignmentViewSet, SubjectViewSet
+from user.cache import namespace_version
+from user.models import User
+from user.serializers import CustomTokenObtainPairSerializer
+from user.tests import QueryPlanTestCase, SchoolTestCase
+
+
+class TeacherQueryPlanTests(QueryPlanTestCase):
+    def test_subject_list_for_teacher(self):
+        self.assertNoFullScan(SubjectViewSet, self.teacher)
+
+    def test_assignment_list_for_teacher(self):
+        self.assertNoFullScan(AssignmentViewSet, self.teacher)
+
+    def test_assignment_list_for_student(self):
+        self.assertNoFullScan(AssignmentViewSet, self.student)
+
+
+class SubjectCacheTests(SchoolTestCase):
+    def test_rename_invalidated_after_commit(self):
+        versions = {namespace: namespace_version(namespace) for namespace in ('subjects', 'assignments', 'marks')}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subject.name = 'Maths'
+            self.subject.save()
+            self.assertEqual({namespace: namespace_version(namespace) for namespace in versions}, versions)
+        for namespace, version in versions.items():
+            self.assertNotEqual(namespace_version(namespace), version, namespace)
+
+        self.auth(self.teacher)
+        response = self.client.get('/api/subjects/')
+        self.assertEqual([row['name'] for row in response.data], ['Maths'])
+
+
+class SubmissionZipTests(SchoolTestCase):
+    pdf = os.urandom(300000)
+    text = b'hello ' * 1000
+
+    def setUp(self):
+        super().setUp()
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.assignment = Assignment.objects.create(
+            title='Essay', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student', published=True,
+        )
+        self.submissions = []
+        for profile, name, body in zip(self.students, ('essay.txt', 'essay.pdf', 'essay.PDF'), (self.text, self.pdf, self.pdf)):
+            submission = StudentSubmission(assignment=self.assignment, student=profile)
+            submission.file.save(name, ContentFile(body), save=True)
+            self.submissions.append(submission)
+        self.url = f'/api/assignments/{self.assignment.id}/submissions/download/'
+
+    def test_download(self):
+        self.auth(self.teacher)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="assignment-{self.assignment.id}-submissions.zip"')
+        # Streaming touches storage only
+        with self.assertNumQueries(0):
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['student0.txt', 'student1.pdf', 'student2.PDF'])
+        self.assertEqual(archive.read('student0.txt'), self.text)
+        self.assertEqual(archive.read('student2.PDF'), self.pdf)
+        # Already compressed formats are stored as they are
+        self.assertEqual(archive.getinfo('student0.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('student2.PDF').compress_type, zipfile.ZIP_STORED)
+
+    def test_permissions(self):
+        self.auth(User.objects.create_user('teacher2', password='pw', role='teacher'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.auth(self.students[0].user)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_missing_files_are_skipped(self):
+        first, second = self.submissions[:2]
+        os.remove(first.file.path)
+        with self.assertLogs('teacher.utils', 'WARNING'):
+            body = b''.join(iter_zip([('a.txt', first.file), ('b.pdf', second.file)]))
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(body)).namelist(), ['b.pdf'])
+
+    async def test_streamed_asynchronously_under_asgi(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.teacher).access_token
+        response = await AsyncClient().get(self.url, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(body)).namelist()), 3)
+
+    async def test_asynchronous(self):
+        response = stream_zip([('essay.pdf', self.submissions[1].file)], 'essays', asynchronous=True)
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(zipfile.ZipFile(io.BytesIO(body)).read('essay.pdf'), self.pdf)
+
+
+class TeacherDashboardTests(SchoolTestCase):
+    def assignment(self, subject, title):
+        return Assignment.objects.create(
+            title=title, description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=subject, audience='student', published=True,
+        )
+
+    def test_payload(self):
+        art = Subject.objects.create(name='Art', teacher=self.teacher)
+        self.students[0].subjects.add(art)
+        Marks.objects.create(student=self.students[0], subject=self.subject, marks=70, published=True)
+        Marks.objects.create(student=self.students[1], subject=self.subject, marks=55, published=False)
+        essay = self.assignment(self.subject, 'Essay')
+        StudentSubmission.objects.create(assignment=essay, student=self.students[2], file='essay.txt')
+        self.assignment(art, 'Sketch')
+
+        with self.assertNumQueries(4):
+            data = teacher_dashboard(self.teacher)
+        subjects, students, assignments = data['subjects'], data['students'], data['assignments']
+        self.assertEqual(subjects['name'], ['Art', 'Math'])
+        self.assertEqual(subjects['enrolled'], [1, 5])
+        self.assertEqual(subjects['unpublished'], [0, 1])
+        self.assertEqual(students['username'], [f'student{i}' for i in range(5)])
+        self.assertEqual([[students['username'][i] for i in row] for row in subjects['students']],
+                         [['student0'], [f'student{i}' for i in range(5)]])
+        self.assertEqual(subjects['marks'][1], [70, 55, None, None, None])
+        self.assertEqual(subjects['published'][1], [True, False, None, None, None])
+        self.assertEqual(assignments['title'], ['Essay', 'Sketch'])
+        self.assertEqual(assignments['submitted'], [1, 0])
+        self.assertEqual(assignments['pending'], [4, 1])
+
+    def test_query_count_is_constant(self):
+        for i in range(3):
+            subject = Subject.objects.create(name=f'Subject {i}', teacher=self.teacher)
+            self.assignment(subject, f'Task {i}')
+            for j in range(4):
+                user = User.objects.create_user(f'pupil{i}{j}', password='pw', role='student')
+                profile = StudentProfile.objects.create(user=user, grade='6')
+                profile.subjects.add(subject, self.subject)
+                Marks.objects.create(student=profile, subject=subject, marks=50 + j)
+
+        self.auth(self.teacher)
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/subjects/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['students']['id']), 17)
+        self.assertEqual(response.data['subjects']['enrolled'][0], 17)
+
+    def test_teachers_only(self):
+        self.auth(self.students[0].user)
+        self.assertEqual(self.client.get('/api/subjects/dashboard/').status_code, 403)
@@ -1,6 +1,6 @@
 from rest_framework import status
 from rest_framework.response import Response
-from student.models import StudentProfile
+from student.models import StudentProfile, StudentSubmission
 from user import permissions, serializers
 from django.db.models import Q 
 from user.models import User
@@ -10,16 +10,33 @@ from rest_framework.decorators import action
 from rest_framework import viewsets
 from teacher.serializers import AssignmentSerializer, SubjectSerializer
 from rest_framework.permissions import IsAuthenticated
+from user.cache import astudent_subject_ids, student_subject_ids
+from user.mixins import AsyncReadMixin, CachedListMixin, ConditionalGetMixin, SparseFieldsMixin
+from teacher.utils import stream_zip
+from teacher.dashboard import teacher_dashboard
+from user.storage import file_response
+from user.utils import served_by_asgi
+import os
 
 
-class SubjectViewSet(viewsets.ModelViewSet):
+class SubjectViewSet(ConditionalGetMixin, CachedListMixin, SparseFieldsMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Subject.objects.all()
     serializer_class = SubjectSerializer
+    cache_namespace = 'subjects'
+
+    def get_cache_scope(self):
+        user = self.request.user
+        if user.role == 'teacher':
+            return f'teacher:{user.id}'
+        # Admins and students both see every subject
+        return 'all'
 
     def get_permissions(self):
         if self.action in ['create', 'destroy']:
             # Only admins can create or delete subjects
             return [IsAdmin()]
+        if self.action == 'dashboard':
+            return [IsTeacher()]
         if self.action in ['update', 'partial_update']:
             # Only teachers or admins can update subjects
             return [IsAuthenticated(), (IsTeacher() | IsAdmin())]
@@ -33,6 +50,11 @@ class SubjectViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(unassigned, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='dashboard')
+    def dashboard(self, request):
+        """Subjects, enrolment, marks and submission counts for the teacher dashboard in one call"""
+        return Response(teacher_dashboard(request.user))
+
     @action(detail=False, methods=['get'], url_path='my-subjects')
     def my_subjects(self, request):
         """Get subjects assigned to the current teacher"""
@@ -61,12 +83,29 @@ class SubjectViewSet(viewsets.ModelViewSet):
         # Admin can see all subjects
         return Subject.objects.all()
     
-class AssignmentViewSet(viewsets.ModelViewSet):
+class AssignmentViewSet(ConditionalGetMixin, CachedListMixin, SparseFieldsMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = Assignment.objects.all()
     serializer_class = AssignmentSerializer
+    pagination_ordering = ('-created_at', 'id')
+    cache_namespace = 'assignments'
+
+    def get_cache_scope(self):
+        user = self.request.user
+        if user.role == 'student':
+            # Students enrolled in the same subjects see the same assignments
+            return 'subjects:' + ','.join(str(pk) for pk in student_subject_ids(user))
+        if user.role == 'teacher':
+            return f'teacher:{user.id}'
+        return user.role
+
+    async def aget_cache_scope(self):
+        user = self.request.user
+        if user.role == 'student':
+            return 'subjects:' + ','.join(str(pk) for pk in await astudent_subject_ids(user))
+        return self.get_cache_scope()
 
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'download_submissions']:
             return [IsTeacherOrAdmin()]
         return [IsAuthenticated()]  # <-- use DRF's IsAuthenticated
 
@@ -76,29 +115,55 @@ class AssignmentViewSet(viewsets.ModelViewSet):
             return Assignment.objects.none()
             
         if user.role == 'student':
-            # Students can see assignments for subjects they're enrolled in AND published assignments
-            try:
-                student_profile = StudentProfile.objects.get(user=user)
-                # Get student's enrolled subjects
-                student_subjects = student_profile.subjects.all()
-                
-                return Assignment.objects.filter(
-                    subject__in=student_subjects,
-                    published=True
-                ).distinct()
-            except StudentProfile.DoesNotExist:
-                return Assignment.objects.none()
+            # Students can see assignments for subjects they're enrolled in AND published assignments.
+            # A lazy subquery keeps this one statement (and no rows without a profile).
+            return Assignment.objects.filter(
+                subject__in=Subject.objects.filter(students__user=user),
+                published=True
+            )
                 
         elif user.role == 'teacher':
             # Teachers can see assignments they created or for subjects they teach
+            # A subquery rather than a join lets each side of the OR use its index
             return Assignment.objects.filter(
-                Q(subject__teacher=user) | Q(created_by=user)
-            ).distinct()
+                Q(subject__in=Subject.objects.filter(teacher=user)) | Q(created_by=user)
+            )
         # Admin can see all assignments
         return Assignment.objects.all()
         
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
+
+    @action(detail=True, methods=['get'], url_path='file')
+    def download(self, request, pk=None):
+        """The assignment's attached file, with ETag revalidation and byte ranges"""
+        assignment = self.get_object()
+        if not assignment.file:
+            return Response({"error": "This assignment has no file"}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(
+            request, assignment.file.storage, assignment.file.name, asynchronous=served_by_asgi(request)
+        )
+
+    @action(detail=True, methods=['get'], url_path='submissions/download')
+    def download_submissions(self, request, pk=None):
+        """Stream every submission file of this assignment as one ZIP, named by student username"""
+        assignment = self.get_object()
+        submissions = StudentSubmission.objects.filter(assignment=assignment).exclude(file='')
+        if request.user.role == 'teacher':
+            # Same scope as the submissions list
+            submissions = submissions.filter(assignment__subject__teacher=request.user)
+        submissions = (
+            submissions.select_related('student__user')
+            .only('file', 'student__user__username')
+            .order_by('student__user__username')
+        )
+        # Resolved up front: the archive is written after the view returns
+        entries = [
+            (submission.student.user.username + os.path.splitext(submission.file.name)[1], submission.file)
+            for submission in submissions
+        ]
+        return stream_zip(entries, f'assignment-{assignment.pk}-submissions',
+                          asynchronous=served_by_asgi(request))
     
     def perform_update(self, serializer):
         user = self.request.user
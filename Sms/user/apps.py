@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class UserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user'
+
+    def ready(self):
+        from django.core import checks
+        from django.db.backends.signals import connection_created
+        from user import signals  # noqa: F401
+        from user.db_router import check_sticky_cache
+        from user.sqlite import tune_connection
+
+        connection_created.connect(tune_connection, dispatch_uid='user.sqlite.tune_connection')
+        checks.register(check_sticky_cache, checks.Tags.caches)
@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.admin.models import LogEntry
+from django.core import serializers
+from django.utils import timezone
+
+from student.models import GradebookSummary, Marks, StudentProfile, StudentSubmission
+from user.models import ArchivedUser, UploadSession, User
+from user.sqlite import immediate_atomic, retry_when_locked
+from user.uploads import discard_chunks
+
+# Rows of other people's that point at an archived user are unlinked rather
+# than deleted, and linked again on restore
+DETACHED_FIELDS = (
+    ('teacher.Subject', 'teacher'),
+    ('user.AuditEvent', 'actor'),
+    ('user.Job', 'created_by'),
+)
+
+# Deleting their authors would delete these for everyone (and students'
+# submissions with the assignments), so their authors stay in the hot table
+AUTHORED_FIELDS = (
+    ('teacher.Assignment', 'created_by'),
+    ('user.notice', 'created_by'),
+)
+
+
+def deleted_before(days, now=None):
+    """Soft-deleted users whose deletion is more than `days` days old"""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return User.objects.filter(is_deleted=True, deleted_at__lt=cutoff)
+
+
+def archivable(users):
+    """The users in `users` that author nothing other users still see"""
+    for label, field in AUTHORED_FIELDS:
+        authored = apps.get_model(label)._base_manager.values(field)
+        users = users.exclude(pk__in=authored)
+    return users
+
+
+def owned_rows(user):
+    """The user and every row deleting them would cascade to, in restore order"""
+    rows = [user]
+    profile = StudentProfile.all_objects.filter(user=user).first()
+    if profile is not None:
+        rows.append(profile)
+        for model in (GradebookSummary, Marks, StudentSubmission):
+            rows.extend(model.all_objects.filter(student=profile).order_by('pk'))
+    rows.extend(LogEntry.objects.filter(user=user).order_by('pk'))
+    return rows
+
+
+@retry_when_locked
+def archive_user(user_id, days):
+    """
+    Move a user deleted more than `days` days ago, with their profile,
+    marks, submissions, gradebook and admin log entries, into an
+    ArchivedUser. Returns it, or None if the user no longer qualifies.
+    """
+    with immediate_atomic():
+        # Checked again inside the transaction, in case of a concurrent restore
+        user = archivable(deleted_before(days)).filter(pk=user_id).first()
+        if user is None:
+            return None
+        rows = owned_rows(user)
+
+        detached = {}
+        for label, field in DETACHED_FIELDS:
+            linked = apps.get_model(label)._base_manager.filter(**{field: user})
+            pks = list(linked.values_list('pk', flat=True))
+            if pks:
+                detached[label] = {field: pks}
+                linked.update(**{field: None})
+
+        # Unfinished uploads are not worth keeping
+        for session in UploadSession.objects.filter(owner=user):
+            discard_chunks(session)
+
+        archived = ArchivedUser.objects.create(
+            user_id=user.pk,
+            username=user.username,
+            role=user.role,
+            deleted_at=user.deleted_at,
+            rows=serializers.serialize('python', rows),
+            detached=detached,
+            blobs=[row.file.name for row in rows if isinstance(row, StudentSubmission) and row.file],
+        )
+        # A queryset delete, since User.delete only soft-deletes
+        User.objects.filter(pk=user.pk).delete()
+    return archived
+
+
+def _references_exist(deserialized, known):
+    """
+    False if a row points at something deleted since it was archived; it
+    would have been deleted along with it. Many-to-many links to such rows
+    are dropped.
+    """
+    def exists(model, pk):
+        if (model, pk) not in known:
+            known[model, pk] = model._base_manager.filter(pk=pk).exists()
+        return known[model, pk]
+
+    instance = deserialized.object
+    for field in instance._meta.concrete_fields:
+        value = getattr(instance, field.attname)
+        if field.is_relation and value is not None and not exists(field.related_model, value):
+            return False
+    for name, pks in (deserialized.m2m_data or {}).items():
+        related = instance._meta.get_field(name).related_model
+        deserialized.m2m_data[name] = [pk for pk in pks if exists(related, pk)]
+    return True
+
+
+@retry_when_locked
+def restore_archived_user(user_id):
+    """
+    Put an archived user and their rows back under their old primary keys,
+    relink what was detached from them, and undelete them. Raises
+    ArchivedUser.DoesNotExist, or ValueError if their username has been
+    taken since. Returns the user.
+    """
+    with immediate_atomic():
+        archived = ArchivedUser.objects.get(user_id=user_id)
+        if User.objects.filter(username=archived.username).exists():
+            raise ValueError(f"The username {archived.username} has been taken since the user was archived.")
+
+        known = {}
+        # Fields dropped from a model since the user was archived are skipped
+        for deserialized in serializers.deserialize('python', archived.rows, ignorenonexistent=True):
+            if _references_exist(deserialized, known):
+                deserialized.save()
+
+        for label, fields in archived.detached.items():
+            model = apps.get_model(label)
+            for field, pks in fields.items():
+                # Unless they have been linked to someone else in the meantime
+                model._base_manager.filter(pk__in=pks, **{f'{field}__isnull': True}).update(**{field: archived.user_id})
+
+        archived.delete()
+        user = User.objects.get(pk=archived.user_id)
+        user.restore()
+    return user
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def audit_config():
+    config = {
+        'ASYNC': True,
+        'QUEUE_SIZE': 10000,
+        'BATCH_SIZE': 100,
+        'FLUSH_INTERVAL_MS': 500,
+    }
+    config.update(getattr(settings, 'AUDIT_LOG', {}))
+    return config
+
+
+class AuditLogWriter:
+    """
+    Buffer audit events in a bounded queue and persist them from one
+    background thread with bulk_create, every BATCH_SIZE events or
+    FLUSH_INTERVAL_MS milliseconds, whichever comes first.
+
+    Request threads only pay for a queue put. When the queue is full the
+    event is dropped and logged rather than blocking the request.
+    """
+
+    def __init__(self, queue_size, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, event):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning("Audit queue full, dropped event: %s", event.action)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                batch = self._collect()
+                if batch:
+                    self._write(batch)
+        finally:
+            connection.close()
+
+    def _collect(self):
+        """Block for the first event, then gather until the batch or the interval is full"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        from user.models import AuditEvent
+        try:
+            AuditEvent.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            logger.exception("Failed to write %d audit events", len(batch))
+
+    def flush(self):
+        """Write everything still queued from the calling thread"""
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+
+    def shutdown(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = audit_config()
+                _writer = AuditLogWriter(
+                    queue_size=config['QUEUE_SIZE'],
+                    batch_size=config['BATCH_SIZE'],
+                    flush_interval=config['FLUSH_INTERVAL_MS'] / 1000,
+                )
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+def record_event(user, action, details=None):
+    """Queue an audit event, or write it immediately when AUDIT_LOG['ASYNC'] is off"""
+    from user.models import AuditEvent
+
+    authenticated = getattr(user, 'is_authenticated', False)
+    event = AuditEvent(
+        actor_id=user.id if authenticated else None,
+        actor_username=getattr(user, 'username', '') or '',
+        action=action[:255],
+        details='' if details is None else str(details),
+    )
+    if audit_config()['ASYNC']:
+        get_writer().enqueue(event)
+    else:
+        event.save()
@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from user.models import User
+
+# Columns kept per cached user; anything else is deferred and loaded on access
+SNAPSHOT_FIELDS = (
+    'id', 'username', 'first_name', 'last_name', 'email', 'role',
+    'is_active', 'is_deleted', 'is_staff', 'is_superuser',
+)
+
+
+def user_cache_config():
+    config = {
+        'CACHE': 'default',
+        'TTL': 300,
+    }
+    config.update(getattr(settings, 'JWT_USER_CACHE', {}))
+    return config
+
+
+class UserSnapshotCache:
+    """
+    User rows behind JWT-authenticated requests, kept for TTL seconds in the
+    Django cache named by JWT_USER_CACHE['CACHE'].
+
+    The User save/delete signal handlers drop entries once the change
+    commits. A shared cache (Redis, Memcached, the database) makes that reach
+    every worker; with a process-local one such as locmem, other processes
+    can serve a stale row until the TTL ends.
+    """
+    key_prefix = 'jwt-user'
+
+    def _cache(self):
+        return caches[user_cache_config()['CACHE']]
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}:{user_id}'
+
+    def get(self, user_id):
+        return self._cache().get(self._key(user_id))
+
+    def set(self, user_id, snapshot):
+        self._cache().set(self._key(user_id), snapshot, timeout=user_cache_config()['TTL'])
+
+    def invalidate(self, user_id):
+        self._cache().delete(self._key(user_id))
+
+
+user_cache = UserSnapshotCache()
+
+
+def user_from_snapshot(snapshot):
+    """Build a User whose snapshot fields are loaded and the rest deferred"""
+    # from_db expects the values in concrete field order
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in snapshot]
+    return User.from_db(User.objects.db, field_names, [snapshot[name] for name in field_names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user from the token claims and a
+    cache (see UserSnapshotCache) instead of loading the User row on every
+    request.
+
+    Tokens carry `role` and `is_deleted` claims (see
+    CustomTokenObtainPairSerializer). Both are checked against the user, so
+    a token issued before a deletion or a role change stops working and its
+    holder has to sign in again. The returned User has the commonly read
+    columns populated; other columns load lazily on first access.
+    """
+
+    def _user_id(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if validated_token.get('is_deleted'):
+            raise AuthenticationFailed(_("This account has been deleted."), code="user_deleted")
+        return user_id
+
+    def _snapshot_queryset(self, user_id):
+        return User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(*SNAPSHOT_FIELDS)
+
+    def _remember(self, user_id, snapshot):
+        if snapshot is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        user_cache.set(user_id, snapshot)
+
+    def _user_from(self, snapshot, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not snapshot['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if snapshot['is_deleted']:
+            raise AuthenticationFailed(_("This account has been deleted."), code="user_deleted")
+        if validated_token.get('role', snapshot['role']) != snapshot['role']:
+            raise AuthenticationFailed(
+                _("The account's role has changed. Please sign in again."), code="role_changed"
+            )
+
+        return user_from_snapshot(snapshot)
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            snapshot = self._snapshot_queryset(user_id).first()
+            self._remember(user_id, snapshot)
+        return self._user_from(snapshot, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        snapshot = user_cache.get(user_id)
+        if snapshot is None:
+            snapshot = await self._snapshot_queryset(user_id).afirst()
+            self._remember(user_id, snapshot)
+        return self._user_from(snapshot, validated_token)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; only a cache miss touches the database"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
@@ -0,0 +1,90 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+RESPONSE_CACHE_ALIAS = 'responses'
+
+
+def response_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def _fresh_version():
+    # Time based, so a version key evicted by the LRU never restarts at a
+    # number that older entries were stored under
+    return time.time_ns()
+
+
+def namespace_version(namespace):
+    cache = response_cache()
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        version = _fresh_version()
+        if not cache.add(_version_key(namespace), version, timeout=None):
+            version = cache.get(_version_key(namespace), version)
+    return version
+
+
+def invalidate_responses(*namespaces):
+    """Orphan every cached response of the given namespaces by bumping their version"""
+    cache = response_cache()
+    for namespace in namespaces:
+        try:
+            cache.incr(_version_key(namespace))
+        except ValueError:
+            cache.set(_version_key(namespace), _fresh_version(), timeout=None)
+
+
+def response_cache_key(namespace, scope, request):
+    """Namespace version + effective scope + the full request path and query"""
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{namespace}:{namespace_version(namespace)}:{scope}:{path}'
+
+
+def _student_subjects_key(user_id):
+    return f'student-subjects:{user_id}'
+
+
+def student_subject_ids(user):
+    """Sorted IDs of the subjects a student is enrolled in, cached until they change"""
+    from student.models import StudentProfile
+
+    cache = response_cache()
+    key = _student_subjects_key(user.id)
+    subject_ids = cache.get(key)
+    if subject_ids is None:
+        subject_ids = sorted(
+            StudentProfile.subjects.through.objects
+            .filter(studentprofile__user=user)
+            .values_list('subject_id', flat=True)
+        )
+        cache.set(key, subject_ids, timeout=getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    return subject_ids
+
+
+async def astudent_subject_ids(user):
+    """student_subject_ids through the async ORM"""
+    from student.models import StudentProfile
+
+    cache = response_cache()
+    key = _student_subjects_key(user.id)
+    subject_ids = cache.get(key)
+    if subject_ids is None:
+        subject_ids = sorted([
+            subject_id async for subject_id in
+            StudentProfile.subjects.through.objects
+            .filter(studentprofile__user=user)
+            .values_list('subject_id', flat=True)
+        ])
+        cache.set(key, subject_ids, timeout=getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+    return subject_ids
+
+
+def forget_student_subjects(*user_ids):
+    response_cache().delete_many([_student_subjects_key(user_id) for user_id in user_ids])
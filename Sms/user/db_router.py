@@ -0,0 +1,147 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject, empty
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+def replicas_config():
+    config = {
+        'ALIASES': [],
+        'STICKY_SECONDS': 10,
+        'CACHE': 'default',
+    }
+    config.update(getattr(settings, 'DATABASE_REPLICAS', {}))
+    return config
+
+
+def check_sticky_cache(app_configs, **kwargs):
+    """
+    System check: with replicas configured, the read-your-writes pins must
+    live in a cache every worker process shares, or a user's next request
+    may land on a worker that never saw the pin and read a lagging replica.
+    """
+    config = replicas_config()
+    if not config['ALIASES']:
+        return []
+    backend = settings.CACHES.get(config['CACHE'], {}).get('BACKEND')
+    if backend is None:
+        return [checks.Error(
+            f"DATABASE_REPLICAS['CACHE'] names '{config['CACHE']}', which is not in CACHES.",
+            id='user.E001',
+        )]
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            f"DATABASE_REPLICAS['CACHE'] ('{config['CACHE']}') uses {backend}, which is private to each process.",
+            hint="Use a cache all workers share, such as Redis, Memcached, the database or files.",
+            id='user.E002',
+        )]
+    return []
+
+
+def _sticky_key(user_id):
+    return f'db-sticky:{user_id}'
+
+
+class RoutingState:
+    """What the router knows about the request being served"""
+
+    def __init__(self, request):
+        self.request = request
+        self.safe = request.method in SAFE_METHODS
+        self.wrote = False
+        self.replica = None
+        self._pinned = None
+
+    def user_id(self):
+        """The authenticated user's id, once authentication has run"""
+        user = self.request.__dict__.get('user')
+        if isinstance(user, LazyObject):
+            # Evaluating a lazy user here would query the database from inside the router
+            user = None if user._wrapped is empty else user._wrapped
+        if user is None or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def pinned(self):
+        """True while the user is within STICKY_SECONDS of their last write"""
+        if self._pinned is None:
+            user_id = self.user_id()
+            if user_id is None:
+                return False
+            cache = caches[replicas_config()['CACHE']]
+            self._pinned = cache.get(_sticky_key(user_id)) is not None
+        return self._pinned
+
+
+def begin_request(request):
+    """Route the current context's queries for `request`; returns the state and a reset token"""
+    state = RoutingState(request)
+    return state, _routing_state.set(state)
+
+
+def end_request(state, token, status_code):
+    """Pin a user who just wrote successfully to the primary, then stop routing for the request"""
+    _routing_state.reset(token)
+    if state.safe or status_code >= 400:
+        return
+    user_id = state.user_id()
+    if user_id is not None:
+        config = replicas_config()
+        caches[config['CACHE']].set(_sticky_key(user_id), True, timeout=config['STICKY_SECONDS'])
+
+
+class ReplicaRouter:
+    """
+    Send reads of safe-method requests to the replicas in
+    DATABASE_REPLICAS['ALIASES'] and everything else to the primary
+    ('default').
+
+    A request reads from one replica throughout. It reads from the primary
+    instead once it has written anything, inside a transaction, or when its
+    user wrote within the last STICKY_SECONDS, so users always see their own
+    changes. Queries outside a request (jobs, commands, streamed bodies)
+    use the primary. ReplicaRoutingMiddleware tells the router which
+    request it is serving; with no aliases configured nothing changes.
+
+    Replicas are expected to lag the primary by well under STICKY_SECONDS.
+    Other users may briefly see older data, and so may the response cache
+    entries their requests fill.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or not state.safe or state.wrote:
+            return DEFAULT_DB_ALIAS
+        aliases = replicas_config()['ALIASES']
+        if not aliases or connections[DEFAULT_DB_ALIAS].in_atomic_block or state.pinned():
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(aliases)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows, so objects read from any of them relate
+        databases = {DEFAULT_DB_ALIAS, *replicas_config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.tokens import Token
+
+logger = logging.getLogger(__name__)
+
+
+def events_config():
+    config = {
+        'BACKEND': 'user.events.InProcessBroker',
+        'QUEUE_SIZE': 100,
+        'HISTORY_SIZE': 1000,
+        'HEARTBEAT': 15,
+        'POLL_INTERVAL_MS': 500,
+        'RETENTION': 3600,
+        'STREAM_TOKEN_LIFETIME': 60,
+    }
+    config.update(getattr(settings, 'PUSH_EVENTS', {}))
+    return config
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    topics: frozenset
+    data: str  # JSON, encoded once per event rather than once per subscriber
+
+    def encode(self):
+        """The event in text/event-stream framing"""
+        return f'id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n'
+
+
+class Subscription:
+    """
+    One connected client: the topics it may receive and a bounded queue that
+    lives on the client's event loop. A client that falls QUEUE_SIZE events
+    behind is disconnected; EventSource reconnects with Last-Event-ID and
+    catches up from the broker's history.
+    """
+
+    def __init__(self, topics, queue_size):
+        self.topics = frozenset(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+
+    def deliver(self, event):
+        # Always runs on self.loop
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout):
+        """The next event, None once disconnected, or TimeoutError when idle"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class BaseBroker(ABC):
+    """
+    Fan events out to the subscriptions of this process.
+
+    Backends decide how a published event reaches every process: subclasses
+    implement `publish` and `replay`, and call `_fan_out` for each event that
+    should reach local subscribers. Publishing is synchronous and safe to call
+    from any thread; delivery is scheduled onto each subscriber's loop.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    @abstractmethod
+    def publish(self, event_type, topics, data):
+        """Send an event to the subscribers of `topics` in every process"""
+
+    def replay(self, topics, last_event_id):
+        """Events after `last_event_id` on any of `topics`, oldest first"""
+        return []
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics, self.config['QUEUE_SIZE'])
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _fan_out(self, event):
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.topics & event.topics]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The client's loop has shut down
+                self.unsubscribe(subscription)
+
+
+class InProcessBroker(BaseBroker):
+    """
+    Deliver events within one process, keeping the last HISTORY_SIZE events
+    for Last-Event-ID replay. Suitable for a single ASGI worker.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        # Seeded from the clock so IDs keep increasing across restarts and a
+        # reconnecting client's Last-Event-ID never hides newer events
+        self._ids = itertools.count(time.time_ns() // 1000)
+        self._history = deque(maxlen=config['HISTORY_SIZE'])
+
+    def publish(self, event_type, topics, data):
+        with self._lock:
+            event = Event(next(self._ids), event_type, frozenset(topics), data)
+            self._history.append(event)
+        self._fan_out(event)
+
+    def replay(self, topics, last_event_id):
+        with self._lock:
+            history = list(self._history)
+        return [e for e in history if e.id > last_event_id and e.topics & topics]
+
+
+class DatabaseBroker(BaseBroker):
+    """
+    Relay events between worker processes through the PushEvent table.
+
+    A local stand-in for a Redis or Postgres pub/sub backend: publishing
+    inserts a row, and one thread per process polls for new rows every
+    POLL_INTERVAL_MS while it has subscribers. Rows older than RETENTION
+    seconds are pruned by the poller and bound how far back clients can
+    replay.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._poller = None
+        self._last_prune = 0.0
+
+    def publish(self, event_type, topics, data):
+        from user.models import PushEvent
+        PushEvent.objects.create(event_type=event_type, topics=sorted(topics), data=data)
+
+    def replay(self, topics, last_event_id):
+        from user.models import PushEvent
+        rows = PushEvent.objects.filter(id__gt=last_event_id).order_by('id')
+        events = (row.as_event() for row in rows.iterator())
+        return [event for event in events if event.topics & topics]
+
+    def subscribe(self, topics):
+        subscription = super().subscribe(topics)
+        self._ensure_polling()
+        return subscription
+
+    def _ensure_polling(self):
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='push-event-poller', daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        from user.models import PushEvent
+        interval = self.config['POLL_INTERVAL_MS'] / 1000
+        try:
+            last_id = PushEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            while True:
+                with self._lock:
+                    if not self._subscriptions:
+                        # Stop while holding the lock so a new subscriber starts a fresh poller
+                        self._poller = None
+                        return
+                try:
+                    for row in PushEvent.objects.filter(id__gt=last_id).order_by('id'):
+                        last_id = row.id
+                        self._fan_out(row.as_event())
+                    self._prune()
+                except Exception:
+                    logger.exception("Polling push events failed")
+                time.sleep(interval)
+        except Exception:
+            logger.exception("Push event poller stopped")
+            with self._lock:
+                self._poller = None
+        finally:
+            connection.close()
+
+    def _prune(self):
+        from user.models import PushEvent
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        cutoff = timezone.now() - timedelta(seconds=self.config['RETENTION'])
+        PushEvent.objects.filter(created_at__lt=cutoff).delete()
+
+
+class StreamToken(Token):
+    """
+    A short-lived token that opens event streams and nothing else. EventSource
+    cannot send an Authorization header, so the token travels in the URL;
+    keeping access tokens out of it keeps them out of access logs.
+
+    It carries the claims CachedJWTAuthentication checks, and `session_exp`,
+    the expiry of the access token it was issued for, when the stream ends.
+    """
+    token_type = 'stream'
+    lifetime = timedelta(seconds=60)
+
+    @classmethod
+    def for_access_token(cls, user, access_token):
+        token = cls.for_user(user)
+        token.set_exp(lifetime=timedelta(seconds=events_config()['STREAM_TOKEN_LIFETIME']))
+        for claim in ('role', 'is_deleted'):
+            token[claim] = access_token.get(claim, getattr(user, claim))
+        token['session_exp'] = access_token['exp']
+        return token
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                config = events_config()
+                _broker = import_string(config['BACKEND'])(config)
+    return _broker
+
+
+def publish_event(event_type, topics, data):
+    """
+    Publish a small delta event to `topics` once the current transaction
+    commits, so clients never hear about a write that was rolled back.
+    """
+    topics = set(topics)
+    if not topics:
+        return
+    payload = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+    def send():
+        try:
+            get_broker().publish(event_type, topics, payload)
+        except Exception:
+            logger.exception("Failed to publish %s event", event_type)
+
+    transaction.on_commit(send)
+
+
+def subscription_topics(user):
+    """
+    Everything `user` may hear about:
+
+    - `user:<id>` their own notices and assignments
+    - `role:<role>` notices for their audience; admins hear every event
+    - `student:<profile id>`, `subject:<id>` a student's results and the
+      published assignments of their subjects
+    - `teaching:<subject id>` every assignment of a teacher's subjects
+
+    Topics are fixed when the stream opens; enrolment changes apply on the
+    client's next reconnect.
+    """
+    from student.models import StudentProfile
+    from teacher.models import Subject
+
+    topics = {f'user:{user.id}', f'role:{user.role}'}
+    if user.role == 'student':
+        for profile_id, subject_id in (
+            StudentProfile.objects.filter(user=user).values_list('id', 'subjects')
+        ):
+            topics.add(f'student:{profile_id}')
+            if subject_id is not None:
+                topics.add(f'subject:{subject_id}')
+    elif user.role == 'teacher':
+        topics.update(
+            f'teaching:{subject_id}'
+            for subject_id in Subject.objects.filter(teacher=user).values_list('id', flat=True)
+        )
+    return topics
@@ -0,0 +1,235 @@
+from time import perf_counter
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.functional import cached_property
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _tree(paths):
+    """{'subject_details': ['name'], 'id': []} from ['subject_details.name', 'id']"""
+    tree = {}
+    for path in paths:
+        name, _, rest = path.partition('.')
+        tree.setdefault(name, [])
+        if rest:
+            tree[name].append(rest)
+    return tree
+
+
+def _split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+class Fieldset:
+    """
+    The fields a client asked for. `fields` is the exact set to render,
+    while `expand` adds expandable fields to the compact representation;
+    both take dotted paths into nested serializers (`subject_details.name`).
+    """
+
+    def __init__(self, fields=(), expand=()):
+        self.fields = _tree(fields) if fields else None
+        self.expand = _tree(expand)
+
+    @classmethod
+    def from_request(cls, request):
+        """The request's fieldset, or None when it asked for neither param"""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = request.query_params
+        fields = _split(params.get(FIELDS_PARAM))
+        # An empty `fields` selects nothing, so it is ignored like a missing one
+        if not fields and EXPAND_PARAM not in params:
+            return None
+        return cls(fields, _split(params.get(EXPAND_PARAM)))
+
+    def select(self, available, expandable=()):
+        """The names in `available` to render, in their declared order"""
+        requested = set(self.fields or ()) | set(self.expand)
+        unknown = requested - set(available)
+        if unknown:
+            raise serializers.ValidationError({FIELDS_PARAM: f"Unknown fields: {', '.join(sorted(unknown))}"})
+        wanted = requested if self.fields is not None else (set(available) - set(expandable)) | requested
+        return [name for name in available if name in wanted]
+
+    def child(self, name):
+        """The fieldset of a nested serializer, or None to render it whole"""
+        fields = (self.fields or {}).get(name, [])
+        expand = self.expand.get(name, [])
+        if not fields and not expand:
+            return None
+        return Fieldset(fields, expand)
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for `?fields=` and `?expand=` on safe requests.
+
+    Without either param the serializer renders every field, as before. With
+    `fields`, only the listed fields are rendered. With `expand` alone, the
+    fields in `Meta.expandable_fields` (nested objects and the names that
+    need a join) are left out unless listed. Only the top-level serializer
+    reads the query string; nested serializers get their part of a dotted
+    path. Unknown names are a validation error.
+
+    `Meta.field_lookups` maps fields whose source is not a plain attribute
+    path, such as SerializerMethodFields, to the model lookups they read, so
+    `plan_queryset` can load exactly what the rendered fields need.
+
+    Top-level serializers add the time spent in `to_representation` to the
+    request's RequestTimingMiddleware timer, when it is sampled.
+    """
+
+    def __init__(self, *args, fieldset=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fieldset = fieldset
+
+    @property
+    def fieldset(self):
+        if self._fieldset is not None:
+            return self._fieldset
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None
+        return Fieldset.from_request(self.context.get('request'))
+
+    @cached_property
+    def _request_timer(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None
+        return getattr(self.context.get('request'), '_request_timer', None)
+
+    def to_representation(self, instance):
+        timer = self._request_timer
+        if timer is None:
+            return super().to_representation(instance)
+        start = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timer.serialize_time += perf_counter() - start
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.fieldset
+        if fieldset is None:
+            return fields
+        selected = {
+            name: fields[name]
+            for name in fieldset.select(fields, getattr(self.Meta, 'expandable_fields', ()))
+        }
+        for name, field in selected.items():
+            child = fieldset.child(name)
+            if child is None:
+                continue
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if not isinstance(nested, DynamicFieldsMixin):
+                raise serializers.ValidationError({FIELDS_PARAM: f"'{name}' has no fields to select"})
+            nested._fieldset = child
+        return selected
+
+
+class QueryPlan:
+    """
+    The select_related, prefetch_related and only() a serializer's rendered
+    fields need. Lookups that cannot be resolved to model fields (a property,
+    say) leave the columns undeferred rather than risk a query per row.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.select = set()
+        self.only = {model._meta.pk.name}
+        self.prefetch = {}
+        self.complete = True
+
+    def add(self, lookup, join=False):
+        """
+        Load `lookup`, and with `join` the object a relation lookup ends at.
+        Returns the nested plan when the lookup ends at a to-many relation.
+        """
+        model = self.model
+        parts = lookup.split('__')
+        for index, part in enumerate(parts):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                self.complete = False
+                return None
+            path = '__'.join(parts[:index + 1])
+            rest = '__'.join(parts[index + 1:])
+            if field.many_to_many or field.one_to_many:
+                plan = self.prefetch.setdefault(path, QueryPlan(field.related_model))
+                if field.one_to_many:
+                    # The prefetch matches rows back to their parent by this key
+                    plan.only.add(field.field.name)
+                return plan.add(rest) if rest else plan
+            if not field.concrete:
+                self.complete = False
+                return None
+            self.only.add(path)
+            if not field.is_relation or not (rest or join):
+                return None
+            self.select.add(path)
+            if not rest:
+                return None
+            model = field.related_model
+        return None
+
+    def add_serializer(self, serializer, prefix=''):
+        lookups = getattr(getattr(serializer, 'Meta', None), 'field_lookups', {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in lookups:
+                for lookup in lookups[name]:
+                    self.add(prefix + lookup)
+                continue
+            if field.source == '*':
+                self.complete = False
+                continue
+            path = prefix + '__'.join(field.source_attrs)
+            if isinstance(field, serializers.ListSerializer):
+                plan = self.add(path)
+                if plan is None:
+                    continue
+                plan.add_serializer(field.child)
+            elif isinstance(field, serializers.BaseSerializer):
+                self.add(path, join=True)
+                self.add_serializer(field, f'{path}__')
+            else:
+                self.add(path)
+        return self
+
+    def apply(self, queryset, defer=True):
+        if self.select:
+            queryset = queryset.select_related(*sorted(self.select))
+        if self.complete and defer:
+            queryset = queryset.only(*sorted(self.only))
+        for path, plan in sorted(self.prefetch.items()):
+            related = plan.apply(plan.model._default_manager.all(), defer)
+            queryset = queryset.prefetch_related(Prefetch(path, queryset=related))
+        return queryset
+
+
+def plan_queryset(serializer, queryset, lookups=(), defer=True):
+    """
+    `queryset` joined, prefetched and narrowed to what `serializer` will
+    render, plus any `lookups` the view itself reads from the rows. Without
+    `defer` every column is loaded, for callers that cannot afford a
+    deferred-field query when the plan misses one.
+    """
+    plan = QueryPlan(queryset.model).add_serializer(serializer)
+    for lookup in lookups:
+        plan.add(lookup)
+    return plan.apply(queryset, defer)
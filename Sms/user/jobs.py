@@ -0,0 +1,308 @@
+import logging
+import os
+import random
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+
+from .events import publish_event
+
+logger = logging.getLogger(__name__)
+
+
+def jobs_config():
+    config = {
+        'QUEUES': {'default': 4},
+        'POLL_INTERVAL_MS': 1000,
+        'LEASE': 60,
+        'BACKOFF': 5,
+        'MAX_BACKOFF': 3600,
+        'RETENTION': 7 * 24 * 60 * 60,
+    }
+    config.update(getattr(settings, 'JOB_QUEUE', {}))
+    return config
+
+
+class PermanentJobError(Exception):
+    """Raised by a task whose job cannot succeed on a retry; the job fails at once"""
+
+
+def task(queue='default', priority=0, max_attempts=3):
+    """
+    Mark a function as a background task and set its defaults. Tasks are
+    called as `func(job, **kwargs)` by a worker; their return value must be
+    JSON serializable and is stored as the job's result. Exceptions are
+    retried up to `max_attempts`, except PermanentJobError.
+    """
+    def decorate(func):
+        func.job_options = {'queue': queue, 'priority': priority, 'max_attempts': max_attempts}
+        return func
+    return decorate
+
+
+def wants_async(request):
+    """True when the client asked for a 202 and a job rather than waiting"""
+    prefer = request.headers.get('Prefer', '')
+    if 'respond-async' in [part.strip() for part in prefer.split(',')]:
+        return True
+    return request.query_params.get('async', '').lower() in ('1', 'true')
+
+
+def job_accepted(request, job):
+    """202 Accepted pointing at the job's status endpoint"""
+    location = request.build_absolute_uri(reverse('job-detail', args=[job.pk]))
+    return Response(
+        {"job_id": job.pk, "status": job.status, "status_url": location},
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': location},
+    )
+
+
+def enqueue(func, kwargs=None, user=None, queue=None, priority=None, max_attempts=None, delay=0):
+    """
+    Queue `func` (a @task function or its dotted path) to run with `kwargs`.
+
+    The job is an ordinary row, so it commits or rolls back with the
+    surrounding transaction and no worker can pick it up before the data it
+    needs is visible.
+    """
+    from .models import Job
+
+    if isinstance(func, str):
+        path = func
+        func = import_string(path)
+    else:
+        path = f'{func.__module__}.{func.__qualname__}'
+    options = getattr(func, 'job_options', {})
+    queue = queue or options.get('queue', 'default')
+    if queue not in jobs_config()['QUEUES']:
+        raise ValueError(f"Unknown job queue '{queue}'")
+    return Job.objects.create(
+        task=path,
+        kwargs=kwargs or {},
+        created_by=user if getattr(user, 'is_authenticated', False) else None,
+        queue=queue,
+        priority=options.get('priority', 0) if priority is None else priority,
+        max_attempts=max_attempts or options.get('max_attempts', 3),
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def backoff(attempts, config=None):
+    """Seconds before retry number `attempts`: doubling, capped, with jitter"""
+    config = config or jobs_config()
+    delay = min(config['MAX_BACKOFF'], config['BACKOFF'] * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def purge_finished(now=None, config=None):
+    """
+    Delete jobs that finished more than RETENTION seconds ago, together with
+    the file their result names (see JobViewSet.download). Returns the
+    number of jobs deleted.
+    """
+    from .models import Job
+
+    config = config or jobs_config()
+    cutoff = (now or timezone.now()) - timedelta(seconds=config['RETENTION'])
+    expired = Job.objects.filter(status__in=('succeeded', 'failed'), finished_at__lt=cutoff)
+    purged = 0
+    for pk, result in list(expired.values_list('pk', 'result')):
+        if not Job.objects.filter(pk=pk).delete()[0]:
+            continue
+        purged += 1
+        name = result.get('file') if isinstance(result, dict) else None
+        if name:
+            default_storage.delete(name)
+            try:
+                # Exports are saved in a directory of their own
+                os.rmdir(os.path.dirname(default_storage.path(name)))
+            except (NotImplementedError, OSError):
+                pass
+    return purged
+
+
+class Worker:
+    """
+    Run queued jobs from a pool of threads.
+
+    Jobs are claimed with one conditional UPDATE each, highest priority
+    first, and only while their queue has fewer running jobs than its limit
+    in JOB_QUEUE['QUEUES']. The limit holds across every worker process
+    sharing the database. Running jobs hold a lease that is renewed while the
+    worker is alive; jobs whose lease expires are put back on the queue.
+    Finished jobs and their files are purged after RETENTION seconds.
+    """
+    purge_interval = 3600  # seconds between purges of finished jobs
+
+    def __init__(self, queues=None, threads=None, name=None):
+        self.config = jobs_config()
+        limits = self.config['QUEUES']
+        unknown = set(queues or ()) - set(limits)
+        if unknown:
+            raise ValueError(f"Unknown job queues: {', '.join(sorted(unknown))}")
+        self.limits = {queue: limits[queue] for queue in (queues or limits)}
+        self.threads = threads or sum(self.limits.values())
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._running = {}
+        self._last_renewal = 0.0
+        self._last_purge = 0.0
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def run(self, once=False):
+        """Work until stopped, or with `once` until no job is ready"""
+        from .models import Job
+
+        lease = self.config['LEASE']
+        poll = self.config['POLL_INTERVAL_MS'] / 1000
+        pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job-worker')
+        try:
+            while not self._stopping.is_set():
+                self._wake.clear()
+                now = timezone.now()
+                if now.timestamp() - self._last_renewal >= lease / 3:
+                    self._renew_leases(now)
+                    self.recover_expired(now)
+                if now.timestamp() - self._last_purge >= self.purge_interval:
+                    self._last_purge = now.timestamp()
+                    purge_finished(now, self.config)
+
+                claimed = 0
+                while len(self._running) < self.threads and not self._stopping.is_set():
+                    job = self.claim()
+                    if job is None:
+                        break
+                    claimed += 1
+                    future = pool.submit(self._execute, job)
+                    self._running[job.pk] = future
+                    future.add_done_callback(lambda _, pk=job.pk: self._done(pk))
+
+                if once and not claimed and not self._running:
+                    break
+                if not claimed:
+                    self._wake.wait(poll)
+        finally:
+            pool.shutdown(wait=True)
+            # Jobs cut short by the shutdown go back on the queue
+            Job.objects.filter(status='running', locked_by=self.name).update(
+                status='queued', locked_by='', locked_at=None
+            )
+            connection.close()
+
+    def _done(self, pk):
+        self._running.pop(pk, None)
+        self._wake.set()
+
+    def _renew_leases(self, now):
+        from .models import Job
+        self._last_renewal = now.timestamp()
+        if self._running:
+            Job.objects.filter(pk__in=list(self._running), locked_by=self.name).update(locked_at=now)
+
+    def recover_expired(self, now=None):
+        """Requeue running jobs whose worker stopped renewing their lease"""
+        from .models import Job
+
+        cutoff = (now or timezone.now()) - timedelta(seconds=self.config['LEASE'])
+        for job in Job.objects.filter(status='running', locked_at__lt=cutoff):
+            logger.warning("Job %s lost its worker %s", job.pk, job.locked_by)
+            self._finish(job, error="The worker running this job stopped", owner=job.locked_by)
+
+    def claim(self):
+        """Lock and return the next ready job, or None"""
+        from .models import Job
+
+        running = dict(
+            Job.objects.filter(status='running', queue__in=self.limits).order_by()
+            .values('queue').annotate(count=Count('pk')).values_list('queue', 'count')
+        )
+        open_queues = [queue for queue, limit in self.limits.items() if running.get(queue, 0) < limit]
+        if not open_queues:
+            return None
+
+        now = timezone.now()
+        candidates = (
+            Job.objects.filter(status='queued', queue__in=open_queues, run_after__lte=now)
+            .order_by('-priority', 'run_after', 'id')
+            .values_list('pk', 'queue')[:10]
+        )
+        running_in_queue = Subquery(
+            Job.objects.filter(status='running', queue=OuterRef('queue')).order_by()
+            .values('queue').annotate(count=Count('pk')).values('count')
+        )
+        for pk, queue in candidates:
+            # Re-checks the queue's limit in the same statement, so workers
+            # racing for the last slot cannot both take it
+            claimed = (
+                Job.objects.filter(pk=pk, status='queued')
+                .alias(running=Coalesce(running_in_queue, Value(0)))
+                .filter(running__lt=self.limits[queue])
+                .update(
+                    status='running', locked_by=self.name, locked_at=now, started_at=now,
+                    attempts=F('attempts') + 1,
+                )
+            )
+            if claimed:
+                return Job.objects.get(pk=pk)
+        return None
+
+    def _execute(self, job):
+        try:
+            self.execute(job)
+        except Exception:
+            logger.exception("Job %s could not be recorded", job.pk)
+        finally:
+            connection.close()
+
+    def execute(self, job):
+        """Call a claimed job's task and record how it went"""
+        try:
+            result = import_string(job.task)(job, **job.kwargs)
+        except PermanentJobError as exc:
+            logger.error("Job %s (%s) failed: %s", job.pk, job.task, exc)
+            self._finish(job, error=str(exc), retry=False)
+        except Exception as exc:
+            logger.exception("Job %s (%s) failed on attempt %d", job.pk, job.task, job.attempts)
+            self._finish(job, error=f'{type(exc).__name__}: {exc}')
+        else:
+            self._finish(job, result=result)
+
+    def _finish(self, job, result=None, error=None, owner=None, retry=True):
+        from .models import Job
+
+        now = timezone.now()
+        lock = Job.objects.filter(pk=job.pk, status='running', locked_by=owner or self.name)
+        if error is None:
+            updated = lock.update(
+                status='succeeded', result=result, error='', finished_at=now, locked_by='', locked_at=None
+            )
+            status = 'succeeded'
+        elif retry and job.attempts < job.max_attempts:
+            updated = lock.update(
+                status='queued', error=error, locked_by='', locked_at=None,
+                run_after=now + timedelta(seconds=backoff(job.attempts, self.config)),
+            )
+            status = 'queued'
+        else:
+            updated = lock.update(status='failed', error=error, finished_at=now, locked_by='', locked_at=None)
+            status = 'failed'
+        if updated and status != 'queued' and job.created_by_id:
+            publish_event('job.finished', [f'user:{job.created_by_id}'], {'id': job.pk, 'status': status})
+
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from user.storage import collect_blobs
+
+
+class Command(BaseCommand):
+    help = "Recount references to deduplicated media blobs and delete the unreferenced ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=3600,
+            help="Spare blobs referenced or written within this many seconds (default: 3600)",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Report without changing anything")
+
+    def handle(self, *args, **options):
+        stats = collect_blobs(grace=options['grace'], dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['deleted']} blobs ({stats['bytes']} bytes) and {stats['strays']} stray files; "
+            f"recounted {stats['recounted']}"
+        ))
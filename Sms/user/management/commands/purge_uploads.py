@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from user.uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete unfinished uploads past their expiry along with their stored chunks"
+
+    def handle(self, *args, **options):
+        count = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f"Purged {count} expired uploads"))
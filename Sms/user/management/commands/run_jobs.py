@@ -0,0 +1,29 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from user.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs until stopped (SIGINT/SIGTERM finish the running jobs first)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help="Only work this queue; repeat for several (default: every queue)")
+        parser.add_argument('--threads', type=int, help="Jobs to run at once in this process")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is ready")
+
+    def handle(self, *args, **options):
+        try:
+            worker = Worker(queues=options['queues'], threads=options['threads'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after the running jobs finish")
+            worker.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        self.stdout.write(f"Worker {worker.name} running {', '.join(worker.limits)} with {worker.threads} threads")
+        worker.run(once=options['once'])
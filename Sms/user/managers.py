@@ -0,0 +1,28 @@
+from django.contrib.auth.models import UserManager
+from django.db import models
+
+
+class ActiveUserManager(UserManager):
+    """
+    User.active: users that are not soft-deleted. User.objects stays
+    unfiltered, since authentication, username uniqueness and restores have
+    to see deleted accounts too.
+    """
+    use_in_migrations = False
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
+class LiveUserRowsManager(models.Manager):
+    """
+    Default manager of rows belonging to a user, hiding those whose user is
+    soft-deleted. Subclasses set `user_lookup` to the path to that user,
+    e.g. 'student__user'. Related-object access and cascades go through the
+    unfiltered base manager; models using it keep an `all_objects` manager
+    for the rest.
+    """
+    user_lookup = 'user'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{f'{self.user_lookup}__is_deleted': False})
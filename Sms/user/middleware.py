@@ -1,17 +1,401 @@
-from django.utils.deprecation import MiddlewareMixin
+import random
+import re
+import threading
+import zlib
+from bisect import bisect_left
+from contextlib import ExitStack
+from time import perf_counter
 
-class CustomHookMiddleware(MiddlewareMixin):
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
 
-    def process_request(self, request):
-        print("🔹 process_request: Request received at", request.path)
+from .db_router import begin_request, end_request, replicas_config
 
-    def process_view(self, request, view_func, view_args, view_kwargs):
-        print("🔹 process_view: Before view runs -", view_func.__name__)
+try:
+    import brotli
+except ImportError:  # br is offered only when installed
+    brotli = None
 
-    def process_response(self, request, response):
-        print("✅ process_response: After view runs")
+try:
+    import zstandard
+except ImportError:  # zstd is offered only when installed
+    zstandard = None
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class ViewLatencyStats:
+    """Thread-safe, in-memory latency histograms keyed by view name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, total_ms, db_ms, queries, serialize_ms=0.0, render_ms=0.0):
+        bucket = bisect_left(LATENCY_BUCKETS_MS, total_ms)
+        with self._lock:
+            stats = self._views.get(view_name)
+            if stats is None:
+                stats = self._views[view_name] = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'db_ms': 0.0,
+                    'serialize_ms': 0.0,
+                    'render_ms': 0.0,
+                    'queries': 0,
+                    'max_ms': 0.0,
+                    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                }
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['db_ms'] += db_ms
+            stats['serialize_ms'] += serialize_ms
+            stats['render_ms'] += render_ms
+            stats['queries'] += queries
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['buckets'][bucket] += 1
+
+    def snapshot(self):
+        with self._lock:
+            views = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self._views.items()}
+        labels = [f'le_{bound}' for bound in LATENCY_BUCKETS_MS] + ['inf']
+        return {
+            name: {
+                'count': stats['count'],
+                'mean_ms': stats['total_ms'] / stats['count'],
+                'max_ms': stats['max_ms'],
+                'mean_db_ms': stats['db_ms'] / stats['count'],
+                'mean_serialize_ms': stats['serialize_ms'] / stats['count'],
+                'mean_render_ms': stats['render_ms'] / stats['count'],
+                'mean_queries': stats['queries'] / stats['count'],
+                'histogram': dict(zip(labels, stats['buckets'])),
+            }
+            for name, stats in views.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+view_latency = ViewLatencyStats()
+
+
+class RequestTimer:
+    """
+    Per-request counters filled in by the DB execute wrapper, the
+    serializers (see user.fieldsets.DynamicFieldsMixin) and render hooks
+    """
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'render_start', 'render_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_start = None
+        self.render_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.queries += 1
+
+
+class RequestTimingMiddleware:
+    """
+    Record wall time, DB query count/time, serialization time and render
+    time of sampled requests.
+
+    Serialization is the top-level serializers turning rows into data, which
+    includes any queries they make; rendering is DRF encoding that data as
+    JSON or another format. Both are part of `app`.
+
+    Timings are returned in a Server-Timing header and folded into per-view
+    latency histograms (see `view_latency`). Configured by the REQUEST_TIMING
+    setting; when disabled the middleware removes itself from the stack.
+    Runs natively in both the WSGI and the ASGI handler, so async views are
+    not pushed onto a thread by this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = getattr(settings, 'REQUEST_TIMING', {})
+        if not config.get('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.sample_rate = config.get('SAMPLE_RATE', 1.0)
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django runs sync hooks in a thread under ASGI; offer a coroutine instead
+            self.process_template_response = self._aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+
+        timer, start = self._start(request)
+        with self._time_queries(timer):
+            response = self.get_response(request)
+        return self._finish(request, response, timer, start)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+
+        timer, start = self._start(request)
+        # Connections are per thread, and under ASGI the queries of sync
+        # views and of the async ORM run in the request's thread-sensitive
+        # worker thread rather than on the event loop; wrap its connections
+        stack = await sync_to_async(self._time_queries)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._finish(request, response, timer, start)
+
+    @staticmethod
+    def _time_queries(timer):
+        """An ExitStack wrapping the current thread's connections with `timer`"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def _sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _start(self, request):
+        timer = request._request_timer = RequestTimer()
+        return timer, perf_counter()
+
+    def _finish(self, request, response, timer, start):
+        total_ms = (perf_counter() - start) * 1000
+        db_ms = timer.db_time * 1000
+        serialize_ms = timer.serialize_time * 1000
+        render_ms = timer.render_time * 1000
+
+        response['Server-Timing'] = (
+            f'app;dur={total_ms:.2f}, '
+            f'db;dur={db_ms:.2f};desc="{timer.queries} queries", '
+            f'serialize;dur={serialize_ms:.2f};desc="Serializer data", '
+            f'render;dur={render_ms:.2f};desc="Response rendering"'
+        )
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            view_latency.record(match.view_name, total_ms, db_ms, timer.queries, serialize_ms, render_ms)
+        return response
+
+    def process_template_response(self, request, response):
+        return self._time_rendering(request, response)
+
+    async def _aprocess_template_response(self, request, response):
+        return self._time_rendering(request, response)
+
+    def _time_rendering(self, request, response):
+        # DRF responses are rendered after this hook; time until the
+        # post-render callback fires
+        timer = getattr(request, '_request_timer', None)
+        if timer is not None:
+            timer.render_start = perf_counter()
+
+            def finished_rendering(rendered):
+                timer.render_time = perf_counter() - timer.render_start
+
+            response.add_post_render_callback(finished_rendering)
         return response
 
-    def process_exception(self, request, exception):
-        print(f"❌ process_exception: Exception occurred - {exception}")
-        return None
\ No newline at end of file
+
+class ReplicaRoutingMiddleware:
+    """
+    Tell ReplicaRouter which request it is routing, and after a successful
+    write pin the user to the primary for DATABASE_REPLICAS['STICKY_SECONDS'].
+    Removes itself when no replicas are configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas_config()['ALIASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = begin_request(request)
+        status_code = 500
+        try:
+            response = self.get_response(request)
+            status_code = response.status_code
+        finally:
+            end_request(state, token, status_code)
+        return response
+
+    async def __acall__(self, request):
+        state, token = begin_request(request)
+        status_code = 500
+        try:
+            response = await self.get_response(request)
+            status_code = response.status_code
+        finally:
+            end_request(state, token, status_code)
+        return response
+
+
+def compression_config():
+    config = {
+        'ENABLED': True,
+        # Bodies shorter than this are sent as they are
+        'MIN_SIZE': 1024,
+        # Preference order among the encodings a client rates equally
+        'ENCODINGS': ['zstd', 'br', 'gzip'],
+        'GZIP_LEVEL': 6,
+        'BROTLI_QUALITY': 4,
+        'ZSTD_LEVEL': 3,
+    }
+    config.update(getattr(settings, 'RESPONSE_COMPRESSION', {}))
+    return config
+
+
+def _gzip(config):
+    compressor = zlib.compressobj(config['GZIP_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _brotli(config):
+    compressor = brotli.Compressor(quality=config['BROTLI_QUALITY'])
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def _zstd(config):
+    compressor = zstandard.ZstdCompressor(level=config['ZSTD_LEVEL']).compressobj()
+    return compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+
+# Encoding name -> factory of (compress, flush, finish) for one response
+COMPRESSORS = {'gzip': _gzip}
+if brotli is not None:
+    COMPRESSORS['br'] = _brotli
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _zstd
+
+COMPRESSIBLE_TYPE = re.compile(r'^(text/(?!event-stream)|application/([\w.-]+\+)?(json|x-ndjson|xml|javascript))')
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """The first of `encodings` that the Accept-Encoding header rates highest, or None"""
+    ratings = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ratings[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = ratings.get(encoding, ratings.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compress text and JSON responses with the best of zstd, br and gzip that
+    the client accepts, configured by RESPONSE_COMPRESSION.
+
+    Bodies under MIN_SIZE go out as they are. Streaming responses (exports)
+    are compressed as they stream, flushing after every chunk so nothing is
+    held back. Responses that serve byte ranges, event streams and already
+    compressed types are left alone. Encodings whose library is not
+    installed are not offered. Like RequestTimingMiddleware it runs natively
+    under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = compression_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.config = config
+        self.encodings = [encoding for encoding in config['ENCODINGS'] if encoding in COMPRESSORS]
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.has_header('Content-Encoding') or response.has_header('Content-Range'):
+            return response
+        if response.get('Accept-Ranges', 'none') != 'none':
+            # Ranges are offsets into the uncompressed body
+            return response
+        if not COMPRESSIBLE_TYPE.match(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < self.config['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None:
+            return response
+        compress, flush, finish = COMPRESSORS[encoding](self.config)
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._acompress_stream(response.streaming_content, compress, flush, finish)
+            else:
+                response.streaming_content = self._compress_stream(response.streaming_content, compress, flush, finish)
+            del response['Content-Length']
+        else:
+            body = compress(response.content) + finish()
+            if len(body) >= len(response.content):
+                return response
+            response.content = body
+            response['Content-Length'] = str(len(body))
+
+        # The compressed bytes differ, so a strong validator must become weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(content, compress, flush, finish):
+        for chunk in content:
+            if data := compress(chunk) + flush():
+                yield data
+        yield finish()
+
+    @staticmethod
+    async def _acompress_stream(content, compress, flush, finish):
+        async for chunk in content:
+            if data := compress(chunk) + flush():
+                yield data
+        yield finish()
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('user', '0004_auditevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notice',
+            index=models.Index(condition=models.Q(('published', True)), fields=['audience', '-created_at'], name='notice_published_audience_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['role'], name='user_active_role_idx'),
+        ),
+    ]
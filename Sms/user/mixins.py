@@ -0,0 +1,293 @@
+import hashlib
+from calendar import timegm
+from functools import update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.http import Http404
+from django.utils.http import http_date
+from rest_framework import exceptions
+from rest_framework.mixins import ListModelMixin
+from rest_framework.response import Response
+
+from user.cache import namespace_version, response_cache, response_cache_key
+from user.fieldsets import plan_queryset
+
+
+class ConditionalGetMixin:
+    """
+    Answer conditional `list` and `retrieve` requests with 304 Not Modified.
+
+    The list validator is max(`last_modified_field`) and the row count of the
+    scoped, filtered queryset, read with one aggregate query before anything
+    is serialized. The count catches deletions that leave the maximum alone.
+    Retrieve compares the object's own timestamp.
+
+    The ETag also covers the user, the full path and, on viewsets with a
+    `cache_namespace`, its version. Related rows the serializer nests, such as
+    an author's name, bump that version when they change.
+
+    Lists only send an ETag. A Last-Modified date cannot reveal that a row
+    was deleted, so If-Modified-Since is honoured on retrieve only.
+    """
+    last_modified_field = 'updated_at'
+
+    def _etag(self, *parts):
+        namespace = getattr(self, 'cache_namespace', None)
+        if namespace:
+            parts += (namespace_version(namespace),)
+        parts += (self.request.user.pk, self.request.get_full_path())
+        digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+        return f'W/"{digest}"'
+
+    def _not_modified(self, request, etag, last_modified=None):
+        """A 304 response when the request's validators match, otherwise None"""
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            self._set_validators(response, etag, last_modified)
+        return response
+
+    def _set_validators(self, response, etag, last_modified=None):
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def _list_state(self):
+        """The queryset and aggregates that validate a list"""
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        return queryset, {'last_modified': Max(self.last_modified_field), 'count': Count('pk')}
+
+    def list(self, request, *args, **kwargs):
+        queryset, aggregates = self._list_state()
+        state = queryset.aggregate(**aggregates)
+        etag = self._etag('list', state['last_modified'], state['count'])
+        response = self._not_modified(request, etag)
+        if response is None:
+            response = self._set_validators(super().list(request, *args, **kwargs), etag)
+        return response
+
+    async def alist(self, request, *args, **kwargs):
+        queryset, aggregates = self._list_state()
+        state = await queryset.aaggregate(**aggregates)
+        etag = self._etag('list', state['last_modified'], state['count'])
+        response = self._not_modified(request, etag)
+        if response is None:
+            response = self._set_validators(await super().alist(request, *args, **kwargs), etag)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self._retrieve(request, instance)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return self._retrieve(request, instance)
+
+    def _retrieve(self, request, instance):
+        last_modified = getattr(instance, self.last_modified_field)
+        etag = self._etag('detail', instance.pk, last_modified)
+        response = self._not_modified(request, etag, last_modified)
+        if response is None:
+            response = self._set_validators(
+                Response(self.get_serializer(instance).data), etag, last_modified
+            )
+        return response
+
+
+class CachedListMixin:
+    """
+    Serve `list` from the response cache.
+
+    Entries are keyed by `cache_namespace`, the viewset's effective scope (see
+    `get_cache_scope`) and the request's path and query string, so every user
+    whose `get_queryset` would return the same rows shares one entry. Signal
+    handlers bump the namespace version when the underlying rows change.
+    """
+    cache_namespace = None
+
+    def get_cache_scope(self):
+        """
+        A string identifying everything get_queryset depends on for this user.
+        Defaults to the user, so nothing is shared; override it to share
+        entries between users who see the same rows.
+        """
+        return f'user:{self.request.user.pk}'
+
+    async def aget_cache_scope(self):
+        """get_cache_scope for the async path; override when the scope needs a query"""
+        return self.get_cache_scope()
+
+    def _store(self, key, response):
+        if response.status_code == 200:
+            response_cache().set(key, response.data, timeout=getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        key = response_cache_key(self.cache_namespace, self.get_cache_scope(), request)
+        data = response_cache().get(key)
+        if data is not None:
+            return Response(data)
+        return self._store(key, super().list(request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        # The locmem cache is in-process memory, so its sync API does not block
+        key = response_cache_key(self.cache_namespace, await self.aget_cache_scope(), request)
+        data = response_cache().get(key)
+        if data is not None:
+            return Response(data)
+        return self._store(key, await super().alist(request, *args, **kwargs))
+
+
+class AsyncReadMixin:
+    """
+    Serve `list` and `retrieve` from coroutines when ASYNC_READ_VIEWS is on
+    (off by default; SMS_ASYNC_READ_VIEWS=1 turns it on for an ASGI server).
+
+    The router's view functions become async: reads authenticate, check
+    permissions, query through the async ORM and serialize on the event loop,
+    while writes and extra actions run the regular sync handlers in a thread.
+    With the setting off the sync views are served as before.
+
+    Serializers must not lazy-load relations on this path; list the ones they
+    read in `read_select_related`, which both paths join for list/retrieve,
+    or let SparseFieldsMixin plan the queryset from the serializer. The plan
+    loads every column here, since a deferred one the serializer touches
+    would be a sync query on the event loop.
+    """
+    read_select_related = ()
+    async_actions = ('list', 'retrieve')
+    # True on views serving a read from a coroutine
+    serving_async = False
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not getattr(settings, 'ASYNC_READ_VIEWS', False):
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if actions.get(request.method.lower()) not in cls.async_actions:
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.serving_async = True
+            self.action_map = actions
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        update_wrapper(async_view, view)
+        return async_view
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch with async authentication and handlers"""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+            request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+            await self.aperform_authentication(request)
+            # Permission classes only read request.user, which is loaded by now
+            self.check_permissions(request)
+            self.check_throttles(request)
+
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        """Request._authenticate, awaiting authenticators that provide aauthenticate"""
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.read_select_related and self.action in self.async_actions:
+            queryset = queryset.select_related(*self.read_select_related)
+        return queryset
+
+    async def aget_object(self):
+        """GenericAPIView.get_object through the async ORM"""
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        paginator = self.paginator
+        if paginator is not None and getattr(paginator, 'is_requested', lambda request: True)(request):
+            # Pagination is sync-only in DRF; run the plain list in a thread
+            return await sync_to_async(ListModelMixin.list)(self, request, *args, **kwargs)
+        rows = [row async for row in self.filter_queryset(self.get_queryset()).aiterator()]
+        return Response(self.get_serializer(rows, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+
+class SparseFieldsMixin:
+    """
+    Build the `list` and `retrieve` queryset from the fields the serializer
+    will render (see user.fieldsets.DynamicFieldsMixin): join and prefetch
+    only the relations they read and load only their columns, so
+    `?fields=id,name` reads two columns and no related tables.
+
+    The columns of `last_modified_field` and `pagination_ordering`, which
+    the view reads itself, are always loaded. Reads served by AsyncReadMixin
+    load every column, joining and prefetching as planned.
+    """
+    planned_actions = ('list', 'retrieve')
+
+    def get_planned_lookups(self):
+        ordering = getattr(self, 'pagination_ordering', ())
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        lookups = [field.lstrip('-') for field in ordering]
+        if hasattr(self, 'last_modified_field'):
+            lookups.append(self.last_modified_field)
+        return lookups
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.planned_actions:
+            queryset = plan_queryset(
+                self.get_serializer(), queryset, self.get_planned_lookups(),
+                defer=not getattr(self, 'serving_async', False),
+            )
+        return queryset
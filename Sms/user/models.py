@@ -1,6 +1,12 @@
+import math
+import uuid
+
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.conf import settings  
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .managers import ActiveUserManager
 
 
 class User(AbstractUser):
@@ -11,16 +17,36 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    # objects (the default) also returns deleted users; active does not
+    objects = UserManager()
+    active = ActiveUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # UserViewSet.get_queryset: non-deleted users by role. Partial,
+            # because is_deleted=False compiles to NOT "is_deleted", which
+            # only a partial index on that condition can serve.
+            models.Index(fields=['role'], condition=models.Q(is_deleted=False), name='user_active_role_idx'),
+            # Admins' cursor-paginated user list, which seeks on id
+            models.Index(fields=['id'], condition=models.Q(is_deleted=False), name='user_active_id_idx'),
+            # deleted_users and archive_deleted_users
+            models.Index(fields=['deleted_at'], condition=models.Q(is_deleted=True), name='user_deleted_at_idx'),
+        ]
+
     def delete(self, using=None, keep_parents=False):
         """Override delete to perform soft delete"""
         self.is_deleted = True
         self.is_active = False 
+        self.deleted_at = timezone.now()
         self.save()
         
     def restore(self):
         """Restore a soft-deleted user"""
         self.is_deleted = False
         self.is_active = True
+        self.deleted_at = None
         self.save()
     def __str__(self):
         return self.username
@@ -44,4 +70,198 @@ class notice(models.Model):
 
     class Meta:
         verbose_name_plural = 'Notices'
-        ordering = ['-created_at']  # Newest notices first
\ No newline at end of file
+        ordering = ['-created_at']  # Newest notices first
+        indexes = [
+            # NoticeViewSet.get_queryset: published notices for an audience, newest first
+            models.Index(
+                fields=['audience', '-created_at'],
+                condition=models.Q(published=True),
+                name='notice_published_audience_idx'
+            ),
+        ]
+
+class AuditEvent(models.Model):
+    actor = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='audit_events'
+    )
+    actor_username = models.CharField(max_length=150, blank=True)
+    action = models.CharField(max_length=255)
+    details = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.actor_username or 'anonymous'} - {self.action}"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['actor', 'created_at'], name='audit_actor_created_idx'),
+            models.Index(fields=['created_at'], name='audit_created_idx'),
+        ]
+
+
+class PushEvent(models.Model):
+    """Events relayed between worker processes by user.events.DatabaseBroker"""
+    event_type = models.CharField(max_length=50)
+    topics = models.JSONField(default=list)
+    data = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
+
+    def as_event(self):
+        from user.events import Event
+        return Event(self.id, self.event_type, frozenset(self.topics), self.data)
+
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload that becomes a submission or assignment file"""
+    TARGET_CHOICES = (
+        ('submission', 'Submission'),
+        ('assignment', 'Assignment'),
+    )
+    STATUS_CHOICES = (
+        ('open', 'Open'),
+        ('assembling', 'Assembling'),
+        ('complete', 'Complete'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    target = models.CharField(max_length=10, choices=TARGET_CHOICES)
+    # The assignment being submitted to, or whose file is replaced
+    assignment = models.ForeignKey('teacher.Assignment', on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.filename} ({self.status})"
+
+    @property
+    def total_chunks(self):
+        return max(1, math.ceil(self.size / self.chunk_size))
+
+    def chunk_length(self, index):
+        """Expected byte length of chunk `index`; only the last may be short"""
+        if index == self.total_chunks - 1:
+            return self.size - self.chunk_size * index
+        return self.chunk_size
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='upload_status_expires_idx'),
+        ]
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    path = models.CharField(max_length=255)
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+
+class Blob(models.Model):
+    """
+    One stored file body in user.storage.ContentAddressedStorage, shared by
+    every file field whose content hashes to it. `refcount` is kept up to date
+    as files are saved and released; gc_blobs recounts it from the file
+    fields and removes blobs that nothing refers to.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last time a reference was added; recent blobs are spared by gc_blobs
+    referenced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.refcount} refs)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'referenced_at'], name='blob_refcount_idx'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work run by the run_jobs command (user.jobs)"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=255)  # dotted path of the task function
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)  # higher runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Set while running; a lease that stops being renewed means the worker died
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'queue', 'priority', 'run_after'], name='job_claim_idx'),
+            models.Index(fields=['created_by', 'created_at'], name='job_owner_created_idx'),
+        ]
+
+
+class ArchivedUser(models.Model):
+    """
+    A user deleted long ago, moved out of the hot tables by
+    archive_deleted_users (user.archive) together with the rows that belong
+    to them. `rows` holds those rows serialized in restore order; `detached`
+    the rows elsewhere that pointed at the user and were unlinked, as
+    {model label: {field: [pks]}}. restore_user puts everything back under
+    the same primary keys.
+
+    The rows are one JSON document rather than archive copies of each table:
+    they are written once, read back whole on restore and never queried, and
+    the document needs no migration when the archived models change. Fields
+    removed since are ignored on restore; added ones take their defaults.
+    """
+    user_id = models.PositiveIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    role = models.CharField(max_length=10, choices=User.ROLE_CHOICES)
+    deleted_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    rows = models.JSONField(encoder=DjangoJSONEncoder)
+    detached = models.JSONField(default=dict)
+    # Blob names of archived file fields, still counted by gc_blobs
+    blobs = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"{self.username} (archived {self.archived_at:%Y-%m-%d})"
@@ -0,0 +1,36 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Opt-in cursor pagination for the list endpoints.
+
+    Requests without a `cursor` or `page_size` query param get the plain,
+    unpaginated list the frontend already expects. Paginated requests seek
+    on the viewset's `pagination_ordering` instead of using OFFSET, so a
+    deep page costs the same as the first one.
+    """
+    page_size_query_param = 'page_size'
+    ordering = ('id',)
+
+    def __init__(self):
+        # Each request gets its own paginator, so settings overrides apply
+        self.page_size = getattr(settings, 'PAGINATION_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 500)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        # Each viewset declares a stable, unique ordering for its cursor
+        ordering = getattr(view, 'pagination_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
@@ -0,0 +1,238 @@
+import atexit
+import csv
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import Case, When
+from django.utils import timezone
+
+from student.models import StudentProfile
+from teacher.models import Subject
+from user.cache import invalidate_responses
+from user.models import User
+from user.utils import setup_worker_process
+
+USER_FIELDS = ('username', 'password', 'email', 'first_name', 'last_name', 'role')
+ROLES = {role for role, _ in User.ROLE_CHOICES}
+GRADES = {grade for grade, _ in StudentProfile.GRADE_CHOICES}
+
+
+# Batches smaller than this are hashed in-process whatever the worker count
+HASH_INLINE_BELOW = 16
+
+
+_hash_pool = None
+_hash_pool_workers = None
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool(workers):
+    """
+    The process pool shared by every provisioning request, started on first use.
+
+    Workers are spawned rather than forked: forking a threaded server copies
+    its locks and open connections into the children.
+    """
+    global _hash_pool, _hash_pool_workers
+    with _hash_pool_lock:
+        if _hash_pool is not None and _hash_pool_workers != workers:
+            _hash_pool.shutdown(wait=False)
+            _hash_pool = None
+        if _hash_pool is None:
+            _hash_pool_workers = workers
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_worker_process,
+            )
+            atexit.register(_hash_pool.shutdown)
+        return _hash_pool
+
+
+def hash_passwords(passwords):
+    """
+    Hash passwords with the configured hasher, spread across a process pool.
+
+    Each hash deliberately costs ~100ms of CPU, so a large batch is split over
+    PROVISIONING_HASH_WORKERS processes (default: one per core). Batches under
+    HASH_INLINE_BELOW are hashed in-process, where handing them to the pool
+    would cost more than it saves.
+    """
+    global _hash_pool
+    workers = getattr(settings, 'PROVISIONING_HASH_WORKERS', None) or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) < max(HASH_INLINE_BELOW, 2 * workers):
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    pool = get_hash_pool(workers)
+    try:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        with _hash_pool_lock:
+            if _hash_pool is pool:
+                _hash_pool = None
+        raise
+
+
+def parse_subject_ids(value):
+    """Accept a list of IDs or a comma/semicolon separated string of them"""
+    if value in (None, ''):
+        return []
+    if isinstance(value, (int, str)):
+        value = str(value).replace(';', ',').split(',')
+    return [int(str(pk).strip()) for pk in value if str(pk).strip()]
+
+
+def read_users_csv(upload):
+    """Read provisioning rows from an uploaded CSV with a header row"""
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(stream)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        return [
+            {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+            for row in reader
+        ]
+    except UnicodeDecodeError:
+        raise ValueError("The file is not valid UTF-8 CSV")
+    finally:
+        stream.detach()
+
+
+def validate_rows(rows):
+    """
+    Check every row against the batch and the database with a fixed number of
+    queries. Returns (valid, results) where `valid` holds cleaned rows and
+    `results` has an error entry for each rejected row.
+    """
+    usernames = [str(row.get('username') or '').strip() for row in rows]
+    taken = set(User.objects.filter(username__in=[u for u in usernames if u]).values_list('username', flat=True))
+
+    subject_ids_by_row = {}
+    all_subject_ids = set()
+    for index, row in enumerate(rows):
+        try:
+            subject_ids_by_row[index] = parse_subject_ids(row.get('subjects', row.get('subject')))
+            all_subject_ids.update(subject_ids_by_row[index])
+        except (TypeError, ValueError):
+            subject_ids_by_row[index] = None
+    existing_subjects = set(Subject.objects.filter(id__in=all_subject_ids).values_list('id', flat=True))
+
+    seen = set()
+    valid = []
+    results = []
+    for index, row in enumerate(rows):
+        username = usernames[index]
+        role = row.get('role')
+        subject_ids = subject_ids_by_row[index]
+        grade = str(row.get('grade') or '1')
+        errors = []
+
+        if not username:
+            errors.append("Username is required.")
+        elif len(username) > 150:
+            errors.append("Username must be at most 150 characters.")
+        elif username in taken or username in seen:
+            errors.append("Username already taken.")
+        if not row.get('password'):
+            errors.append("Password is required.")
+        else:
+            # AUTH_PASSWORD_VALIDATORS, against the user the row would create
+            candidate = User(**{field: row.get(field) or '' for field in USER_FIELDS if field != 'password'})
+            try:
+                validate_password(row['password'], user=candidate)
+            except ValidationError as error:
+                errors.extend(error.messages)
+        if role not in ROLES:
+            errors.append(f"Role must be one of: {', '.join(sorted(ROLES))}.")
+        if row.get('email'):
+            try:
+                validate_email(row['email'])
+            except ValidationError:
+                errors.append("Enter a valid email address.")
+        if subject_ids is None:
+            errors.append("Subject IDs must be integers.")
+        elif set(subject_ids) - existing_subjects:
+            errors.append("One or more subject IDs are invalid.")
+        elif role == 'teacher' and not subject_ids:
+            errors.append("At least one subject must be assigned to a teacher.")
+        if role == 'student' and grade not in GRADES:
+            errors.append("Grade must be between 1 and 12.")
+
+        if errors:
+            results.append({"row": index, "username": username, "status": "error", "errors": errors})
+            continue
+
+        seen.add(username)
+        valid.append({
+            'row': index,
+            'user': {field: row.get(field) or '' for field in USER_FIELDS},
+            'subjects': subject_ids,
+            'grade': grade,
+            'education_level': row.get('education_level') or '',
+        })
+    return valid, results
+
+
+def provision_users(rows):
+    """
+    Create users, student profiles and subject links for a batch of rows.
+
+    Valid rows are written in a handful of statements regardless of batch
+    size; invalid rows are reported and skipped. Returns per-row results
+    ordered by row index.
+    """
+    valid, results = validate_rows(rows)
+    if not valid:
+        return sorted(results, key=lambda result: result['row'])
+
+    hashes = hash_passwords([entry['user']['password'] for entry in valid])
+
+    with transaction.atomic():
+        users = []
+        for entry, password_hash in zip(valid, hashes):
+            fields = dict(entry['user'], password=password_hash)
+            users.append(User(**fields))
+        users = User.objects.bulk_create(users)
+
+        students = [
+            (entry, user) for entry, user in zip(valid, users) if user.role == 'student'
+        ]
+        profiles = StudentProfile.objects.bulk_create([
+            StudentProfile(user=user, grade=entry['grade'], education_level=entry['education_level'])
+            for entry, user in students
+        ])
+        Through = StudentProfile.subjects.through
+        Through.objects.bulk_create([
+            Through(studentprofile_id=profile.id, subject_id=subject_id)
+            for (entry, _), profile in zip(students, profiles)
+            for subject_id in entry['subjects']
+        ])
+
+        # Teachers take over their subjects in one UPDATE
+        teacher_of = {
+            subject_id: user.id
+            for entry, user in zip(valid, users) if user.role == 'teacher'
+            for subject_id in entry['subjects']
+        }
+        if teacher_of:
+            Subject.objects.filter(id__in=teacher_of).update(
+                teacher=Case(*[When(id=subject_id, then=teacher_id) for subject_id, teacher_id in teacher_of.items()]),
+                updated_at=timezone.now(),
+            )
+            # After commit, or a concurrent read could cache the old teachers again
+            transaction.on_commit(lambda: invalidate_responses('subjects', 'assignments'))
+
+    for entry, user in zip(valid, users):
+        results.append({"row": entry['row'], "username": user.username, "status": "created", "id": user.id})
+    return sorted(results, key=lambda result: result['row'])
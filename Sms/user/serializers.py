@@ -1,26 +1,31 @@
 from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
+from django.db import transaction
+from django.utils import timezone
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
-from .models import User, notice
+from .models import AuditEvent, Job, UploadSession, User, notice
 from teacher.models import Subject
+from .cache import invalidate_responses
+from .fieldsets import DynamicFieldsMixin
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Claims read by CachedJWTAuthentication
+        token['role'] = user.role
+        token['is_deleted'] = user.is_deleted
+        return token
+
     def validate(self, attrs):
-        # Use the parent class's validate method to authenticate the user
+        # The parent class authenticates the user and adds the
+        # 'refresh' and 'access' tokens to the response
         data = super().validate(attrs)
         
         # Prevent login if user is soft deleted
         if self.user.is_deleted:
             raise serializers.ValidationError(_("This account has been deleted. Please contact admin."))
         
-        # Get the refresh and access tokens
-        refresh = self.get_token(self.user)
-        
-        # Add the tokens to the response
-        data['access'] = str(refresh.access_token)
-        data['refresh'] = str(refresh)
-        
         # Add user data to the response
         data['user'] = {
             'id': self.user.id,
@@ -33,7 +38,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         
         return data
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     subjects = serializers.PrimaryKeyRelatedField(
         queryset=Subject.objects.all(), many=True, required=False
     )
@@ -42,6 +47,8 @@ class UserSerializer(serializers.ModelSerializer):
         model = User  # or your custom user model
         fields = ['id', 'username', 'first_name', 'last_name', 'email', 'password', 'role', 'subjects']
         extra_kwargs = {'password': {'write_only': True}}
+        # Users have no `subjects` to read back; the field is only written
+        field_lookups = {'subjects': []}
 
     def create(self, validated_data):
         subjects = validated_data.pop('subjects', [])
@@ -51,18 +58,58 @@ class UserSerializer(serializers.ModelSerializer):
         
         # If user is a teacher, update the teacher field on subjects
         if user.role == 'teacher' and subjects:
-            Subject.objects.filter(id__in=[s.id for s in subjects]).update(teacher=user)
+            Subject.objects.filter(id__in=[s.id for s in subjects]).update(teacher=user, updated_at=timezone.now())
+            transaction.on_commit(lambda: invalidate_responses('subjects', 'assignments'))
             
         return user
 
-class NoticeSerializer(serializers.ModelSerializer):
+class NoticeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField(read_only=True)
     
     class Meta:
         model = notice
         fields = ['id', 'title', 'content', 'created_at', 'created_by', 'updated_at', 'published', 'audience', 'created_by_name']
         read_only_fields = ['created_by']
-        
+        expandable_fields = ['created_by_name']
+        field_lookups = {'created_by_name': ['created_by__first_name', 'created_by__last_name', 'created_by__username']}
+
+
     def get_created_by_name(self, obj):
         user = obj.created_by
-        return f"{user.first_name} {user.last_name}" if user.first_name and user.last_name else user.username
\ No newline at end of file
+        return f"{user.first_name} {user.last_name}" if user.first_name and user.last_name else user.username
+
+class AuditEventSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = AuditEvent
+        fields = ['id', 'actor', 'actor_username', 'action', 'details', 'created_at']
+        read_only_fields = fields
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'target', 'assignment', 'filename', 'size', 'chunk_size', 'total_chunks',
+                  'sha256', 'status', 'created_at', 'expires_at', 'missing']
+        read_only_fields = ['status', 'created_at', 'expires_at']
+        extra_kwargs = {'chunk_size': {'required': False}}
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and (len(value) != 64 or set(value) - set('0123456789abcdef')):
+            raise serializers.ValidationError("Expected a hex SHA-256 digest.")
+        return value
+
+    def get_missing(self, obj):
+        """Indexes of the chunks still to be sent"""
+        from .uploads import missing_chunks
+        return missing_chunks(obj) if obj.status == 'open' else []
+
+
+class JobSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'queue', 'task', 'status', 'priority', 'attempts', 'max_attempts', 'run_after',
+                  'result', 'error', 'created_by', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from user.authentication import user_cache
+from user.cache import invalidate_responses
+from user.events import publish_event
+from user.models import User, notice
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Saves cover edits, soft deletes (User.delete) and restores"""
+    # After commit, or a concurrent request could cache the old row again.
+    # The pk is read now, as a delete clears it on the instance.
+    user_id = instance.pk
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_responses(sender, instance, **kwargs):
+    """Cached notices, subjects and assignments embed teacher/admin names; marks embed student names"""
+    if instance.role in ('teacher', 'admin'):
+        transaction.on_commit(lambda: invalidate_responses('notice', 'subjects', 'assignments'))
+    elif instance.role == 'student':
+        transaction.on_commit(lambda: invalidate_responses('marks'))
+
+
+@receiver(post_save, sender=notice)
+@receiver(post_delete, sender=notice)
+def invalidate_notice_responses(sender, instance, **kwargs):
+    # After commit, or a concurrent read could cache the old rows under the new version
+    transaction.on_commit(lambda: invalidate_responses('notice'))
+
+
+NOTICE_AUDIENCE_TOPICS = {
+    'student': ['role:student'],
+    'teacher': ['role:teacher'],
+    'both': ['role:student', 'role:teacher'],
+}
+
+
+@receiver(post_save, sender=notice)
+def push_notice(sender, instance, created, **kwargs):
+    """Admins and the author get every change; the audience only sees published notices"""
+    staff_topics = ['role:admin', f'user:{instance.created_by_id}']
+    audience_topics = NOTICE_AUDIENCE_TOPICS.get(instance.audience, [])
+    if instance.published:
+        staff_topics += audience_topics
+    else:
+        # Withdraw it from clients that may be showing it
+        publish_event('notice.removed', audience_topics, {'id': instance.id})
+    publish_event('notice.created' if created else 'notice.updated', staff_topics, {
+        'id': instance.id,
+        'title': instance.title,
+        'audience': instance.audience,
+        'published': instance.published,
+        'created_by': instance.created_by_id,
+        'updated_at': instance.updated_at,
+    })
+
+
+@receiver(post_delete, sender=notice)
+def push_notice_removed(sender, instance, **kwargs):
+    topics = ['role:admin', f'user:{instance.created_by_id}']
+    topics += NOTICE_AUDIENCE_TOPICS.get(instance.audience, [])
+    publish_event('notice.removed', topics, {'id': instance.id})
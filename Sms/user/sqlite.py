@@ -0,0 +1,108 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_config():
+    config = {
+        'ENABLED': False,
+        'JOURNAL_MODE': 'WAL',
+        # Durable across application crashes; a power cut may lose the last commits
+        'SYNCHRONOUS': 'NORMAL',
+        'MMAP_SIZE': 256 * 1024 * 1024,
+        # Negative values are KiB rather than pages
+        'CACHE_SIZE': -64 * 1024,
+        'BUSY_TIMEOUT_MS': 5000,
+        'TEMP_STORE': 'MEMORY',
+        'WRITE_RETRIES': 3,
+        'RETRY_BACKOFF_MS': 50,
+    }
+    config.update(getattr(settings, 'SQLITE_TUNING', {}))
+    return config
+
+
+def tune_connection(sender, connection, **kwargs):
+    """connection_created receiver applying the SQLITE_TUNING pragmas"""
+    if connection.vendor != 'sqlite':
+        return
+    config = sqlite_config()
+    if not config['ENABLED']:
+        return
+    # On the raw connection, so the pragmas stay out of query logs and counts
+    raw = connection.connection
+    raw.execute(f"PRAGMA busy_timeout = {int(config['BUSY_TIMEOUT_MS'])}")
+    raw.execute(f"PRAGMA journal_mode = {config['JOURNAL_MODE']}")
+    raw.execute(f"PRAGMA synchronous = {config['SYNCHRONOUS']}")
+    raw.execute(f"PRAGMA mmap_size = {int(config['MMAP_SIZE'])}")
+    raw.execute(f"PRAGMA cache_size = {int(config['CACHE_SIZE'])}")
+    raw.execute(f"PRAGMA temp_store = {config['TEMP_STORE']}")
+
+
+def is_locked(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """
+    transaction.atomic that, with SQLITE_TUNING enabled, starts SQLite
+    transactions with BEGIN IMMEDIATE. The write lock is then taken (waiting
+    up to busy_timeout) before the first read, instead of being upgraded
+    halfway through, which SQLite refuses at once with "database is locked"
+    whenever another writer is active. Nested blocks are plain savepoints.
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block or not sqlite_config()['ENABLED']:
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    # Connecting sets transaction_mode from OPTIONS, so connect before
+    # swapping it rather than letting atomic() reconnect and reset it
+    connection.ensure_connection()
+    previous = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = previous
+            yield
+    finally:
+        connection.transaction_mode = previous
+
+
+def retry_when_locked(func=None, using=None):
+    """
+    Re-run `func` when SQLite still reports the database locked after
+    busy_timeout, up to WRITE_RETRIES times with jittered exponential
+    backoff. Calls made inside an outer transaction are not retried, since
+    only the outer block could start over. Does nothing unless
+    SQLITE_TUNING is enabled.
+    """
+    if func is None:
+        return lambda func: retry_when_locked(func, using)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        config = sqlite_config()
+        retries = config['WRITE_RETRIES'] if config['ENABLED'] else 0
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if attempt >= retries or not is_locked(exc) or connection.in_atomic_block:
+                    raise
+                attempt += 1
+                delay = config['RETRY_BACKOFF_MS'] * 2 ** (attempt - 1) / 1000
+                logger.warning("%s found the database locked; retry %d of %d", func.__qualname__, attempt, retries)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+    return wrapper
@@ -0,0 +1,357 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.db.models.signals import post_delete, post_init, post_save
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header, parse_etags
+
+from .sqlite import immediate_atomic
+from .utils import iterate_in_thread
+
+BLOB_DIR = 'blobs'
+BLOCK_SIZE = 64 * 1024
+# <upload_to>/<sha256>/<original filename>
+BLOB_NAME = re.compile(r'(?:^|/)([0-9a-f]{64})/[^/]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def blob_storage():
+    """The storage of deduplicated file fields, configured as STORAGES['blobs']"""
+    return storages['blobs']
+
+
+def blob_hash(name):
+    """The SHA-256 a ContentAddressedStorage name refers to, or None for other names"""
+    match = BLOB_NAME.search(name or '')
+    return match.group(1) if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each distinct file body once, under blobs/<aa>/<bb>/<sha256>.
+
+    The name handed back to the file field keeps its upload_to directory and
+    the original filename around the hash (`submissions/<sha256>/essay.pdf`)
+    so listings and downloads stay readable, but every name with the same
+    hash resolves to the same blob. Saving a file adds a reference to its
+    Blob row and deleting a name releases one; blobs themselves are only
+    removed by the gc_blobs command. Names saved before this storage was
+    configured are served from their old paths unchanged.
+    """
+
+    def blob_name(self, sha256):
+        return posixpath.join(BLOB_DIR, sha256[:2], sha256[2:4], sha256)
+
+    def _blob_name_for(self, name):
+        sha256 = blob_hash(name)
+        return self.blob_name(sha256) if sha256 else name
+
+    def path(self, name):
+        return super().path(self._blob_name_for(name))
+
+    def url(self, name):
+        return super().url(self._blob_name_for(name))
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from the content in _save, so they never collide
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        directory, filename = posixpath.split(name)
+        tmp_dir = super().path(posixpath.join(BLOB_DIR, 'tmp'))
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks(BLOCK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            sha256 = digest.hexdigest()
+
+            self._add_reference(sha256, size)
+            # Written after the reference is recorded: gc_blobs removes a body
+            # in the transaction that deletes its row, so it cannot remove this
+            # one. Replace even when the blob exists; a rename is cheap.
+            blob_path = super().path(self.blob_name(sha256))
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(blob_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Keep the name within the file field's 255 characters
+        room = 255 - len(directory) - len(sha256) - 2
+        if len(filename) > room:
+            stem, extension = os.path.splitext(filename)
+            filename = stem[:max(1, room - len(extension))] + extension
+        return posixpath.join(directory, sha256, filename)
+
+    def _add_reference(self, sha256, size):
+        from .models import Blob
+
+        def increment():
+            return Blob.objects.filter(pk=sha256).update(refcount=F('refcount') + 1, referenced_at=timezone.now())
+
+        # Update first, so a row gc_blobs deletes meanwhile is created again
+        # rather than incremented after it is gone
+        if increment():
+            return
+        try:
+            with transaction.atomic():
+                Blob.objects.create(sha256=sha256, size=size, refcount=1)
+        except IntegrityError:
+            # Created concurrently
+            increment()
+
+    def delete_blob(self, sha256):
+        """Remove a blob body from disk; only gc_blobs should call this"""
+        return super().delete(self.blob_name(sha256))
+
+    def delete(self, name):
+        """Release one reference to the name's blob; gc_blobs removes the body"""
+        from .models import Blob
+
+        sha256 = blob_hash(name)
+        if sha256 is None:
+            return super().delete(name)
+        Blob.objects.filter(pk=sha256, refcount__gt=0).update(refcount=F('refcount') - 1)
+
+
+def track_blob_references(model, field_name='file'):
+    """
+    Release the blob of `model.<field_name>` when a row is deleted or its file
+    replaced, once the transaction commits. Saving the new file through the
+    storage has already added its reference, also when the new file has the
+    same content and name as the old one.
+    """
+    loaded = f'_{field_name}_loaded_name'
+    stored = f'_{field_name}_stored'
+    field = model._meta.get_field(field_name)
+    storage = field.storage
+    generate_filename = field.generate_filename
+
+    def generate_stored_filename(instance, filename):
+        # Called by FieldFile.save just before the storage adds a reference,
+        # which it does even when the content, and so the name, is unchanged
+        instance.__dict__[stored] = True
+        return generate_filename(instance, filename)
+
+    if not getattr(generate_filename, 'tracks_blob_references', False):
+        generate_stored_filename.tracks_blob_references = True
+        field.generate_filename = generate_stored_filename
+
+    def current_name(instance):
+        if field_name not in instance.__dict__:
+            return None  # deferred
+        value = instance.__dict__[field_name]
+        return getattr(value, 'name', value) or ''
+
+    def release(name):
+        if name:
+            transaction.on_commit(lambda: storage.delete(name))
+
+    def remember(sender, instance, **kwargs):
+        instance.__dict__[loaded] = current_name(instance)
+
+    def saved(sender, instance, **kwargs):
+        previous = instance.__dict__.get(loaded)
+        name = current_name(instance)
+        replaced = instance.__dict__.pop(stored, False) or previous != name
+        if previous and name is not None and replaced:
+            release(previous)
+        instance.__dict__[loaded] = name
+
+    def deleted(sender, instance, **kwargs):
+        release(current_name(instance))
+
+    uid = f'blob-references-{model._meta.label_lower}-{field_name}'
+    post_init.connect(remember, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(saved, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=uid)
+
+
+def blob_fields():
+    """(model, field name) for every file field stored in blob_storage"""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+def collect_blobs(grace=3600, dry_run=False):
+    """
+    Recount blob references from the file fields and archived users, then
+    delete blobs nothing refers to. Blobs referenced within the last `grace`
+    seconds are left alone, as are stray files younger than that, so uploads
+    in flight are never collected. Returns a dict of counts.
+    """
+    from .models import ArchivedUser, Blob
+
+    storage = blob_storage()
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    stats = {'recounted': 0, 'deleted': 0, 'bytes': 0, 'strays': 0}
+
+    references = Counter()
+    for model, field_name in blob_fields():
+        # The base manager, so rows hidden by a filtering default manager count
+        names = model._base_manager.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+        for name in names.values_list(field_name, flat=True).iterator():
+            sha256 = blob_hash(name)
+            if sha256:
+                references[sha256] += 1
+    # Files of archived users come back with them
+    for names in ArchivedUser.objects.exclude(blobs=[]).values_list('blobs', flat=True).iterator():
+        for name in names:
+            sha256 = blob_hash(name)
+            if sha256:
+                references[sha256] += 1
+
+    settled = Blob.objects.filter(referenced_at__lt=cutoff)
+    for sha256, refcount, size in list(settled.values_list('sha256', 'refcount', 'size')):
+        count = references.get(sha256, 0)
+        if refcount != count:
+            stats['recounted'] += 1
+            if not dry_run:
+                settled.filter(pk=sha256).update(refcount=count)
+        if count:
+            continue
+        if dry_run:
+            deleted = True
+        else:
+            # Conditional, so a reference added since the recount keeps the
+            # blob. The body goes in the same transaction, before a save of the
+            # same content can create the row again and write it back.
+            with immediate_atomic():
+                deleted = settled.filter(pk=sha256, refcount=0).delete()[0]
+                if deleted:
+                    storage.delete_blob(sha256)
+        if deleted:
+            stats['deleted'] += 1
+            stats['bytes'] += size
+
+    # Bodies left behind by a crash between writing the file and its row
+    root = FileSystemStorage.path(storage, BLOB_DIR)
+    # Referenced bodies are kept even if their row is missing
+    known = set(references)
+    known.update(Blob.objects.values_list('sha256', flat=True))
+    oldest = time.time() - grace
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename in known or os.path.getmtime(path) >= oldest:
+                continue
+            stats['strays'] += 1
+            if not dry_run:
+                os.remove(path)
+    return stats
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single satisfiable byte range, None to send it all, or False"""
+    match = RANGE.match(header.replace(' ', ''))
+    if not match:
+        # Multiple ranges or another unit: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(storage, name, start, length):
+    with storage.open(name, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            block = source.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def file_response(request, storage, name, asynchronous=False):
+    """
+    Serve a stored file with validators and byte ranges.
+
+    Content-addressed files get their hash as a strong ETag, so clients can
+    revalidate for free and resume downloads with If-Range; files stored
+    under their old names get a weak ETag and are always sent whole when
+    If-Range is used. Pass `asynchronous=True` under ASGI.
+    """
+    size = storage.size(name)
+    sha256 = blob_hash(name)
+    if sha256:
+        etag = f'"{sha256}"'
+    else:
+        modified = storage.get_modified_time(name)
+        etag = f'W/"{int(modified.timestamp())}-{size}"'
+
+    # If-None-Match uses the weak comparison
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in if_none_match or etag.removeprefix('W/') in (tag.removeprefix('W/') for tag in if_none_match):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range needs a strong match, so a weak ETag never yields a partial response
+    if range_header and (if_range is None or (sha256 and if_range == etag)):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    content = _read_range(storage, name, start, end - start + 1)
+    if asynchronous:
+        content = iterate_in_thread(content)
+    content_type, encoding = mimetypes.guess_type(posixpath.basename(name))
+    response = StreamingHttpResponse(
+        content,
+        status=206 if byte_range else 200,
+        content_type=content_type or 'application/octet-stream',
+    )
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = content_disposition_header(True, posixpath.basename(name))
+    return response
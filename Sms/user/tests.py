@@ -1,3 +1,1532 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+import zlib
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from student.models import GradebookSummary, Marks, StudentProfile, StudentSubmission
+from student.serializers import MarksSerializer
+from student.views import MarksViewSet
+from teacher.models import Assignment, Subject
+from user.audit import AuditLogWriter, record_event
+from user.authentication import CachedJWTAuthentication, user_cache
+from user.cache import namespace_version, response_cache, student_subject_ids
+from user.db_router import check_sticky_cache
+from user.middleware import COMPRESSORS, CompressionMiddleware, negotiate_encoding, view_latency
+from user.mixins import CachedListMixin
+from user import events
+from user.jobs import Worker, backoff, enqueue, purge_finished, task
+from user.models import ArchivedUser, AuditEvent, Blob, Job, UploadChunk, UploadSession, User, notice
+from user.provisioning import HASH_INLINE_BELOW, hash_passwords
+from user.renderers import FastJSONRenderer, orjson
+from user.serializers import CustomTokenObtainPairSerializer
+from user.storage import ContentAddressedStorage, blob_storage, collect_blobs
+from user.sqlite import immediate_atomic, retry_when_locked
+from user.uploads import write_chunk
+from user.views import NoticeViewSet, UserViewSet
+
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)')
+
+
+def create_school(test):
+    """An admin, a teacher of 'Math' and five grade 5 students enrolled in it; passwords are 'pw'"""
+    test.admin = User.objects.create_user('admin', password='pw', role='admin')
+    test.teacher = User.objects.create_user('teacher', password='pw', role='teacher')
+    test.subject = Subject.objects.create(name='Math', teacher=test.teacher)
+    test.students = []
+    for i in range(5):
+        user = User.objects.create_user(f'student{i}', password='pw', role='student')
+        profile = StudentProfile.objects.create(user=user, grade='5')
+        profile.subjects.add(test.subject)
+        test.students.append(profile)
+
+
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+@task(max_attempts=2)
+def fails_once(job, value):
+    if job.attempts < 2:
+        raise RuntimeError('boom')
+    return {'value': value}
+
+
+@task(max_attempts=1)
+def always_fails(job):
+    raise ValueError('nope')
+
+
+@override_settings(AUDIT_LOG={'ASYNC': False})
+class SchoolTestCase(APITestCase):
+    """Base for the API tests, on the users and subject of create_school"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_school(cls)
+
+    def setUp(self):
+        clear_caches()
+
+    def auth(self, user):
+        self.client.force_authenticate(user)
+
+
+@override_settings(AUDIT_LOG={'ASYNC': False})
+class SchoolTransactionTestCase(APITransactionTestCase):
+    """SchoolTestCase for tests that need real commits"""
+
+    def setUp(self):
+        clear_caches()
+        create_school(self)
+
+    def auth(self, user):
+        self.client.force_authenticate(user)
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Base for the query-plan regression tests: runs EXPLAIN QUERY PLAN on a
+    viewset's role-scoped queryset and fails if SQLite has to scan a table.
+
+    Admin querysets (and students' subject list) are unfiltered by design and
+    are not checked; they rely on pagination instead.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='pw', role='admin')
+        cls.teacher = User.objects.create_user('teacher', password='pw', role='teacher')
+        cls.student = User.objects.create_user('student', password='pw', role='student')
+        cls.subject = Subject.objects.create(name='Math', teacher=cls.teacher)
+        cls.profile = StudentProfile.objects.create(user=cls.student, grade='5')
+        cls.profile.subjects.add(cls.subject)
+
+    def scoped_queryset(self, viewset_class, user, action='list'):
+        view = viewset_class()
+        view.request = SimpleNamespace(user=user, query_params={})
+        view.action = action
+        view.format_kwarg = None
+        view.kwargs = {}
+        return view.get_queryset()
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, viewset_class, user):
+        plan = self.query_plan(self.scoped_queryset(viewset_class, user))
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        self.assertFalse(
+            scans,
+            f"{viewset_class.__name__} for a {user.role} scans a table:\n" + "\n".join(plan)
+        )
+
+
+class UserQueryPlanTests(QueryPlanTestCase):
+    def test_user_list_for_teacher(self):
+        self.assertNoFullScan(UserViewSet, self.teacher)
+
+    def test_user_list_for_student(self):
+        self.assertNoFullScan(UserViewSet, self.student)
+
+    def test_notice_list_for_teacher(self):
+        self.assertNoFullScan(NoticeViewSet, self.teacher)
+
+    def test_notice_list_for_student(self):
+        self.assertNoFullScan(NoticeViewSet, self.student)
+
+
+class KeysetPaginationTests(SchoolTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i in range(7):
+            notice.objects.create(title=f'n{i}', content='c', created_by=cls.admin, audience='both')
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        titles = [item['title'] for item in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            titles += [item['title'] for item in response.data['results']]
+        return titles
+
+    def test_unpaginated_without_params(self):
+        self.auth(self.admin)
+        response = self.client.get('/api/notice/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_pages_follow_the_view_ordering(self):
+        self.auth(self.admin)
+        self.assertEqual(self.titles('/api/notice/?page_size=3'), [f'n{i}' for i in reversed(range(7))])
+        self.auth(self.teacher)
+        response = self.client.get('/api/student-profiles/?page_size=2')
+        self.assertEqual(len(response.data['results']), 2)
+
+    @override_settings(PAGINATION_PAGE_SIZE=2, PAGINATION_MAX_PAGE_SIZE=4)
+    def test_page_sizes_follow_settings(self):
+        self.auth(self.admin)
+        response = self.client.get('/api/notice/?cursor=')
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get('/api/notice/?page_size=100')
+        self.assertEqual(len(response.data['results']), 4)
+
+
+@override_settings(SQLITE_TUNING={'ENABLED': True, 'RETRY_BACKOFF_MS': 1})
+class SqliteTuningTests(TransactionTestCase):
+    def begins(self, wrapper):
+        return [query['sql'] for query in wrapper.queries_log if query['sql'].startswith('BEGIN')]
+
+    def test_immediate_atomic_on_a_fresh_or_reopened_connection(self):
+        original = connections[DEFAULT_DB_ALIAS]
+        fresh = original.copy()
+        fresh.force_debug_cursor = True
+        connections[DEFAULT_DB_ALIAS] = fresh
+        try:
+            # Never connected: transaction_mode does not exist yet
+            with immediate_atomic():
+                fresh.cursor().execute('SELECT 1')
+            # Dropped, as CONN_MAX_AGE and health checks do; reconnecting resets the mode
+            fresh.connection = None
+            with immediate_atomic():
+                fresh.cursor().execute('SELECT 1')
+            self.assertEqual(self.begins(fresh), ['BEGIN IMMEDIATE', 'BEGIN IMMEDIATE'])
+            with transaction.atomic():
+                fresh.cursor().execute('SELECT 1')
+            self.assertEqual(self.begins(fresh)[-1], 'BEGIN')
+        finally:
+            connections[DEFAULT_DB_ALIAS] = original
+
+    def test_retry_when_locked(self):
+        calls = []
+
+        @retry_when_locked
+        def write():
+            calls.append(len(calls))
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'written'
+
+        self.assertEqual(write(), 'written')
+        self.assertEqual(len(calls), 3)
+
+        # Inside an outer transaction only the outer block could start over
+        calls.clear()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write()
+        self.assertEqual(len(calls), 1)
+
+
+class ReplicaStickyCacheCheckTests(SimpleTestCase):
+    @override_settings(DATABASE_REPLICAS={'ALIASES': []})
+    def test_no_replicas(self):
+        self.assertEqual(check_sticky_cache(None), [])
+
+    @override_settings(
+        DATABASE_REPLICAS={'ALIASES': ['replica']},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_process_local_cache(self):
+        self.assertEqual([error.id for error in check_sticky_cache(None)], ['user.E002'])
+
+    @override_settings(
+        DATABASE_REPLICAS={'ALIASES': ['replica'], 'CACHE': 'pins'},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    )
+    def test_unknown_cache(self):
+        self.assertEqual([error.id for error in check_sticky_cache(None)], ['user.E001'])
+
+    @override_settings(
+        DATABASE_REPLICAS={'ALIASES': ['replica']},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}},
+    )
+    def test_shared_cache(self):
+        self.assertEqual(check_sticky_cache(None), [])
+
+
+@skipUnless('replica' in settings.DATABASES, "run with --settings=Sms.settings_replica")
+class ReplicaRoutingTests(APITransactionTestCase):
+    """
+    The primary and the replica are separate test databases here, with no
+    replication between them, so a read shows which one it went to.
+    """
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        caches['default'].clear()
+        self.teacher = User.objects.create_user('teacher', password='pw', role='teacher')
+        self.other = User.objects.create_user('other', password='pw', role='teacher')
+        self.subject = Subject.objects.create(name='Math', teacher=self.teacher)
+        student = User.objects.create_user('student', password='pw', role='student')
+        self.profile = StudentProfile.objects.create(user=student, grade='5')
+        self.profile.subjects.add(self.subject)
+
+    def marks(self, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get('/api/marks/')
+        self.assertEqual(response.status_code, 200)
+        return len(response.json()), bool(replica.captured_queries)
+
+    def test_reads_your_writes(self):
+        self.assertEqual(self.marks(self.teacher), (0, True))
+
+        self.client.force_authenticate(self.teacher)
+        response = self.client.post(
+            '/api/marks/', {'student': self.profile.pk, 'subject': self.subject.pk, 'marks': 70}, format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+        # Pinned to the primary for STICKY_SECONDS; other users are not
+        self.assertEqual(self.marks(self.teacher), (1, False))
+        self.assertEqual(self.marks(self.other), (0, True))
+        time.sleep(settings.DATABASE_REPLICAS['STICKY_SECONDS'] + 0.1)
+        self.assertEqual(self.marks(self.teacher), (0, True))
+
+
+class RequestTimingTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        view_latency.reset()
+        self.addCleanup(view_latency.reset)
+
+    def timings(self, response):
+        return {
+            name: (float(duration), desc)
+            for name, duration, desc in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response['Server-Timing'])
+        }
+
+    def test_server_timing(self):
+        self.auth(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user/')
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'app', 'db', 'serialize', 'render'})
+        self.assertEqual(timings['db'][1], f'{len(queries)} queries')
+        self.assertEqual(timings['serialize'][1], 'Serializer data')
+        self.assertEqual(timings['render'][1], 'Response rendering')
+        for name in ('serialize', 'render'):
+            self.assertGreater(timings[name][0], 0, name)
+        self.assertLessEqual(timings['serialize'][0] + timings['render'][0], timings['app'][0])
+
+    async def test_asgi_requests(self):
+        token = CustomTokenObtainPairSerializer.get_token(self.admin).access_token
+        response = await AsyncClient().get('/api/user/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        # The view's queries run in a worker thread, with its own connections
+        self.assertGreater(int(timings['db'][1].split()[0]), 0)
+        self.assertGreater(timings['db'][0], 0)
+        self.assertGreater(timings['serialize'][0], 0)
+
+    def test_metrics(self):
+        self.auth(self.admin)
+        queries = 0
+        for _ in range(3):
+            queries += int(self.timings(self.client.get('/api/user/'))['db'][1].split()[0])
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        stats = response.data['user-list']
+        self.assertEqual((stats['count'], stats['mean_queries']), (3, queries / 3))
+        self.assertEqual(sum(stats['histogram'].values()), 3)
+        self.assertGreater(stats['mean_serialize_ms'], 0)
+        self.assertGreater(stats['mean_render_ms'], 0)
+        self.assertGreaterEqual(stats['max_ms'], stats['mean_ms'])
+
+        self.auth(self.teacher)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_nested_serializers_are_not_timed(self):
+        self.auth(self.admin)
+        with mock.patch('user.fieldsets.perf_counter', wraps=time.perf_counter) as clock:
+            self.client.get('/api/student-profiles/')
+        # Twice for each of the five profiles; their nested users and subjects not at all
+        self.assertEqual(clock.call_count, 10)
+
+    @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 0})
+    def test_unsampled(self):
+        self.auth(self.admin)
+        response = self.client.get('/api/notice/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(view_latency.snapshot(), {})
+
+    @override_settings(REQUEST_TIMING={'ENABLED': False})
+    def test_disabled(self):
+        self.auth(self.admin)
+        self.assertNotIn('Server-Timing', self.client.get('/api/notice/'))
+
+
+class AsyncReadViewTests(SchoolTestCase):
+    """
+    ASYNC_READ_VIEWS is read when the URLconf is built, so these build the
+    views themselves rather than going through the test client.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.notice = notice.objects.create(title='n1', content='c', created_by=cls.teacher, audience='student')
+        notice.objects.create(title='n2', content='c', created_by=cls.teacher, audience='teacher')
+        Marks.objects.create(student=cls.students[0], subject=cls.subject, marks=50, published=True)
+        Marks.objects.create(student=cls.students[1], subject=cls.subject, marks=60, published=True)
+
+    def as_view(self, viewset_class, action):
+        with override_settings(ASYNC_READ_VIEWS=True):
+            return viewset_class.as_view({'get': action})
+
+    def get(self, view, user=None, path='/', data=None, **kwargs):
+        headers = {}
+        if user is not None:
+            token = CustomTokenObtainPairSerializer.get_token(user).access_token
+            headers['Authorization'] = f'Bearer {token}'
+        request = AsyncRequestFactory().get(path, data, headers=headers)
+        return view(request, **kwargs)
+
+    def test_off_by_default(self):
+        self.assertFalse(settings.ASYNC_READ_VIEWS)
+        self.assertFalse(asyncio.iscoroutinefunction(NoticeViewSet.as_view({'get': 'list'})))
+        self.assertTrue(asyncio.iscoroutinefunction(self.as_view(NoticeViewSet, 'list')))
+
+    async def test_list(self):
+        view = self.as_view(NoticeViewSet, 'list')
+        response = await self.get(view, self.students[0].user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['title'] for row in response.data], ['n1'])
+
+        response = await self.get(view, self.admin, data={'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+    async def test_list_scoped_to_student(self):
+        view = self.as_view(MarksViewSet, 'list')
+        response = await self.get(view, self.students[0].user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['marks'] for row in response.data], [50])
+
+    async def test_retrieve(self):
+        view = self.as_view(NoticeViewSet, 'retrieve')
+        response = await self.get(view, self.students[0].user, pk=self.notice.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'n1')
+
+        hidden = await notice.objects.aget(title='n2')
+        for pk in (hidden.pk, 999, 'abc'):
+            response = await self.get(view, self.students[0].user, pk=pk)
+            self.assertEqual(response.status_code, 404, pk)
+
+    async def test_unauthenticated(self):
+        response = await self.get(self.as_view(NoticeViewSet, 'list'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_planned_queryset_defers_nothing(self):
+        class RecordedMarksSerializer(MarksSerializer):
+            # Reads a column the query plan does not know about
+            recorded = serializers.SerializerMethodField()
+
+            class Meta(MarksSerializer.Meta):
+                fields = MarksSerializer.Meta.fields + ['recorded']
+                field_lookups = {**MarksSerializer.Meta.field_lookups, 'recorded': []}
+
+            def get_recorded(self, obj):
+                return obj.created_at.date()
+
+        with override_settings(ASYNC_READ_VIEWS=True):
+            view = MarksViewSet.as_view({'get': 'list'}, serializer_class=RecordedMarksSerializer)
+        response = await self.get(view, self.teacher, data={'fields': 'id,recorded'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(row) for row in response.data], [{'id', 'recorded'}] * 2)
+
+
+class ResponseCacheTests(SchoolTestCase):
+    def notices(self, user):
+        self.auth(user)
+        response = self.client.get('/api/notice/')
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data]
+
+    def test_default_scope_is_the_user(self):
+        view = CachedListMixin()
+        view.request = SimpleNamespace(user=self.teacher)
+        self.assertEqual(view.get_cache_scope(), f'user:{self.teacher.pk}')
+
+    def test_notice_list_invalidated_after_commit(self):
+        user = self.students[0].user
+        self.assertEqual(self.notices(user), [])
+        version = namespace_version('notice')
+        with self.captureOnCommitCallbacks(execute=True):
+            notice.objects.create(title='n1', content='c', created_by=self.teacher, audience='student')
+            # A read before the commit must not be cached under the new version
+            self.assertEqual(namespace_version('notice'), version)
+        self.assertNotEqual(namespace_version('notice'), version)
+        self.assertEqual(self.notices(user), ['n1'])
+
+    def test_author_rename_invalidated_after_commit(self):
+        notice.objects.create(title='n1', content='c', created_by=self.teacher, audience='both')
+        self.notices(self.admin)
+        version = namespace_version('notice')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.first_name = 'Renamed'
+            self.teacher.save()
+            self.assertEqual(namespace_version('notice'), version)
+        self.assertNotEqual(namespace_version('notice'), version)
+
+
+    def test_teacher_subjects_invalidated_after_commit(self):
+        science = Subject.objects.create(name='Science')
+        version = namespace_version('subjects')
+        self.auth(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/user/', {
+                    'username': 'teacher2', 'password': 'Quiet-harbor-81', 'role': 'teacher', 'subjects': [science.id],
+                }, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(namespace_version('subjects'), version)
+        self.assertNotEqual(namespace_version('subjects'), version)
+        # Assigned once, by UserSerializer.create
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "teacher_subject"')]
+        self.assertEqual(len(updates), 1)
+        science.refresh_from_db()
+        self.assertEqual(science.teacher.username, 'teacher2')
+
+    @override_settings(PROVISIONING_HASH_WORKERS=1)
+    def test_provisioned_teachers_invalidated_after_commit(self):
+        science = Subject.objects.create(name='Science')
+        version = namespace_version('assignments')
+        self.auth(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/user/bulk-create/', {'users': [
+                {'username': 'teacher2', 'password': 'Quiet-harbor-81', 'role': 'teacher', 'subjects': str(science.id)},
+            ]}, format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(namespace_version('assignments'), version)
+        self.assertNotEqual(namespace_version('assignments'), version)
+
+    def test_enrolment_forgotten_after_commit(self):
+        science = Subject.objects.create(name='Science')
+        profile, other = self.students[:2]
+
+        def cached(user):
+            return response_cache().get(f'student-subjects:{user.pk}')
+
+        student_subject_ids(profile.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.subjects.add(science)
+            self.assertEqual(cached(profile.user), [self.subject.pk])
+        self.assertIsNone(cached(profile.user))
+
+        # Cleared from the subject's side: the enrolled students are read before the links go
+        for user in (profile.user, other.user):
+            student_subject_ids(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subject.students.clear()
+            self.assertIsNotNone(cached(other.user))
+        self.assertIsNone(cached(profile.user))
+        self.assertIsNone(cached(other.user))
+
+        student_subject_ids(other.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+            self.assertIsNotNone(cached(other.user))
+        self.assertIsNone(cached(other.user))
+
+
+class ConditionalGetTests(SchoolTestCase):
+    def test_unchanged_lists_answer_304(self):
+        notice.objects.create(title='Trip', content='c', created_by=self.admin, audience='student')
+        for url in ('/api/notice/', '/api/subjects/', '/api/assignments/', '/api/marks/'):
+            for user in (self.admin, self.teacher, self.students[0].user):
+                self.auth(user)
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                # Only the validating aggregate
+                with self.assertNumQueries(1):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304, (url, user.username))
+                self.assertEqual(response.content, b'')
+
+    def test_list_etag_changes(self):
+        first = Marks.objects.create(student=self.students[0], subject=self.subject, marks=50)
+        self.auth(self.teacher)
+        etag = self.client.get('/api/marks/')['ETag']
+        Marks.objects.create(student=self.students[1], subject=self.subject, marks=60)
+        response = self.client.get('/api/marks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.data)), (200, 2))
+
+        # Deleting a row other than the latest leaves max(updated_at) alone
+        etag = response['ETag']
+        first.delete()
+        response = self.client.get('/api/marks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.data)), (200, 1))
+
+        # A renamed subject is nested in the marks
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subject.name = 'Maths'
+            self.subject.save()
+        self.assertEqual(self.client.get('/api/marks/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Another user, another path: another ETag
+        etag = self.client.get('/api/marks/')['ETag']
+        self.assertEqual(self.client.get('/api/marks/?subject=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.auth(self.admin)
+        self.assertEqual(self.client.get('/api/marks/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_retrieve(self):
+        item = notice.objects.create(title='Trip', content='c', created_by=self.admin, audience='student')
+        url = f'/api/notice/{item.id}/'
+        self.auth(self.students[0].user)
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        item.title = 'Outing'
+        item.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/notice/999/').status_code, 404)
+
+        assignment = Assignment.objects.create(
+            title='Essay', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student',
+        )
+        for url in (f'/api/assignments/{assignment.id}/', f'/api/subjects/{self.subject.id}/'):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+
+class CachedJWTAuthenticationTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        token = CustomTokenObtainPairSerializer.get_token(self.teacher).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def get(self):
+        return self.client.get('/api/subjects/')
+
+    def test_user_is_cached(self):
+        original = CachedJWTAuthentication._snapshot_queryset
+        with mock.patch.object(
+            CachedJWTAuthentication, '_snapshot_queryset', autospec=True, side_effect=original,
+        ) as snapshot_queryset:
+            self.assertEqual(self.get().status_code, 200)
+            self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(snapshot_queryset.call_count, 1)
+        self.assertEqual(user_cache.get(self.teacher.pk)['role'], 'teacher')
+
+    @override_settings(JWT_USER_CACHE={'CACHE': 'responses'})
+    def test_invalidated_in_the_configured_cache_after_commit(self):
+        self.get()
+        self.assertIsNotNone(caches['responses'].get(f'jwt-user:{self.teacher.pk}'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.first_name = 'Renamed'
+            self.teacher.save()
+            self.assertIsNotNone(user_cache.get(self.teacher.pk))
+        self.assertIsNone(user_cache.get(self.teacher.pk))
+
+    def test_role_change_rejects_old_tokens(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.teacher.pk).update(role='student')
+            self.teacher.refresh_from_db()
+            self.teacher.save()
+        response = self.get()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'role_changed')
+
+    def test_deleted_user_is_rejected(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.delete()
+        self.assertEqual(self.get().status_code, 401)
+
+
+@override_settings(PROVISIONING_HASH_WORKERS=1)
+class ProvisioningTests(SchoolTestCase):
+    password = 'Quiet-harbor-81'
+
+    def provision(self, data, format='json'):
+        self.auth(self.admin)
+        return self.client.post('/api/user/bulk-create/', data, format=format)
+
+    def test_bulk_create(self):
+        science = Subject.objects.create(name='Science')
+        response = self.provision({'users': [
+            {'username': 'new0', 'password': self.password, 'role': 'student',
+             'subjects': [self.subject.id, science.id], 'grade': '7'},
+            {'username': 'new1', 'password': self.password, 'role': 'teacher', 'subjects': str(science.id)},
+            {'username': 'new0', 'password': self.password, 'role': 'student'},
+            {'username': 'bad', 'password': self.password, 'role': 'nobody', 'subjects': 'a'},
+        ]})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']], ['created', 'created', 'error', 'error'],
+        )
+        self.assertEqual(response.data['results'][2]['errors'], ["Username already taken."])
+        self.assertEqual(len(response.data['results'][3]['errors']), 2)
+
+        self.assertTrue(User.objects.get(username='new0').check_password(self.password))
+        profile = StudentProfile.objects.get(user__username='new0')
+        self.assertEqual(profile.grade, '7')
+        self.assertEqual(profile.subjects.count(), 2)
+        science.refresh_from_db()
+        self.assertEqual(science.teacher.username, 'new1')
+
+    def test_password_validators(self):
+        response = self.provision({'users': [
+            {'username': 'short', 'password': 'pw', 'role': 'admin'},
+            {'username': 'numeric', 'password': '4815162342', 'role': 'admin'},
+            {'username': 'common', 'password': 'password123', 'role': 'admin'},
+            {'username': 'harborquiet', 'password': 'harborquiet', 'role': 'admin'},
+        ]})
+        self.assertEqual(response.status_code, 400, response.data)
+        for result in response.data['results']:
+            self.assertEqual(result['status'], 'error')
+            self.assertTrue(result['errors'], result)
+        self.assertIn("This password is too short. It must contain at least 8 characters.",
+                      response.data['results'][0]['errors'])
+        self.assertIn("This password is entirely numeric.", response.data['results'][1]['errors'])
+        self.assertIn("This password is too common.", response.data['results'][2]['errors'])
+        self.assertIn("The password is too similar to the username.", response.data['results'][3]['errors'])
+        self.assertFalse(User.objects.filter(username__in=['short', 'numeric', 'common', 'harborquiet']).exists())
+
+    def test_csv(self):
+        body = f"Username,Password,Role,Grade,Subjects\nc1,{self.password},student,3,{self.subject.id}\nc2,pw,student,3,\n"
+        response = self.provision({'file': SimpleUploadedFile('users.csv', body.encode())}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([result['status'] for result in response.data['results']], ['created', 'error'])
+        self.assertEqual(StudentProfile.objects.get(user__username='c1').grade, '3')
+
+
+    @override_settings(PROVISIONING_HASH_WORKERS=2)
+    def test_hash_pool(self):
+        passwords = [f'{self.password}-{i}' for i in range(HASH_INLINE_BELOW)]
+        self.enterContext(mock.patch('user.provisioning._hash_pool', None))
+        self.enterContext(mock.patch('user.provisioning.atexit'))
+        executor = self.enterContext(mock.patch('user.provisioning.ProcessPoolExecutor'))
+        executor.return_value.map.side_effect = lambda fn, items, chunksize: map(fn, items)
+
+        # Small batches never reach the pool
+        hash_passwords(passwords[:-1])
+        executor.assert_not_called()
+
+        # One spawn-context pool serves every later batch
+        for _ in range(2):
+            hashes = hash_passwords(passwords)
+        executor.assert_called_once()
+        self.assertEqual(executor.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+        self.assertEqual(executor.call_args.kwargs['max_workers'], 2)
+        self.assertTrue(all(check_password(password, hashed) for password, hashed in zip(passwords, hashes)))
+
+        # A broken pool is replaced on the next batch
+        executor.return_value.map.side_effect = BrokenProcessPool
+        with self.assertRaises(BrokenProcessPool):
+            hash_passwords(passwords)
+        executor.return_value.map.side_effect = lambda fn, items, chunksize: map(fn, items)
+        hash_passwords(passwords)
+        self.assertEqual(executor.call_count, 2)
+
+class FastJSONRendererTests(SimpleTestCase):
+    def assertRendersLikeDRF(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_same_output_as_drf(self):
+        self.assertRendersLikeDRF({
+            'id': 1,
+            'name': 'Zoë \u2028 "quoted"',
+            'marks': [55.5, 0.1, -3.0],
+            'when': datetime.datetime(2024, 2, 29, 8, 30, tzinfo=datetime.timezone.utc),
+            'day': datetime.date(2024, 2, 29),
+            'average': Decimal('61.25'),
+            'label': gettext_lazy('Marks'),
+            'nested': {1: None, 'flag': True},
+        })
+
+    def test_data_orjson_refuses_falls_back(self):
+        self.assertRendersLikeDRF({'big': 2 ** 70})
+
+    def test_indented_output_uses_drf(self):
+        context = {'indent': 2}
+        data = {'a': [1, 2]}
+        self.assertEqual(
+            FastJSONRenderer().render(data, renderer_context=context),
+            JSONRenderer().render(data, renderer_context=context),
+        )
+
+    @skipUnless(orjson, 'orjson is not installed')
+    def test_known_float_differences(self):
+        self.assertEqual(FastJSONRenderer().render({'x': 1e16}), b'{"x":1e16}')
+        self.assertEqual(JSONRenderer().render({'x': 1e16}), b'{"x":1e+16}')
+        self.assertEqual(FastJSONRenderer().render({'x': float('nan')}), b'{"x":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'x': float('nan')})
+
+
+@override_settings(RESPONSE_COMPRESSION={'MIN_SIZE': 100})
+class CompressionMiddlewareTests(SimpleTestCase):
+    body = b'{"rows": [' + b','.join(b'{"id": %d, "name": "student"}' % i for i in range(100)) + b']}'
+
+    def respond(self, response, accept_encoding='gzip'):
+        request = RequestFactory().get('/', headers={'Accept-Encoding': accept_encoding})
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def json_response(self, body=None, **headers):
+        return HttpResponse(self.body if body is None else body, content_type='application/json', headers=headers)
+
+    def test_negotiate_encoding(self):
+        encodings = ['zstd', 'br', 'gzip']
+        self.assertEqual(negotiate_encoding('gzip, br', encodings), 'br')
+        self.assertEqual(negotiate_encoding('gzip, br;q=0.5', encodings), 'gzip')
+        self.assertEqual(negotiate_encoding('*', encodings), 'zstd')
+        self.assertEqual(negotiate_encoding('*, zstd;q=0', encodings), 'br')
+        self.assertEqual(negotiate_encoding('GZIP;q=0.8', encodings), 'gzip')
+        self.assertIsNone(negotiate_encoding('gzip;q=0, identity', encodings))
+        self.assertIsNone(negotiate_encoding('br;q=abc', encodings))
+        self.assertIsNone(negotiate_encoding('', encodings))
+
+    def test_gzip(self):
+        response = self.respond(self.json_response(ETag='"v1"'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"v1"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(zlib.decompress(response.content, 31), self.body)
+
+    @skipUnless('br' in COMPRESSORS and 'zstd' in COMPRESSORS, 'brotli or zstandard is not installed')
+    def test_preferred_encoding(self):
+        self.assertEqual(self.respond(self.json_response(), 'gzip, br, zstd')['Content-Encoding'], 'zstd')
+        self.assertEqual(self.respond(self.json_response(), 'gzip, br')['Content-Encoding'], 'br')
+
+    def test_left_alone(self):
+        cases = [
+            (self.json_response(b'{}'), 'gzip'),
+            (self.json_response(), 'identity'),
+            (self.json_response(**{'Accept-Ranges': 'bytes'}), 'gzip'),
+            (HttpResponse(self.body, content_type='image/png'), 'gzip'),
+            (HttpResponse(self.body, content_type='text/event-stream'), 'gzip'),
+        ]
+        for response, accept_encoding in cases:
+            content = response.content
+            response = self.respond(response, accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'), response)
+            self.assertEqual(response.content, content)
+
+    def test_streaming_flushes_every_chunk(self):
+        chunks = [b'id,marks\n', b'1,55\n' * 50, b'2,60\n' * 50]
+        response = self.respond(StreamingHttpResponse(iter(chunks), content_type='text/csv'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+
+        decompressor = zlib.decompressobj(31)
+        parts = iter(response.streaming_content)
+        for chunk in chunks:
+            # Each input chunk can be decoded as soon as its output arrives
+            self.assertEqual(decompressor.decompress(next(parts)), chunk)
+        self.assertEqual(decompressor.decompress(b''.join(parts)) + decompressor.flush(), b'')
+        self.assertTrue(decompressor.eof)
+
+    async def test_async_streaming(self):
+        async def content():
+            for chunk in (b'a' * 200, b'b' * 200):
+                yield chunk
+
+        response = self.respond(StreamingHttpResponse(content(), content_type='application/x-ndjson'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = b''.join([part async for part in response.streaming_content])
+        self.assertEqual(zlib.decompress(body, 31), b'a' * 200 + b'b' * 200)
+
+
+class BlobStorageTests(SchoolTestCase):
+    body = bytes(range(256)) * 400
+    sha256 = hashlib.sha256(body).hexdigest()
+
+    def setUp(self):
+        super().setUp()
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def assignment(self, title='Handout'):
+        return Assignment.objects.create(
+            title=title, description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, published=True,
+        )
+
+    def save_file(self, instance, content, name='handout.pdf'):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.file.save(name, ContentFile(content), save=True)
+
+    def blob_path(self, sha256):
+        return blob_storage().path(f'x/{sha256}/x')
+
+    def refcounts(self):
+        return dict(Blob.objects.values_list('sha256', 'refcount'))
+
+    def settle(self):
+        Blob.objects.update(referenced_at=timezone.now() - datetime.timedelta(hours=2))
+
+    def test_identical_files_share_a_blob(self):
+        first, second = self.assignment(), self.assignment('Copy')
+        self.save_file(first, self.body)
+        self.save_file(second, self.body, 'copy.pdf')
+        self.assertEqual(first.file.name, f'assignments/{self.sha256}/handout.pdf')
+        self.assertEqual(self.refcounts(), {self.sha256: 2})
+        with open(self.blob_path(self.sha256), 'rb') as stored:
+            self.assertEqual(stored.read(), self.body)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.refcounts(), {self.sha256: 1})
+
+    def test_resaving_the_same_content(self):
+        assignment = self.assignment()
+        self.save_file(assignment, self.body)
+        self.save_file(assignment, self.body)
+        assignment = Assignment.objects.get(pk=assignment.pk)
+        self.save_file(assignment, self.body)
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.file = ContentFile(self.body, name='handout.pdf')
+            assignment.save()
+        self.assertEqual(self.refcounts(), {self.sha256: 1})
+
+        # Edits that leave the file alone keep its reference
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.title = 'Renamed'
+            assignment.save()
+        self.assertEqual(self.refcounts(), {self.sha256: 1})
+
+        self.save_file(assignment, b'other')
+        self.assertEqual(self.refcounts()[self.sha256], 0)
+
+    def test_collect_blobs(self):
+        assignment = self.assignment()
+        self.save_file(assignment, self.body)
+        self.save_file(self.assignment('Other'), b'other')
+        with self.captureOnCommitCallbacks(execute=True):
+            assignment.delete()
+        self.assertEqual(collect_blobs()['deleted'], 0)  # referenced too recently
+
+        self.settle()
+        Blob.objects.exclude(pk=self.sha256).update(refcount=7)
+        # The body is removed in the transaction that deletes the row
+        depths = []
+        delete_blob = ContentAddressedStorage.delete_blob
+
+        def record(storage, sha256):
+            depths.append(len(connection.atomic_blocks))
+            return delete_blob(storage, sha256)
+
+        with mock.patch.object(ContentAddressedStorage, 'delete_blob', autospec=True, side_effect=record):
+            stats = collect_blobs()
+        self.assertEqual((stats['deleted'], stats['bytes'], stats['recounted']), (1, len(self.body), 1))
+        self.assertEqual(depths, [len(connection.atomic_blocks) + 1])
+        self.assertFalse(os.path.exists(self.blob_path(self.sha256)))
+        self.assertEqual(list(Blob.objects.values_list('refcount', flat=True)), [1])
+
+        # Saving the content again writes a new row and body
+        self.save_file(self.assignment('Again'), self.body)
+        self.assertEqual(self.refcounts()[self.sha256], 1)
+        self.assertTrue(os.path.exists(self.blob_path(self.sha256)))
+
+    def test_stray_files(self):
+        self.save_file(self.assignment(), self.body)
+        stray = self.blob_path('0' * 64)
+        os.makedirs(os.path.dirname(stray))
+        with open(stray, 'wb') as out:
+            out.write(b'stray')
+        # A referenced body whose row went missing is not a stray
+        Blob.objects.all().delete()
+        old = time.time() - 7200
+        for path in (stray, self.blob_path(self.sha256)):
+            os.utime(path, (old, old))
+
+        out = open(os.devnull, 'w')
+        self.addCleanup(out.close)
+        call_command('gc_blobs', '--dry-run', stdout=out)
+        self.assertTrue(os.path.exists(stray))
+        self.assertEqual(collect_blobs()['strays'], 1)
+        self.assertFalse(os.path.exists(stray))
+        self.assertTrue(os.path.exists(self.blob_path(self.sha256)))
+
+    def test_download_ranges(self):
+        assignment = self.assignment()
+        self.save_file(assignment, self.body)
+        url = f'/api/assignments/{assignment.id}/file/'
+        etag = f'"{self.sha256}"'
+        self.auth(self.students[0].user)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('handout.pdf', response['Content-Disposition'])
+
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        response = self.client.get(url, headers={'Range': 'bytes=10-19', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.body)}')
+        self.assertEqual(b''.join(response.streaming_content), self.body[10:20])
+
+        response = self.client.get(url, headers={'Range': 'bytes=-5'})
+        self.assertEqual(b''.join(response.streaming_content), self.body[-5:])
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(url, headers={'Range': 'bytes=10-19', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(self.body))
+
+        response = self.client.get(url, headers={'Range': f'bytes={len(self.body)}-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.body)}')
+
+
+    async def test_downloads_stream_asynchronously_under_asgi(self):
+        assignment = await sync_to_async(self.assignment)()
+        submission = StudentSubmission(assignment=assignment, student=self.students[0])
+        await sync_to_async(self.save_file)(assignment, self.body)
+        await sync_to_async(self.save_file)(submission, self.body, 'essay.pdf')
+        token = CustomTokenObtainPairSerializer.get_token(self.students[0].user).access_token
+        for url in (f'/api/assignments/{assignment.id}/file/', f'/api/submissions/{submission.id}/file/'):
+            response = await AsyncClient().get(url, headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertTrue(response.is_async, url)
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.body)
+
+@override_settings(JOB_QUEUE={'QUEUES': {'default': 2, 'exports': 1}, 'BACKOFF': 0, 'POLL_INTERVAL_MS': 10})
+class JobQueueTests(SchoolTransactionTestCase):
+    def test_claims_by_priority_within_the_queue_limit(self):
+        worker = Worker()
+        for value in range(4):
+            enqueue(fails_once, {'value': value}, priority=value)
+        exported = enqueue(fails_once, {'value': 'export'}, queue='exports')
+        later = enqueue(fails_once, {'value': 'later'}, priority=10, delay=3600)
+
+        first, second = worker.claim(), worker.claim()
+        self.assertEqual([first.kwargs['value'], second.kwargs['value']], [3, 2])
+        self.assertEqual((first.status, first.attempts, first.locked_by), ('running', 1, worker.name))
+        # 'default' is full, which leaves the export
+        self.assertEqual(worker.claim().pk, exported.pk)
+        self.assertIsNone(worker.claim())
+        # The limit holds across workers
+        self.assertIsNone(Worker(name='other').claim())
+        self.assertEqual(Job.objects.get(pk=later.pk).status, 'queued')
+
+    def test_lease_recovery(self):
+        worker = Worker()
+        job = enqueue(fails_once, {'value': 1})
+        job = worker.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(seconds=61))
+        Worker(name='other').recover_expired()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('queued', '', 1))
+        self.assertEqual(job.error, "The worker running this job stopped")
+
+        # Out of attempts, it fails instead
+        job = worker.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(seconds=61))
+        worker.recover_expired()
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'failed')
+
+    def test_retries(self):
+        retried = enqueue(fails_once, {'value': 3})
+        failed = enqueue('user.tests.always_fails')
+        with self.assertLogs('user.jobs', 'ERROR'):
+            Worker().run(once=True)
+        retried.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts, retried.result), ('succeeded', 2, {'value': 3}))
+        self.assertEqual((failed.status, failed.attempts, failed.error), ('failed', 1, 'ValueError: nope'))
+
+    @override_settings(JOB_QUEUE={'QUEUES': {'default': 1}, 'BACKOFF': 60})
+    def test_retry_waits_for_backoff(self):
+        job = enqueue(fails_once, {'value': 1})
+        with self.assertLogs('user.jobs', 'ERROR'):
+            Worker().run(once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_after, timezone.now() + datetime.timedelta(seconds=25))
+
+    def test_backoff(self):
+        config = {'BACKOFF': 5, 'MAX_BACKOFF': 3600}
+        for attempts, low, high in ((1, 2.5, 5), (3, 10, 20), (20, 1800, 3600)):
+            for _ in range(20):
+                self.assertTrue(low <= backoff(attempts, config) <= high, attempts)
+
+    def test_purge_finished(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            now = timezone.now()
+            name = default_storage.save('exports/1/marks.csv', ContentFile(b'id\n'))
+            old = enqueue(fails_once, {'value': 1})
+            Job.objects.filter(pk=old.pk).update(
+                status='succeeded', result={'file': name}, finished_at=now - datetime.timedelta(days=8),
+            )
+            recent = enqueue(fails_once, {'value': 2})
+            Job.objects.filter(pk=recent.pk).update(status='failed', finished_at=now - datetime.timedelta(days=1))
+            waiting = enqueue(fails_once, {'value': 3})
+
+            self.assertEqual(purge_finished(now), 1)
+            self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {recent.pk, waiting.pk})
+            self.assertFalse(default_storage.exists(name))
+            self.assertFalse(os.path.exists(os.path.join(media, 'exports', '1')))
+
+
+class ArchiveTests(SchoolTestCase):
+    def setUp(self):
+        super().setUp()
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+
+    def delete_long_ago(self, user):
+        user.delete()
+        User.objects.filter(pk=user.pk).update(deleted_at=timezone.now() - datetime.timedelta(days=100))
+
+    def archive(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_deleted_users', '--days', '90', *args, stdout=out)
+        return out.getvalue()
+
+    def restore(self, user_id):
+        self.auth(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/user/{user_id}/restore/')
+
+    def test_archive_and_restore(self):
+        profile = self.students[0]
+        art = Subject.objects.create(name='Art', teacher=self.teacher)
+        profile.subjects.add(art)
+        Marks.objects.create(student=profile, subject=self.subject, marks=50)
+        Marks.objects.create(student=profile, subject=art, marks=70)
+        assignment = Assignment.objects.create(
+            title='a', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            submission = StudentSubmission.objects.create(
+                assignment=assignment, student=profile, file=ContentFile(b'hello', name='essay.txt'),
+            )
+        AuditEvent.objects.create(actor=profile.user, actor_username=profile.user.username, action='login')
+        user = profile.user
+        self.delete_long_ago(user)
+        # Teachers who authored assignments stay in the hot tables
+        self.delete_long_ago(self.teacher)
+
+        self.assertIn('Would archive 1', self.archive('--dry-run'))
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+        output = self.archive()
+        self.assertIn('Archived 1', output)
+        self.assertIn('skipped 1', output)
+
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        self.assertFalse(StudentProfile.all_objects.filter(pk=profile.pk).exists())
+        self.assertFalse(Marks.all_objects.exists())
+        self.assertFalse(StudentSubmission.all_objects.exists())
+        self.assertIsNone(AuditEvent.objects.get().actor_id)
+        self.assertEqual(ArchivedUser.objects.get().blobs, [submission.file.name])
+
+        # gc_blobs counts the archived file as a reference
+        Blob.objects.update(referenced_at=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(collect_blobs(grace=0)['deleted'], 0)
+
+        # Marks for a subject deleted in the meantime are dropped
+        art.delete()
+        response = self.restore(user.pk)
+        self.assertEqual(response.status_code, 200, response.data)
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.is_deleted)
+        self.assertIsNone(user.deleted_at)
+        self.assertTrue(user.check_password('pw'))
+        profile = StudentProfile.objects.get(pk=profile.pk)
+        self.assertEqual(list(profile.subjects.values_list('pk', flat=True)), [self.subject.pk])
+        self.assertEqual(list(Marks.objects.values_list('marks', flat=True)), [50])
+        self.assertEqual(StudentSubmission.objects.get().file.read(), b'hello')
+        self.assertEqual(AuditEvent.objects.get().actor_id, user.pk)
+        self.assertEqual(GradebookSummary.objects.get(student=profile).total, 50)
+        self.assertFalse(ArchivedUser.objects.exists())
+
+        self.assertEqual(self.restore(99999).status_code, 404)
+
+    def test_taken_username(self):
+        user = self.students[1].user
+        self.delete_long_ago(user)
+        self.archive()
+        User.objects.create_user(user.username, password='pw', role='student')
+        response = self.restore(user.pk)
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertTrue(ArchivedUser.objects.filter(user_id=user.pk).exists())
+
+    def test_teacher_is_detached_and_relinked(self):
+        teacher = User.objects.create_user('teacher2', password='pw', role='teacher')
+        biology = Subject.objects.create(name='Biology', teacher=teacher)
+        self.delete_long_ago(teacher)
+        self.archive()
+        biology.refresh_from_db()
+        self.assertIsNone(biology.teacher_id)
+
+        self.assertEqual(self.restore(teacher.pk).status_code, 200)
+        biology.refresh_from_db()
+        self.assertEqual(biology.teacher_id, teacher.pk)
+
+    def test_restore_ignores_removed_fields(self):
+        user = self.students[2].user
+        self.delete_long_ago(user)
+        self.archive()
+        archived = ArchivedUser.objects.get()
+        for row in archived.rows:
+            row['fields']['removed_since'] = 'x'
+        archived.save()
+        self.assertEqual(self.restore(user.pk).status_code, 200)
+        self.assertTrue(StudentProfile.objects.filter(user=user).exists())
+
+
+async def read_until(content, needle, timeout=3):
+    """Read a streaming response until `needle` appears; returns what was read"""
+    received = ''
+
+    async def read():
+        nonlocal received
+        async for chunk in content:
+            received += chunk.decode() if isinstance(chunk, bytes) else chunk
+            if needle in received:
+                return
+
+    await asyncio.wait_for(read(), timeout)
+    return received
+
+
+class EventStreamTests(SchoolTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        events._broker = None
+        self.addCleanup(setattr, events, '_broker', None)
+
+    def access_token(self, user):
+        return CustomTokenObtainPairSerializer.get_token(user).access_token
+
+    async def stream_token(self, user):
+        response = await AsyncClient().post(
+            '/api/events/token/', headers={'Authorization': f'Bearer {self.access_token(user)}'},
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['token']
+
+    def test_broker_backends_must_publish(self):
+        with self.assertRaises(TypeError):
+            events.BaseBroker(events.events_config())
+
+    def test_wsgi_is_refused(self):
+        self.assertEqual(self.client.get('/api/events/').status_code, 501)
+
+    async def test_token_in_url_must_be_a_stream_token(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/events/')).status_code, 401)
+        user = self.students[0].user
+        response = await client.get('/api/events/', {'token': str(self.access_token(user))})
+        self.assertEqual(response.status_code, 401)
+
+        access = self.access_token(user)
+        stream = events.StreamToken.for_access_token(user, access)
+        self.assertEqual(stream['session_exp'], access['exp'])
+        self.assertLessEqual(stream['exp'], time.time() + 60)
+        # ...and is no use anywhere else
+        response = await client.get('/api/notice/', headers={'Authorization': f'Bearer {stream}'})
+        self.assertEqual(response.status_code, 401)
+
+        stream.set_exp(lifetime=-datetime.timedelta(seconds=1))
+        self.assertEqual((await client.get('/api/events/', {'token': str(stream)})).status_code, 401)
+
+    async def test_stream(self):
+        user = self.students[0].user
+        response = await AsyncClient().get('/api/events/', {'token': await self.stream_token(user)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content.__aiter__()
+        await read_until(content, 'retry')
+
+        create_notice = sync_to_async(notice.objects.create)
+        await create_notice(title='for teachers', content='c', created_by=self.admin, audience='teacher')
+        await create_notice(title='for students', content='c', created_by=self.admin, audience='student')
+        received = await read_until(content, 'for students')
+        self.assertIn('event: notice.created', received)
+        self.assertNotIn('for teachers', received)
+
+        # Reconnecting with Last-Event-ID replays what the student may see
+        response = await AsyncClient().get(
+            '/api/events/', {'token': await self.stream_token(user)}, headers={'Last-Event-ID': '0'},
+        )
+        received = await read_until(response.streaming_content.__aiter__(), 'for students')
+        self.assertNotIn('for teachers', received)
+
+    async def test_bearer_header(self):
+        response = await AsyncClient().get(
+            '/api/events/', headers={'Authorization': f'Bearer {self.access_token(self.teacher)}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        await read_until(response.streaming_content.__aiter__(), 'retry')
+
+
+class AuditEventTests(SchoolTestCase):
+    def events(self, query=''):
+        self.auth(self.admin)
+        return self.client.get(f'/api/audit-events/{query}')
+
+    def test_filters(self):
+        record_event(self.admin, "Created user", "student")
+        record_event(self.teacher, "Published results")
+        AuditEvent.objects.filter(actor=self.teacher).update(created_at=timezone.now() - datetime.timedelta(days=2))
+
+        def actions(query):
+            response = self.events(query)
+            self.assertEqual(response.status_code, 200, response.data)
+            return [event['action'] for event in response.data]
+
+        self.assertEqual(actions(f'?actor={self.teacher.pk}'), ["Published results"])
+        self.assertEqual(actions('?actor=admin&action=created'), ["Created user"])
+        since = (timezone.now() - datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.assertEqual(actions(f'?since={since}'), ["Created user"])
+        self.assertEqual(actions(f'?until={since}'), ["Published results"])
+
+    def test_invalid_datetimes(self):
+        for query in ('?since=bad', '?until=2024-02-30T00:00', '?since=2024-13-01T00:00:00Z'):
+            response = self.events(query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_admin_only(self):
+        self.auth(self.teacher)
+        self.assertEqual(self.client.get('/api/audit-events/').status_code, 403)
+
+
+class AuditLogWriterTests(SchoolTransactionTestCase):
+    def event(self, action):
+        return AuditEvent(actor=self.admin, actor_username=self.admin.username, action=action)
+
+    def test_drops_events_when_the_queue_is_full(self):
+        writer = AuditLogWriter(queue_size=2, batch_size=10, flush_interval=1)
+        with mock.patch.object(writer, '_ensure_started'):
+            writer.enqueue(self.event('one'))
+            writer.enqueue(self.event('two'))
+            with self.assertLogs('user.audit', 'WARNING'):
+                writer.enqueue(self.event('three'))
+        writer.flush()
+        self.assertEqual(sorted(AuditEvent.objects.values_list('action', flat=True)), ['one', 'two'])
+
+    def test_background_writes_in_batches(self):
+        writer = AuditLogWriter(queue_size=100, batch_size=3, flush_interval=0.05)
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', wraps=AuditEvent.objects.bulk_create) as bulk_create:
+            for index in range(7):
+                writer.enqueue(self.event(str(index)))
+            deadline = time.monotonic() + 5
+            while AuditEvent.objects.count() < 7 and time.monotonic() < deadline:
+                time.sleep(0.02)
+            writer.shutdown()
+        self.assertEqual(AuditEvent.objects.count(), 7)
+        self.assertTrue(all(len(call.args[0]) <= 3 for call in bulk_create.call_args_list))
+
+    def test_shutdown_flushes(self):
+        writer = AuditLogWriter(queue_size=100, batch_size=100, flush_interval=10)
+        with mock.patch.object(writer, '_ensure_started'):
+            writer.enqueue(self.event('queued'))
+        writer.shutdown()
+        self.assertEqual(list(AuditEvent.objects.values_list('action', flat=True)), ['queued'])
+
+
+class ChunkedUploadTests(SchoolTestCase):
+    body = os.urandom(25000)
+
+    def setUp(self):
+        super().setUp()
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+        self.assignment = Assignment.objects.create(
+            title='Essay', description='d', created_by=self.teacher, due_date=timezone.now(),
+            subject=self.subject, audience='student', published=True,
+        )
+        self.auth(self.students[0].user)
+
+    def start(self, **data):
+        data = {
+            'target': 'submission', 'assignment': self.assignment.id, 'filename': '../essay.pdf',
+            'size': len(self.body), 'chunk_size': 10000, **data,
+        }
+        response = self.client.post('/api/uploads/', data, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put(self, session_id, index, data, sha256=None):
+        return self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/chunks/{index}/', data,
+            content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=sha256 or hashlib.sha256(data).hexdigest(),
+        )
+
+    def parts(self, session_id):
+        return sorted(os.listdir(os.path.join(self.media, 'uploads', session_id)))
+
+    def test_resumable_upload(self):
+        session_id = self.start(sha256=hashlib.sha256(self.body).hexdigest())
+        self.assertEqual(self.put(session_id, 1, self.body[10000:20000]).status_code, 200)
+        self.assertEqual(self.put(session_id, 0, self.body[:10000], '0' * 64).status_code, 400)
+        self.assertEqual(self.put(session_id, 2, self.body[20000:21000]).status_code, 400)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 400)
+        response = self.client.get(f'/api/uploads/{session_id}/')
+        self.assertEqual((response.data['filename'], response.data['missing']), ('essay.pdf', [0, 2]))
+
+        self.put(session_id, 0, self.body[:10000])
+        self.put(session_id, 2, self.body[20000:])
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(StudentSubmission.objects.get().file.read(), self.body)
+        self.assertEqual(self.parts(session_id), [])
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 400)
+
+        self.auth(self.students[1].user)
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').status_code, 404)
+
+    def test_resent_chunk_replaces_its_file(self):
+        session_id = self.start()
+        for _ in range(3):
+            self.assertEqual(self.put(session_id, 2, self.body[20000:]).status_code, 200)
+        chunk = UploadChunk.objects.get()
+        self.assertEqual(self.parts(session_id), [os.path.basename(chunk.path)])
+
+    def test_chunk_racing_finalize_is_discarded(self):
+        session_id = self.start(size=5)
+        self.put(session_id, 0, b'hello')
+        session = UploadSession.objects.get(pk=session_id)
+        # Claimed by finalize after the PUT loaded the session
+        UploadSession.objects.filter(pk=session_id).update(status='assembling')
+        with self.assertRaisesMessage(ValueError, 'no longer accepting chunks'):
+            write_chunk(session, 0, io.BytesIO(b'world'), 5, hashlib.sha256(b'world').hexdigest())
+        chunk = UploadChunk.objects.get()
+        self.assertEqual(chunk.sha256, hashlib.sha256(b'hello').hexdigest())
+        self.assertEqual(self.parts(session_id), [os.path.basename(chunk.path)])
+
+    def test_targets_and_purge(self):
+        response = self.client.post('/api/uploads/', {
+            'target': 'assignment', 'assignment': self.assignment.id, 'filename': 'brief.pdf', 'size': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.auth(self.teacher)
+        session_id = self.start(target='assignment', filename='brief.pdf', size=5)
+        self.put(session_id, 0, b'hello')
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 200)
+        self.assignment.refresh_from_db()
+        self.assertEqual(self.assignment.file.read(), b'hello')
+
+        session_id = self.start(target='assignment', filename='notes.pdf', size=5)
+        self.put(session_id, 0, b'hello')
+        UploadSession.objects.filter(pk=session_id).update(expires_at=timezone.now())
+        call_command('purge_uploads', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.filter(pk=session_id).exists())
+        self.assertEqual(self.parts(session_id), [])
+
+
+class SparseFieldsTests(SchoolTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        science = Subject.objects.create(name='Science', teacher=cls.teacher)
+        for i, profile in enumerate(cls.students):
+            profile.subjects.add(science)
+            Marks.objects.create(student=profile, subject=cls.subject, marks=50 + i)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data, [query['sql'] for query in queries]
+
+    def test_default_representation(self):
+        self.auth(self.admin)
+        full, _ = self.get('/api/student-profiles/')
+        self.assertEqual(set(full[0]), {
+            'id', 'user_details', 'username', 'email', 'education_level', 'grade', 'grade_display',
+            'subjects', 'subject_details',
+        })
+        # An empty fields param changes nothing
+        for query in ('fields=', 'fields=,'):
+            self.assertEqual(self.get(f'/api/student-profiles/?{query}')[0], full, query)
+
+    def test_fields(self):
+        self.auth(self.admin)
+        data, queries = self.get('/api/student-profiles/?fields=id,grade_display')
+        self.assertEqual(data[0], {'id': self.students[0].id, 'grade_display': 'Grade 5'})
+        # Two columns, no related rows (the join filters out deleted users)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith(
+            'SELECT "student_studentprofile"."id", "student_studentprofile"."grade" FROM'
+        ), queries[0])
+
+        data, queries = self.get('/api/student-profiles/?fields=id,subject_details.name,user_details.username')
+        self.assertEqual(data[0], {
+            'id': self.students[0].id,
+            'user_details': {'username': 'student0'},
+            'subject_details': [{'name': 'Math'}, {'name': 'Science'}],
+        })
+        # Profiles joined to their users, then the subjects prefetched
+        self.assertEqual(len(queries), 2)
+
+    def test_expand(self):
+        self.auth(self.admin)
+        data, _ = self.get('/api/student-profiles/?expand=')
+        self.assertNotIn('user_details', data[0])
+        self.assertNotIn('subject_details', data[0])
+        # The compact subjects, without their expandable teacher_name
+        data, _ = self.get('/api/student-profiles/?expand=subject_details.name')
+        self.assertEqual([set(subject) for subject in data[0]['subject_details']], [{'id', 'name', 'teacher'}] * 2)
+        self.assertNotIn('user_details', data[0])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.auth(self.teacher)
+        _, before = self.get('/api/marks/?expand=student_name')
+        for i in range(5):
+            user = User.objects.create_user(f'pupil{i}', password='pw', role='student')
+            profile = StudentProfile.objects.create(user=user, grade='5')
+            Marks.objects.create(student=profile, subject=self.subject, marks=40)
+        data, after = self.get('/api/marks/?expand=student_name')
+        self.assertEqual(len(data), 10)
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(data[0]['student_name'], 'student0')
+
+    def test_unknown_fields(self):
+        self.auth(self.admin)
+        for query in ('fields=bogus', 'fields=grade.name', 'expand=user_details.bogus'):
+            response = self.client.get(f'/api/student-profiles/?{query}')
+            self.assertEqual(response.status_code, 400, query)
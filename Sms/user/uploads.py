@@ -0,0 +1,252 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from student.models import StudentProfile, StudentSubmission
+from user.models import UploadChunk, UploadSession
+from user.sqlite import immediate_atomic, retry_when_locked
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def uploads_config():
+    config = {
+        'CHUNK_SIZE': 5 * 1024 * 1024,
+        'MAX_CHUNK_SIZE': 64 * 1024 * 1024,
+        'MAX_FILE_SIZE': 2 * 1024 * 1024 * 1024,
+        'SESSION_TTL': 24 * 60 * 60,
+    }
+    config.update(getattr(settings, 'CHUNKED_UPLOADS', {}))
+    return config
+
+
+def check_upload_target(user, target, assignment):
+    """
+    Raise PermissionError unless `user` may attach a file to `assignment`:
+    students submit to published assignments of their subjects, teachers
+    replace the file of assignments they created, admins either.
+    """
+    if target == 'submission':
+        enrolled = StudentProfile.objects.filter(user=user, subjects=assignment.subject_id).exists()
+        if user.role != 'student' or not enrolled or not assignment.published:
+            raise PermissionError("You can only submit to published assignments of your subjects")
+    elif target == 'assignment':
+        if user.role != 'admin' and not (user.role == 'teacher' and assignment.created_by_id == user.id):
+            raise PermissionError("You can only upload files to assignments that you created")
+    else:
+        raise ValueError(f"Unknown upload target '{target}'")
+
+
+def create_session(user, target, assignment, filename, size, chunk_size=None, sha256=''):
+    """Validate and open an upload session. Raises ValueError or PermissionError."""
+    config = uploads_config()
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    if size <= 0:
+        raise ValueError("size must be a positive number of bytes")
+    if size > config['MAX_FILE_SIZE']:
+        raise ValueError(f"Files are limited to {config['MAX_FILE_SIZE']} bytes")
+    if not 0 < chunk_size <= config['MAX_CHUNK_SIZE']:
+        raise ValueError(f"chunk_size must be between 1 and {config['MAX_CHUNK_SIZE']} bytes")
+    filename = os.path.basename(str(filename or '').replace('\\', '/')).strip()
+    if not filename:
+        raise ValueError("filename is required")
+    check_upload_target(user, target, assignment)
+
+    return UploadSession.objects.create(
+        owner=user,
+        target=target,
+        assignment=assignment,
+        filename=filename[:255],
+        size=size,
+        chunk_size=chunk_size,
+        sha256=(sha256 or '').lower(),
+        expires_at=timezone.now() + timedelta(seconds=config['SESSION_TTL']),
+    )
+
+
+def missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.total_chunks) if index not in received]
+
+
+def _chunk_name(session, index):
+    return f'uploads/{session.pk}/{index}.part'
+
+
+class StreamedChunk(File):
+    """
+    Hand the first `length` bytes of a request body to a storage backend
+    block by block, hashing them on the way, so a chunk is never held in
+    memory or spooled to a temporary file.
+    """
+
+    def __init__(self, stream, length, name):
+        super().__init__(None, name)
+        self.stream = stream
+        self.length = length
+        self.received = 0
+        self.digest = hashlib.sha256()
+
+    @property
+    def size(self):
+        return self.length
+
+    def chunks(self, chunk_size=None):
+        remaining = self.length - self.received
+        while remaining > 0:
+            block = self.stream.read(min(chunk_size or READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            self.digest.update(block)
+            self.received += len(block)
+            remaining -= len(block)
+            yield block
+
+    def __iter__(self):
+        return self.chunks()
+
+
+def write_chunk(session, index, stream, length, sha256):
+    """
+    Store chunk `index` of `session` from `stream`, replacing any earlier
+    copy. The chunk must have its expected length and match `sha256` (hex);
+    otherwise it is discarded and ValueError is raised.
+    """
+    if session.status != 'open':
+        raise ValueError("This upload is no longer accepting chunks")
+    if not 0 <= index < session.total_chunks:
+        raise ValueError(f"Chunk index must be between 0 and {session.total_chunks - 1}")
+    expected = session.chunk_length(index)
+    if length != expected:
+        raise ValueError(f"Chunk {index} must be exactly {expected} bytes")
+    if not sha256:
+        raise ValueError("The chunk's SHA-256 checksum is required")
+
+    content = StreamedChunk(stream, length, _chunk_name(session, index))
+    path = default_storage.save(content.name, content)
+    if content.received != length or content.digest.hexdigest() != sha256.lower():
+        default_storage.delete(path)
+        raise ValueError(f"Chunk {index} was incomplete or did not match its checksum")
+
+    try:
+        replaced = _record_chunk(session, index, length, sha256.lower(), path)
+    except BaseException:
+        default_storage.delete(path)
+        raise
+    if replaced is not None and replaced != path:
+        default_storage.delete(replaced)
+
+
+@retry_when_locked
+def _record_chunk(session, index, length, sha256, path):
+    """
+    Point chunk `index` of `session` at the stored file `path` and return
+    the path it replaces, if any. Each PUT stores its own file, so the rows
+    of concurrent PUTs of one chunk are swapped one at a time under the
+    session's row lock (SQLite's write lock), which finalize_session also
+    waits for: every replaced file is deleted exactly once, and no chunk is
+    recorded once the session is being assembled.
+    """
+    with immediate_atomic():
+        if not UploadSession.objects.select_for_update().filter(pk=session.pk, status='open').exists():
+            raise ValueError("This upload is no longer accepting chunks")
+        previous = UploadChunk.objects.filter(session=session, index=index).first()
+        if previous is None:
+            UploadChunk.objects.create(session=session, index=index, size=length, sha256=sha256, path=path)
+            return None
+        previous.size, previous.sha256, previous.path, replaced = length, sha256, path, previous.path
+        previous.save(update_fields=['size', 'sha256', 'path', 'received_at'])
+        return replaced
+
+
+class AssembledFile(File):
+    """The chunks of a session read back in order, hashed as they stream by"""
+
+    def __init__(self, paths, name, size):
+        super().__init__(None, name)
+        self.paths = paths
+        self._size = size
+        self.digest = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        for path in self.paths:
+            with default_storage.open(path, 'rb') as part:
+                while block := part.read(chunk_size or READ_BLOCK_SIZE):
+                    self.digest.update(block)
+                    yield block
+
+    def __iter__(self):
+        return self.chunks()
+
+
+def _attach(session, content):
+    """Save the assembled file onto the session's submission or assignment"""
+    assignment = session.assignment
+    check_upload_target(session.owner, session.target, assignment)
+    if session.target == 'submission':
+        profile = StudentProfile.objects.get(user=session.owner)
+        instance = (
+            StudentSubmission.objects.filter(assignment=assignment, student=profile).first()
+            or StudentSubmission(assignment=assignment, student=profile)
+        )
+    else:
+        instance = assignment
+    instance.file.save(session.filename, content, save=False)
+    return instance
+
+
+@retry_when_locked
+def finalize_session(session):
+    """
+    Assemble the received chunks into the target's file field, hashing the
+    whole file as it is copied; chunks are read back one block at a time.
+    Returns the saved StudentSubmission or Assignment.
+    """
+    claimed = UploadSession.objects.filter(pk=session.pk, status='open').update(status='assembling')
+    if not claimed:
+        raise ValueError("This upload has already been finalized")
+    try:
+        missing = missing_chunks(session)
+        if missing:
+            raise ValueError(f"Missing chunks: {missing}")
+        paths = list(session.chunks.order_by('index').values_list('path', flat=True))
+        content = AssembledFile(paths, session.filename, session.size)
+
+        with immediate_atomic():
+            instance = _attach(session, content)
+            digest = content.digest.hexdigest()
+            if session.sha256 and digest != session.sha256:
+                instance.file.storage.delete(instance.file.name)
+                raise ValueError("The assembled file does not match its checksum")
+            instance.save()
+            UploadSession.objects.filter(pk=session.pk).update(status='complete', sha256=digest)
+    except BaseException:
+        UploadSession.objects.filter(pk=session.pk).update(status='open')
+        raise
+
+    discard_chunks(session)
+    session.status = 'complete'
+    session.sha256 = digest
+    return instance
+
+
+def discard_chunks(session):
+    for path in session.chunks.values_list('path', flat=True):
+        default_storage.delete(path)
+    session.chunks.all().delete()
+
+
+def purge_expired_sessions(now=None):
+    """Delete open sessions past their expiry along with their chunks"""
+    expired = UploadSession.objects.filter(status='open', expires_at__lt=now or timezone.now())
+    count = 0
+    for session in expired.iterator():
+        discard_chunks(session)
+        session.delete()
+        count += 1
+    return count
@@ -1,12 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, CustomTokenObtainPairView ,NoticeViewSet
+from .views import UserViewSet, CustomTokenObtainPairView ,NoticeViewSet, AuditEventViewSet, JobViewSet, UploadSessionViewSet, event_stream, event_stream_token, request_metrics
 
 router = DefaultRouter()
 router.register(r'user', UserViewSet)
 router.register(r'notice', NoticeViewSet)
+router.register(r'audit-events', AuditEventViewSet)
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
+router.register(r'jobs', JobViewSet, basename='job')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('metrics/', request_metrics, name='request_metrics'),
+    path('events/', event_stream, name='event_stream'),
+    path('events/token/', event_stream_token, name='event_stream_token'),
 ]
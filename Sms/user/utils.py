@@ -2,9 +2,43 @@
 #     """Capitalize the first letter of the username."""
 #     return username.capitalize()
 
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+from .audit import record_event
+
+
 def log_action(user, action, details=None):
-    """Log actions performed by users (simplified)."""
-    msg = f"[ACTION LOG] {user.username} performed {action}"
-    if details:
-        msg += f" | Details: {details}"
-    print(msg)
+    """Record an action performed by a user in the audit log."""
+    record_event(user, action, details)
+
+
+def served_by_asgi(request):
+    """Whether a Django or DRF request is being served by the ASGI handler"""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def iterate_in_thread(iterator):
+    """
+    Pull a blocking iterator one item at a time from a worker thread.
+
+    Under ASGI a StreamingHttpResponse built on a sync iterator is consumed
+    whole before anything is sent; wrapping it keeps large downloads flat.
+    The iterator must not touch the database.
+    """
+    sentinel = object()
+    while (item := await sync_to_async(next, thread_sensitive=False)(iterator, sentinel)) is not sentinel:
+        yield item
+
+
+def setup_worker_process():
+    """
+    Process pool initializer that configures Django in a spawned worker.
+
+    Kept here, clear of model imports, because the worker has to import the
+    initializer's module before Django is set up.
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
@@ -1,32 +1,150 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
 from student.serializers import StudentProfileSerializer
-from rest_framework import viewsets, permissions, status
+from rest_framework import mixins, viewsets, permissions, status
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
-from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework_simplejwt.views import TokenObtainPairView
-from .models import User, notice
-from .serializers import NoticeSerializer, UserSerializer, CustomTokenObtainPairSerializer
+from .models import ArchivedUser, AuditEvent, Job, UploadSession, User, notice
+from .archive import restore_archived_user
+from .serializers import AuditEventSerializer, JobSerializer, NoticeSerializer, UploadSessionSerializer, UserSerializer, CustomTokenObtainPairSerializer
 from .permissions import IsAdmin, IsTeacherOrAdmin
 from student.models import Subject, StudentProfile
-from .utils import log_action
+from .utils import log_action, served_by_asgi
+from .provisioning import provision_users, read_users_csv
+from .uploads import create_session, discard_chunks, finalize_session, write_chunk
+from .middleware import view_latency
+from .mixins import AsyncReadMixin, CachedListMixin, ConditionalGetMixin, SparseFieldsMixin
+from .renderers import FastJSONParser
+from .authentication import CachedJWTAuthentication
+from .storage import file_response
+from django.core.files.storage import default_storage
+from .events import StreamToken, events_config, get_broker, subscription_topics
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from user import models
 from django.db.models import Q 
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def request_metrics(request):
+    """Per-view latency histograms collected by RequestTimingMiddleware"""
+    return Response(view_latency.snapshot())
+
+async def event_stream(request):
+    """
+    Server-Sent Events for the signed-in user: notice, assignment and result
+    deltas scoped by user.events.subscription_topics. Needs the ASGI server.
+
+    Authenticate with the usual Bearer header or, since EventSource cannot
+    set headers, a stream token from event_stream_token in `?token=`; access
+    tokens are refused there. The stream ends when the access token expires;
+    the client reconnects with a fresh token and Last-Event-ID to replay what
+    it missed.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event streams are only served by the ASGI application"}, status=501)
+
+    authenticator = CachedJWTAuthentication()
+    try:
+        stream_token = request.GET.get('token')
+        if stream_token:
+            validated_token = StreamToken(stream_token)
+            expires_at = validated_token['session_exp']
+        else:
+            header = authenticator.get_header(request)
+            raw_token = header and authenticator.get_raw_token(header)
+            if not raw_token:
+                return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+            validated_token = authenticator.get_validated_token(raw_token)
+            expires_at = validated_token['exp']
+        user = await authenticator.aget_user(validated_token)
+    except TokenError as exc:
+        return JsonResponse({"detail": str(exc), "code": "token_not_valid"}, status=401)
+    except (AuthenticationFailed, InvalidToken) as exc:
+        detail = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+        return JsonResponse(detail, status=401)
+
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        last_event_id = None
+
+    broker = get_broker()
+    heartbeat = events_config()['HEARTBEAT']
+    topics = await sync_to_async(subscription_topics)(user)
+    # Subscribe before replaying so nothing published in between is lost
+    subscription = broker.subscribe(topics)
+    try:
+        backlog = []
+        if last_event_id is not None:
+            backlog = await sync_to_async(broker.replay)(subscription.topics, last_event_id)
+    except BaseException:
+        broker.unsubscribe(subscription)
+        raise
+
+    async def stream():
+        replayed_through = backlog[-1].id if backlog else 0
+        try:
+            yield 'retry: 3000\n\n'
+            for event in backlog:
+                yield event.encode()
+            while True:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await subscription.get(min(heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    break
+                if event.id > replayed_through:
+                    yield event.encode()
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def event_stream_token(request):
+    """A short-lived token for opening the event stream with `?token=`"""
+    if not isinstance(request.auth, AccessToken):
+        return Response({"error": "Sign in with an access token to open event streams"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    token = StreamToken.for_access_token(request.user, request.auth)
+    return Response({"token": str(token), "expires_in": events_config()['STREAM_TOKEN_LIFETIME']})
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 @method_decorator(csrf_exempt, name='dispatch')
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
     def get_permissions(self):
-        if self.action == 'create' and User.objects.count() == 0:
+        if self.action == 'create' and not User.objects.exists():
             return [permissions.AllowAny()]
-        if self.action == 'create':
+        if self.action in ['create', 'bulk_provision']:
             return [IsAdmin()]
         if self.action == 'destroy':
             # Allow delete only if admin or teacher
@@ -41,7 +159,7 @@ class UserViewSet(viewsets.ModelViewSet):
             return User.objects.none()
             
         # By default, only show non-deleted users
-        queryset = User.objects.filter(is_deleted=False)
+        queryset = User.active.all()
             
         if user.role == 'admin':
             return queryset
@@ -139,12 +257,8 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Create the teacher user
+            # Create the teacher user; UserSerializer.create assigns the subjects
             self.perform_create(serializer)
-            teacher = serializer.instance
-
-            # Assign subjects to the teacher
-            Subject.objects.filter(id__in=subject_ids).update(teacher=teacher)
 
             log_action(request.user, "Successfully created teacher", f"Assigned subjects: {subject_ids}")
             headers = self.get_success_headers(serializer.data)
@@ -156,6 +270,35 @@ class UserViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=False, methods=['post'], url_path='bulk-create',
+            parser_classes=[FastJSONParser, MultiPartParser, FormParser])
+    def bulk_provision(self, request):
+        """Create many users at once from a JSON list or an uploaded CSV"""
+        upload = request.FILES.get('file')
+        if upload:
+            try:
+                rows = read_users_csv(upload)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            rows = request.data.get('users') if isinstance(request.data, dict) else request.data
+
+        if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+            return Response(
+                {"error": "Provide a non-empty 'users' list or a CSV file"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = provision_users(rows)
+        created = sum(1 for result in results if result['status'] == 'created')
+        log_action(request.user, "Bulk created users", f"{created} of {len(rows)} rows")
+        return Response({
+            "message": f"Created {created} users, {len(rows) - created} rows failed",
+            "created": created,
+            "failed": len(rows) - created,
+            "results": results,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
     @action(detail=True, methods=['patch'], url_path='change-username')
     def change_username(self, request, pk=None):
         requesting_user = request.user
@@ -201,9 +344,8 @@ class UserViewSet(viewsets.ModelViewSet):
         else:
             raise PermissionDenied("You do not have permission to delete users.")
 
-        # Perform soft delete (set is_deleted=True)
-        target_user.is_deleted = True
-        target_user.save()
+        # Perform soft delete (User.delete sets is_deleted and deleted_at)
+        target_user.delete()
         
         return Response(
             {"message": f"User {target_user.username} has been successfully deleted."},
@@ -228,16 +370,22 @@ class UserViewSet(viewsets.ModelViewSet):
                 )
                 
             user_to_restore.restore()  # This calls our custom restore method
-            
-            return Response(
-                {"message": f"User {user_to_restore.username} has been successfully restored."},
-                status=status.HTTP_200_OK
-            )
         except User.DoesNotExist:
-            return Response(
-                {"error": "User not found."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+            # Users deleted long ago have been moved to the archive
+            try:
+                user_to_restore = restore_archived_user(pk)
+            except ArchivedUser.DoesNotExist:
+                return Response(
+                    {"error": "User not found."},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {"message": f"User {user_to_restore.username} has been successfully restored."},
+            status=status.HTTP_200_OK
+        )
                 
     @action(detail=False, methods=['get'], url_path='deleted')
     def deleted_users(self, request):
@@ -245,7 +393,7 @@ class UserViewSet(viewsets.ModelViewSet):
             if request.user.role != 'admin':
                 raise PermissionDenied("Only administrators can view deleted users.")
                 
-            deleted_users = User.objects.filter(is_deleted=True)
+            deleted_users = User.objects.filter(is_deleted=True).order_by('-deleted_at')
             serializer = self.get_serializer(deleted_users, many=True)
             
             return Response(serializer.data)
@@ -336,9 +484,18 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 @method_decorator(csrf_exempt, name='dispatch')
-class NoticeViewSet(viewsets.ModelViewSet):
+class NoticeViewSet(ConditionalGetMixin, CachedListMixin, SparseFieldsMixin, AsyncReadMixin, viewsets.ModelViewSet):
     queryset = notice.objects.all()
     serializer_class = NoticeSerializer
+    pagination_ordering = ('-created_at', 'id')
+    cache_namespace = 'notice'
+
+    def get_cache_scope(self):
+        user = self.request.user
+        # Teachers also see the notices they wrote
+        if user.role == 'teacher':
+            return f'teacher:{user.id}'
+        return user.role
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -355,7 +512,7 @@ class NoticeViewSet(viewsets.ModelViewSet):
             return notice.objects.filter(
                 Q(audience__in=['teacher', 'both'], published=True) |
                 Q(created_by=user)
-            ).distinct()
+            )
         # Admin can see all notices
         return notice.objects.all()
         
@@ -371,3 +528,142 @@ class NoticeViewSet(viewsets.ModelViewSet):
             if audience != 'student':
                 raise serializer.ValidationError("Teachers can only create notices for students.")
             serializer.save(created_by=user)
+
+
+class AuditEventViewSet(SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """Audit trail written by log_action, filterable by actor, action and time range (admin only)"""
+    queryset = AuditEvent.objects.all()
+    serializer_class = AuditEventSerializer
+    permission_classes = [IsAdmin]
+    pagination_ordering = ('-created_at', 'id')
+
+    def get_queryset(self):
+        queryset = AuditEvent.objects.all()
+        params = self.request.query_params
+
+        actor = params.get('actor')
+        if actor:
+            if actor.isdigit():
+                queryset = queryset.filter(actor_id=actor)
+            else:
+                queryset = queryset.filter(actor_username=actor)
+
+        action_text = params.get('action')
+        if action_text:
+            queryset = queryset.filter(action__icontains=action_text)
+
+        for param, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            value = params.get(param)
+            if value:
+                try:
+                    # None when malformed; ValueError for impossible dates like Feb 30
+                    moment = parse_datetime(value)
+                except ValueError:
+                    moment = None
+                if moment is None:
+                    raise ValidationError({param: "Expected an ISO 8601 datetime."})
+                queryset = queryset.filter(**{lookup: moment})
+        return queryset
+
+
+class JobViewSet(SparseFieldsMixin, viewsets.ReadOnlyModelViewSet):
+    """Status of background jobs; users see the jobs they started, admins see all"""
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', 'id')
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Job.objects.all()
+        if user.role != 'admin':
+            queryset = queryset.filter(created_by=user)
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """The file a finished export job produced"""
+        job = self.get_object()
+        name = job.result.get('file') if isinstance(job.result, dict) else None
+        if job.status != 'succeeded' or not name:
+            return Response({"error": "This job has no file to download"}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(request, default_storage, name, asynchronous=served_by_asgi(request))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable uploads for submission and assignment files.
+
+    POST a session (target, assignment, filename, size, optional chunk_size
+    and sha256), PUT each chunk's raw bytes to chunks/<index>/ with its hex
+    digest in X-Chunk-SHA256, GET the session to see which chunks are still
+    missing after an interruption, then POST finalize/ to assemble the file.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            session = create_session(
+                request.user, data['target'], data['assignment'], data['filename'],
+                data['size'], data.get('chunk_size'), data.get('sha256'),
+            )
+        except PermissionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        log_action(request.user, "Started upload", f"{session.filename} ({session.size} bytes)")
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        """Store one chunk, streamed from the request body to storage"""
+        session = self.get_object()
+        if session.expires_at <= timezone.now():
+            return Response({"error": "This upload has expired"}, status=status.HTTP_410_GONE)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return Response({"error": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+        try:
+            write_chunk(session, int(index), request.stream, length, request.headers.get('X-Chunk-SHA256', ''))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Assemble the chunks into the target's file"""
+        from student.serializers import StudentSubmissionSerializer
+        from teacher.serializers import AssignmentSerializer
+
+        session = self.get_object()
+        try:
+            instance = finalize_session(session)
+        except PermissionError as e:
+            return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        log_action(request.user, "Finished upload", f"{session.filename} ({session.size} bytes)")
+        serializer_class = StudentSubmissionSerializer if session.target == 'submission' else AssignmentSerializer
+        return Response({
+            "upload": self.get_serializer(session).data,
+            session.target: serializer_class(instance, context=self.get_serializer_context()).data,
+        })
+
+    def perform_destroy(self, instance):
+        # Abort: drop the chunks received so far
+        discard_chunks(instance)
+        instance.delete()